@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # модуля resource нет в Windows, тогда пиковый объем памяти процесса не замеряется
+    resource = None
+
+from wordfreq import top_n_list
+
+import learn_new_words as lnw
+from learn_new_words import SessionEngine
+
+# примерный объем одной страницы книги в словах
+words_per_page = 300
+# сколько слов-кандидатов используется для замеров find_sent, get_lemma и translate_options
+sample_size = 200
+
+# функции, для которых считается число вызовов во время каждого замера
+counted_functions = [
+    "iter_pages", "get_sentence_spans", "tag_sentence", "zipf_scores", "lemmatize", "lemmatize_word",
+    "find_sent", "find_examples", "get_lemma", "fetch_translations", "translate_options"
+]
+
+def synthetic_pages(num_pages, seed=0):
+    """Сгенерировать num_pages страниц текста из частотных английских слов.
+
+    Слова выбираются из списка wordfreq с весами по закону Ципфа, поэтому в тексте есть и очень частотные,
+    и редкие слова, как в настоящей книге. Результат воспроизводим при одинаковом seed.
+    """
+    vocabulary = top_n_list(lnw.src_lang, 200000)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(num_pages):
+        words = rng.choices(vocabulary, weights, k=words_per_page)
+        sentences = []
+        start = 0
+        while start < len(words):
+            length = rng.randint(6, 25)
+            sentence = " ".join(words[start:start + length])
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            start += length
+        pages.append(" ".join(sentences))
+    return pages
+
+def gutenberg_pages(num_pages):
+    """Составить num_pages страниц из книг корпуса Gutenberg (общественное достояние), входящего в nltk_data.
+
+    Если текста не хватает, книги повторяются по кругу.
+    """
+    from nltk.corpus import gutenberg
+
+    words = []
+    for file_id in gutenberg.fileids():
+        words.extend(gutenberg.raw(file_id).split())
+    pages = []
+    for page_num in range(num_pages):
+        start = page_num * words_per_page % len(words)
+        page_words = (words[start:] + words)[:words_per_page]
+        pages.append(" ".join(page_words))
+    return pages
+
+corpora = {
+    "synthetic": synthetic_pages,
+    "gutenberg": gutenberg_pages
+}
+
+def count_calls(calls):
+    """Подменить функции из counted_functions в модуле learn_new_words обертками, которые считают вызовы.
+
+    calls - словарь, куда записывается число вызовов каждой функции.
+    Функция возвращает словарь исходных функций, чтобы их можно было вернуть на место.
+    """
+    originals = {}
+    for name in counted_functions:
+        original = getattr(lnw, name)
+        originals[name] = original
+
+        def wrapper(*args, _name=name, _original=original, **kwargs):
+            calls[_name] = calls.get(_name, 0) + 1
+            return _original(*args, **kwargs)
+
+        setattr(lnw, name, wrapper)
+    return originals
+
+def peak_rss_mb():
+    """Пиковый объем памяти процесса (ru_maxrss) в МБ или None, если его нельзя узнать."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # в macOS ru_maxrss в байтах, в Linux - в килобайтах
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def deep_size(obj, seen=None):
+    """Сколько байт занимает объект вместе со всем, на что он ссылается: строки, списки, словари, массивы.
+
+    Каждый объект считается один раз, даже если на него ссылаются из нескольких мест.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    # массив numpy, который ссылается на чужие данные (например, после reshape), не учитывает их в getsizeof
+    if getattr(obj, "base", None) is not None and hasattr(obj, "nbytes"):
+        size += obj.nbytes
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+def measure(stage, function, *args, trace_memory=False):
+    """Выполнить function(*args) и замерить время, память и число вызовов функций learn_new_words.
+
+    Функция возвращает кортеж (результат, словарь с замерами):
+    seconds - время выполнения,
+    peak_rss_mb - пиковый объем памяти процесса после этапа (ru_maxrss),
+    rss_growth_mb - на сколько этот пик вырос за время этапа (0, если этап не превысил прежний пик),
+    peak_traced_mb - пиковый объем памяти, выделенной на этом этапе (по tracemalloc, только если trace_memory),
+    calls - число вызовов функций из counted_functions.
+    Функции learn_new_words нужно вызывать внутри function через модуль (lnw.имя), иначе вызов не будет посчитан.
+    """
+    calls = {}
+    originals = count_calls(calls)
+    if trace_memory:
+        tracemalloc.start()
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        result = function(*args)
+    finally:
+        seconds = time.perf_counter() - started
+        for name, original in originals.items():
+            setattr(lnw, name, original)
+
+    stats = {
+        "stage": stage,
+        "seconds": seconds,
+        "calls": calls
+    }
+    if rss_before is not None:
+        stats["peak_rss_mb"] = peak_rss_mb()
+        stats["rss_growth_mb"] = stats["peak_rss_mb"] - rss_before
+    if trace_memory:
+        stats["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result, stats
+
+def run_size(pages, workdir, trace_memory=False):
+    """Прогнать весь конвейер learn_new_words на тексте из pages и вернуть список замеров по этапам."""
+    address = os.path.join(workdir, f"corpus_{len(pages)}.txt")
+    with open(address, "w", encoding="utf-8") as file:
+        file.write("\f".join(pages))
+
+    # кэши процесса очищаются, чтобы размеры текста не влияли друг на друга
+    lnw.tag_sentence.cache_clear()
+    lnw.lemmatize_word.cache_clear()
+    lnw.translation_cache = None
+    lnw.translation_cache_path = os.path.join(workdir, f"translations_{len(pages)}.db")
+
+    results = []
+
+    def get_text():
+        return "".join(lnw.iter_pages(address))
+
+    text, stats = measure("get_text", get_text, trace_memory=trace_memory)
+    results.append(stats)
+
+    def get_spans():
+        return lnw.get_sentence_spans(text)
+
+    spans, stats = measure("get_sentence_spans", get_spans, trace_memory=trace_memory)
+    # для сравнения: сколько занимали бы те же предложения в виде отдельных строк
+    stats["strings_mb"] = sum(sys.getsizeof(text[start:end]) for start, end in spans) / 2 ** 20
+    results.append(stats)
+
+    # tag_sentence передается явно: значение по умолчанию tagger=tag_sentence связано с исходной функцией,
+    # и обертка, которая считает вызовы, иначе не вызывалась бы
+    def analyze():
+        return lnw.analyze_pages(lnw.iter_pages(address), tagger=lnw.tag_sentence)
+
+    document, stats = measure("analyze_pages", analyze, trace_memory=trace_memory)
+    # весь документ и для сравнения его самые большие части
+    stats["document_mb"] = deep_size(document) / 2 ** 20
+    stats["text_mb"] = sys.getsizeof(document["text"]) / 2 ** 20
+    lengths = document["lengths"]
+    stats["offsets_mb"] = (document["offsets"].nbytes + len(lengths) * lengths.itemsize) / 2 ** 20
+    stats["postings_mb"] = deep_size([document["postings"], document["posting_starts"]]) / 2 ** 20
+    results.append(stats)
+
+    def get_word_set():
+        return lnw.get_word_set(document)
+
+    word_set, stats = measure("get_word_set", get_word_set, trace_memory=trace_memory)
+    results.append(stats)
+
+    sample = lnw.top_candidates(word_set, document, sample_size)
+
+    def find_all_sents():
+        return [lnw.find_sent(word, document) for word in sample]
+
+    def get_all_lemmas():
+        return [lnw.get_lemma(word, document) for word in sample]
+
+    _, stats = measure("find_sent", find_all_sents, trace_memory=trace_memory)
+    results.append(stats)
+
+    lemmas, stats = measure("get_lemma", get_all_lemmas, trace_memory=trace_memory)
+    results.append(stats)
+
+    queries = [lnw.translation_query(word, lemma) for word, lemma in zip(sample, lemmas) if lemma != "Not found"]
+
+    def translate_all():
+        return [lnw.translate_options(query) for query in queries]
+
+    _, stats = measure("translate_options", translate_all, trace_memory=trace_memory)
+    results.append(stats)
+
+    for stats in results:
+        stats["pages"] = len(pages)
+    return results
+
+def synthetic_words(num_rows, seed=0):
+    """Сгенерировать словарь new_words из num_rows слов в формате analyze: перевод (список вариантов) и пример."""
+    vocabulary = top_n_list(lnw.src_lang, 50000)
+    rng = random.Random(seed)
+    new_words = {}
+    for num in range(num_rows):
+        word = f"{vocabulary[num % len(vocabulary)]}{num // len(vocabulary) or ''}"
+        sentence = " ".join(rng.choices(vocabulary[:5000], k=rng.randint(6, 25)))
+        new_words[word] = [word.upper(), word.title()], sentence.capitalize() + "."
+    return new_words
+
+def write_docx_by_index(new_words, doc_name):
+    """Прежний способ записи docx для сравнения: таблица создается сразу, строки берутся по индексу table.rows[i]."""
+    word_document = lnw.Document()
+    table = word_document.add_table(len(new_words), 4)
+    for i, row in enumerate(lnw.iter_rows(new_words)):
+        cells = table.rows[i].cells
+        for cell, value in zip(cells, row):
+            cell.text = str(value)
+    word_document.save(doc_name)
+
+export_writers = {
+    "docx (rows by index)": write_docx_by_index,
+    "docx": lnw.write_docx,
+    "csv": lnw.write_csv,
+    "tsv": lnw.write_tsv,
+    "anki": lnw.write_anki
+}
+
+def run_export(sizes, workdir):
+    """Замерить время сохранения таблиц из sizes строк каждым способом из export_writers."""
+    print(f"{'rows':>8}{'format':>24}{'seconds':>12}{'rows/s':>14}")
+    for size in sizes:
+        new_words = synthetic_words(size)
+        for num, (name, writer) in enumerate(export_writers.items()):
+            file_name = os.path.join(workdir, f"export_{size}_{num}")
+            started = time.perf_counter()
+            writer(new_words, file_name)
+            seconds = time.perf_counter() - started
+            print(f"{size:>8}{name:>24}{seconds:>12.4f}{size / seconds:>14.0f}")
+
+def simulated_answer(session, rng, words_needed):
+    """Ответ студента-симулятора на текущий вопрос сессии; иногда он отвечает неверно, как настоящий студент."""
+    if session.state == "words_needed":
+        return str(words_needed)
+    if session.state == "known":
+        return rng.choices(["yes", "no", "0", "maybe"], [40, 50, 5, 5])[0]
+    if session.state == "correct_form":
+        return session.word
+    if session.state == "choose":
+        return rng.choices(["1", "1, 2", "0", "9"], [50, 30, 10, 10])[0]
+    if session.state == "confirm":
+        return rng.choice(["yes", "no"])
+    return "my translation"
+
+async def simulate_student(engine, num, address, words_needed, think_time, ramp_up, latencies):
+    """Провести один диалог от начала до конца и записать задержку каждого ответа движка в latencies.
+
+    Студент подключается в случайный момент в течение ramp_up секунд, а не одновременно со всеми.
+    """
+    rng = random.Random(num)
+    session_id = f"session {num}"
+    await asyncio.sleep(rng.uniform(0, ramp_up))
+    started = time.perf_counter()
+    await engine.open_session(session_id, address, student=f"student {num}")
+    latencies["open"].append(time.perf_counter() - started)
+    session = engine.sessions[session_id]
+    while not session.done:
+        await asyncio.sleep(rng.uniform(0, 2 * think_time))
+        started = time.perf_counter()
+        await engine.reply(session_id, simulated_answer(session, rng, words_needed))
+        latencies["reply"].append(time.perf_counter() - started)
+    return engine.close_session(session_id)
+
+async def simulate_class(num_students, address, words_needed, think_time, ramp_up, workers):
+    """Провести num_students диалогов одновременно в одном SessionEngine."""
+    latencies = {"open": [], "reply": []}
+    engine = SessionEngine(workers)
+    try:
+        results = await asyncio.gather(*(
+            simulate_student(engine, num, address, words_needed, think_time, ramp_up, latencies)
+            for num in range(num_students)
+        ))
+    finally:
+        engine.shutdown()
+    return results, latencies
+
+def percentile(values, share):
+    """Значение, меньше которого доля share значений values (метод ближайшего ранга)."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(share * len(values)) - 1))]
+
+def run_students(num_students, num_pages, words_needed, think_time, ramp_up, workers, workdir):
+    """Смоделировать num_students студентов, которые одновременно разбирают один текст, и вывести задержки ответов."""
+    address = os.path.join(workdir, f"class_{num_pages}.txt")
+    with open(address, "w", encoding="utf-8") as file:
+        file.write("\f".join(synthetic_pages(num_pages)))
+    lnw.known_words_path = os.path.join(workdir, "known_words.db")
+    lnw.translation_cache_path = os.path.join(workdir, "translations_students.db")
+    lnw.analysis_cache_path = os.path.join(workdir, "analysis_students.db")
+
+    started = time.perf_counter()
+    results, latencies = asyncio.run(simulate_class(num_students, address, words_needed, think_time, ramp_up, workers))
+    elapsed = time.perf_counter() - started
+
+    replies = latencies["reply"]
+    print(f"{num_students} students, {num_pages} pages, {words_needed} words each: "
+          f"{sum(map(len, results))} words saved, {len(replies)} answers in {elapsed:.2f} s "
+          f"({len(replies) / elapsed:.0f} answers/s)")
+    for name, values in latencies.items():
+        print(f"{name:<6} p50 {percentile(values, 0.5) * 1000:9.2f} ms   p99 {percentile(values, 0.99) * 1000:9.2f} ms   "
+              f"mean {statistics.mean(values) * 1000:9.2f} ms   max {max(values) * 1000:9.2f} ms")
+
+def slope(sizes, seconds):
+    """Оценить показатель степени роста времени по двум крайним точкам (1 - линейный рост, 2 - квадратичный)."""
+    if len(sizes) < 2 or seconds[0] <= 0 or seconds[-1] <= 0:
+        return float("nan")
+    return math.log(seconds[-1] / seconds[0]) / math.log(sizes[-1] / sizes[0])
+
+def print_report(results, previous=None):
+    """Вывести таблицу замеров, кривые роста по размерам текста и, если есть, сравнение с прошлым запуском."""
+    stages = list(dict.fromkeys(stats["stage"] for stats in results))
+    sizes = sorted({stats["pages"] for stats in results})
+    by_key = {(stats["stage"], stats["pages"]): stats for stats in results}
+    previous_by_key = {}
+    if previous:
+        previous_by_key = {(stats["stage"], stats["pages"]): stats for stats in previous}
+
+    print(f"\n{'stage':<20}{'pages':>7}{'seconds':>11}{'allocated, MB':>15}{'peak RSS, MB':>20}  calls")
+    for stage in stages:
+        for size in sizes:
+            stats = by_key[(stage, size)]
+            calls = ", ".join(f"{name} {count}" for name, count in stats["calls"].items())
+            # память этапа - пик выделенной на нем памяти по tracemalloc (только с флагом --memory)
+            allocated = f"{stats['peak_traced_mb']:.1f}" if "peak_traced_mb" in stats else "-"
+            # пик памяти процесса после этапа и его рост за время этапа
+            rss = f"{stats['peak_rss_mb']:.1f} (+{stats['rss_growth_mb']:.1f})" if "peak_rss_mb" in stats else "-"
+            line = f"{stage:<20}{size:>7}{stats['seconds']:>11.4f}{allocated:>15}{rss:>20}  {calls}"
+            if "strings_mb" in stats:
+                line += f" (sentences as strings {stats['strings_mb']:.1f} MB)"
+            if "document_mb" in stats:
+                line += (f" (document {stats['document_mb']:.1f} MB: text {stats['text_mb']:.1f} MB, "
+                         f"offsets {stats['offsets_mb']:.1f} MB, postings {stats['postings_mb']:.1f} MB)")
+            old = previous_by_key.get((stage, size))
+            if old and old["seconds"] > 0:
+                line += f" [x{stats['seconds'] / old['seconds']:.2f} vs previous run"
+                if "peak_rss_mb" in old and "peak_rss_mb" in stats:
+                    line += f", peak RSS {stats['peak_rss_mb'] - old['peak_rss_mb']:+.1f} MB"
+                line += "]"
+            print(line)
+
+    print("\nScaling (time per size, exponent: 1 - linear, 2 - quadratic):")
+    for stage in stages:
+        seconds = [by_key[(stage, size)]["seconds"] for size in sizes]
+        longest = max(seconds) or 1
+        print(f"{stage} (exponent {slope(sizes, seconds):.2f})")
+        for size, value in zip(sizes, seconds):
+            bar = "#" * max(1, round(40 * value / longest))
+            print(f"  {size:>6} pages | {bar} {value:.4f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the learn_new_words text pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="text sizes in pages")
+    parser.add_argument("--corpus", default="synthetic", choices=corpora, help="where to take the text from")
+    parser.add_argument("--memory", action="store_true", help="measure the peak memory allocated by each stage with tracemalloc (slower)")
+    parser.add_argument("--save", metavar="FILE", help="save the results to a json file")
+    parser.add_argument("--compare", metavar="FILE", help="compare with the results saved by a previous run")
+    parser.add_argument("--export", type=int, nargs="*", metavar="ROWS",
+                        help="only time saving tables of ROWS words in every format (default 100 1000 10000)")
+    parser.add_argument("--students", type=int, metavar="N",
+                        help="only simulate N students working with the chatbot at the same time")
+    parser.add_argument("--student-words", type=int, default=10, help="words each simulated student saves")
+    parser.add_argument("--think-time", type=float, default=0.05, help="average pause of a simulated student, s")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="time during which simulated students join, s")
+    parser.add_argument("--workers", type=int, help="processes for text analysis in the simulation")
+    args = parser.parse_args()
+
+    # переводчик без доступа к сети: каждое слово "переводится" в несколько вариантов
+    lnw.translation_backend = lambda words, src, dest: [(word.upper(), [word.upper(), word.title()]) for word in words]
+
+    if args.students:
+        with tempfile.TemporaryDirectory() as workdir:
+            run_students(args.students, args.sizes[-1], args.student_words, args.think_time, args.ramp_up, args.workers,
+                         workdir)
+        return
+
+    if args.export is not None:
+        with tempfile.TemporaryDirectory() as workdir:
+            run_export(args.export or [100, 1000, 10000], workdir)
+        return
+
+    lnw.prefetch_size = 0
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            print(f"Running the pipeline on {size} pages of {args.corpus} text...")
+            results.extend(run_size(corpora[args.corpus](size), workdir, args.memory))
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+    print_report(results, previous)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nThe results have been saved to {args.save}.")
+
+if __name__ == "__main__":
+    main()
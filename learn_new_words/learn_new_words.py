@@ -1,17 +1,80 @@
+import time
+
+# время начала импорта модуля, для отчета о запуске (см. startup_report)
+import_started = time.perf_counter()
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import heapq
+import importlib
+import json
+import os
 import random
-import tkinter.filedialog
+import sqlite3 as sq
+import threading
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice, repeat
+
+# время загрузки каждого тяжелого модуля и каждого шага разогрева: {название: (секунды, поток)}
+load_times = {}
+
+class LazyModule:
+    """Заместитель модуля или объекта из модуля, который импортируется только при первом обращении.
+    
+    name - имя модуля, attribute - имя объекта в модуле (например, класса), если нужен он, а не весь модуль.
+    Время импорта записывается в load_times.
+    """
+    
+    def __init__(self, name, attribute=None):
+        self._name = name
+        self._attribute = attribute
+        self._target = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    started = time.perf_counter()
+                    target = importlib.import_module(self._name)
+                    if self._attribute:
+                        target = getattr(target, self._attribute)
+                    label = f"{self._name}.{self._attribute}" if self._attribute else self._name
+                    load_times[label] = (time.perf_counter() - started, threading.current_thread().name)
+                    self._target = target
+        return self._target
+    
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+    
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
 
-import nltk
-from nltk.corpus import wordnet
-from nltk.stem import WordNetLemmatizer 
+nltk = LazyModule("nltk")
+np = LazyModule("numpy")
+wordnet = LazyModule("nltk.corpus", "wordnet")
+WordNetLemmatizer = LazyModule("nltk.stem", "WordNetLemmatizer")
+filedialog = LazyModule("tkinter.filedialog")
 
-from docx import Document
-from googletrans import Translator
-from pypdf import errors, PdfReader
-from wordfreq import zipf_frequency
+Document = LazyModule("docx", "Document")
+Translator = LazyModule("googletrans", "Translator")
+PdfReader = LazyModule("pypdf", "PdfReader")
+errors = LazyModule("pypdf.errors")
+docx_errors = LazyModule("docx.opc.exceptions")
+get_frequency_dict = LazyModule("wordfreq", "get_frequency_dict")
 
-lemmatizer = WordNetLemmatizer()
-translator = Translator()
+# лемматизатор и переводчик создаются при первом использовании (см. get_lemmatizer и get_translator)
+lemmatizer = None
+translator = None
+# поток, который загружает WordNet и модели nltk, пока пользователь выбирает файл (см. warm_up)
+warm_up_thread = None
+# за сколько секунд программа должна запускаться (см. startup_report)
+startup_target = 1.0
 
 # язык для токенизации в nltk
 language = "english"
@@ -19,10 +82,60 @@ language = "english"
 src_lang = "en"
 dest_lang = "ru"
 
-# верхняя и нижняя границы частотности слов выбираются в зависимости от уровня студента,
-# текущие значения подходят для студента уровня C1
-frq_lower = 1.5
-frq_upper = 2.7
+# файл с кэшем переводов, срок хранения перевода в секундах и максимальное число переводов в кэше
+translation_cache_path = "translations_cache.db"
+translation_ttl = 90 * 24 * 60 * 60
+translation_cache_size = 100000
+# сколько следующих слов переводится заранее, пока пользователь отвечает на вопрос о текущем
+prefetch_size = 5
+
+translation_cache = None
+translation_lock = threading.Lock()
+prefetch_executor = None
+pending_translations = {}
+
+# файл, где хранятся слова, которые студенты уже знают или учат
+known_words_path = "known_words.db"
+known_words_db = None
+
+# нижняя и верхняя границы частотности слов (по шкале Zipf) для студентов разных уровней
+level_profiles = {
+    "A2": (3.5, 4.5),
+    "B1": (3.0, 4.0),
+    "B2": (2.5, 3.5),
+    "C1": (1.5, 2.7),
+    "C2": (1.0, 2.0)
+}
+default_level = "C1"
+frequency_tables = {}
+
+# как выбирать пример употребления слова: first - первое предложение в тексте, 
+# shortest - самое короткое, best - предложение, длина которого ближе всего к example_length слов
+example_order = "first"
+example_length = 15
+
+# сколько страниц pdf извлекает один процесс за раз
+pages_per_chunk = 16
+# размер условной страницы для файлов docx (в абзацах) и txt (в строках)
+paragraphs_per_page = 40
+lines_per_page = 40
+
+# сколько лемм и размеченных предложений хранится в кэше процесса
+lemma_cache_size = 100000
+sentence_cache_size = 10000
+
+# файл с кэшем анализа документов и его максимальный размер в байтах (см. load_document)
+analysis_cache_path = "analysis_cache.db"
+analysis_cache_size = 200 * 2 ** 20
+analysis_cache = None
+# сколько байт занимают записи кэша анализа: считается при открытии кэша и растет при каждой записи (см. trim_analysis_cache)
+analysis_cache_total = 0
+# отпечаток настроек, для которых из кэша уже удалены устаревшие записи (см. invalidate_analysis_cache)
+analysis_cache_settings = None
+# номер версии формата анализа: его нужно увеличить, если меняется analyze_pages, чтобы старый кэш не использовался
+analysis_version = 5
+# версия устройства файла кэша анализа (PRAGMA user_version, см. get_analysis_cache)
+analysis_cache_schema = 1
 
 answer_options = [
     "Good!\n",
@@ -32,79 +145,746 @@ answer_options = [
     "Impressive!"
 ]
 
-def get_text():
-    """Извлечь текст из pdf файла.
+def count_pages(address):
+    """Узнать, сколько страниц в файле.
+    
+    Для pdf это число страниц документа, для docx и txt - число условных страниц (см. read_pages).
+    """
+    if address.lower().endswith('.pdf'):
+        with open(address, 'rb') as pdfFileObj:
+            return len(PdfReader(pdfFileObj).pages)
+    return len(read_pages(address))
+
+def extract_pdf_pages(address, start, end):
+    """Извлечь текст страниц с start по end (нумерация с 1) из pdf файла, результат - список строк.
+    
+    Функция открывает файл сама, поэтому ее можно запускать в отдельном процессе.
+    Переводы строк заменяются пробелами, а каждая страница заканчивается переводом строки,
+    чтобы последнее слово страницы не склеивалось с первым словом следующей.
+    """
+    with open(address, 'rb') as pdfFileObj:
+        pdfReader = PdfReader(pdfFileObj)
+        return [pdfReader.pages[i-1].extract_text().replace('\n', ' ') + '\n' for i in range(start, end+1)]
+
+def read_pages(address):
+    """Прочитать файл docx или txt и разделить его текст на условные страницы.
+    
+    В docx нет страниц, поэтому страница - это paragraphs_per_page абзацев подряд.
+    В txt страницы разделяются символом перевода страницы, а если его нет, 
+    страница - это lines_per_page строк подряд.
+    Каждая страница заканчивается переводом строки, поэтому страницы можно соединять без разделителя.
+    """
+    if address.lower().endswith('.docx'):
+        lines = [paragraph.text for paragraph in Document(address).paragraphs]
+        size = paragraphs_per_page
+    else:
+        with open(address, 'r', encoding='utf-8') as file:
+            text = file.read()
+        if '\f' in text:
+            return [page.replace('\n', ' ') + '\n' for page in text.split('\f')]
+        lines = text.split('\n')
+        size = lines_per_page
+    
+    return [" ".join(lines[i:i+size]) + '\n' for i in range(0, len(lines), size)]
+
+def iter_pages(address, start=1, end=None, workers=None):
+    """Постранично извлечь текст из файла pdf, docx или txt.
     
-    Пользователь выбирает файл и указывает, с каким диапазоном страниц работать. Текст извлекается из pdf и сохраняется
-    в переменную text.
+    Функция - генератор: страницы с start по end возвращаются по порядку по мере извлечения, 
+    поэтому анализ первых страниц начинается до того, как извлечена последняя.
+    Страницы pdf делятся на блоки по pages_per_chunk страниц, блоки извлекаются параллельно
+    в workers процессах (по умолчанию - по числу процессоров).
+    Если диапазон страниц неверный, возникает IndexError.
+    """
+    num_pages = count_pages(address)
+    if end is None:
+        end = num_pages
+    if not 1 <= start <= end <= num_pages:
+        raise IndexError(f"Page range {start}-{end} is out of 1-{num_pages}")
+    
+    if not address.lower().endswith('.pdf'):
+        yield from read_pages(address)[start-1:end]
+        return
+    
+    chunk_starts = range(start, end+1, pages_per_chunk)
+    chunk_ends = [min(chunk_start + pages_per_chunk - 1, end) for chunk_start in chunk_starts]
+    
+    # короткий диапазон извлекается в текущем процессе: запуск пула процессов обошелся бы дороже
+    if workers == 1 or len(chunk_starts) == 1:
+        for chunk_start, chunk_end in zip(chunk_starts, chunk_ends):
+            yield from extract_pdf_pages(address, chunk_start, chunk_end)
+        return
+    
+    with ProcessPoolExecutor(workers) as executor:
+        for pages in executor.map(extract_pdf_pages, repeat(address), chunk_starts, chunk_ends):
+            yield from pages
+
+def choose_file():
+    """Выбрать файл и диапазон страниц.
+    
+    Пользователь выбирает файл pdf, docx или txt и указывает, с каким диапазоном страниц работать.
+    Функция возвращает кортеж (address, start, end) или None, если файл не найден.
     """
     while True:
         try:
-            address = tkinter.filedialog.askopenfilename(title='Please choose a pdf file.')
-            pdfFileObj = open(address, 'rb') 
-            pdfReader = PdfReader(pdfFileObj)   
+            address = filedialog.askopenfilename(
+                title='Please choose a pdf, docx or txt file.',
+                filetypes=[('Documents', '*.pdf *.docx *.txt'), ('All files', '*.*')]
+            )
+            num_pages = count_pages(address)
 
-            print(f'This file contains {len(pdfReader.pages)} pages.')
+            print(f'This file contains {num_pages} pages.')
             num = input('How many would you like to process? Give me the start page and the end page like this: 1-40. ')
             hyphen = num.find('-')
             start = int(num[:hyphen])
             end = int(num[hyphen+1:])
-
-            text = ''
-            for i in range(start, end+1):
-                text += pdfReader.pages[i-1].extract_text()
-
-            text = text.replace('\n', '')
-            pdfFileObj.close()
+            if not 1 <= start <= end <= num_pages:
+                raise IndexError
             
-            return text
+            return address, start, end
 
         except FileNotFoundError:
             print("It seems like this file doesn't exist.")
             break
 
         except errors.PdfReadError:
-            print("It seems like this is not a pdf file. Please choose a pdf file.")
+            print("It seems like this pdf file is damaged. Please choose another file.")
+        
+        except docx_errors.PackageNotFoundError:
+            print("It seems like this is not a docx file or it is damaged. Please choose another file.")
+        
+        # UnicodeDecodeError - это тоже ValueError, поэтому он перехватывается раньше ошибок диапазона
+        except UnicodeDecodeError:
+            print("It seems like this is not a text file. Please choose a pdf, docx or txt file.")
             
-        except IndexError:
+        except (IndexError, ValueError):
             print("The range seems wrong. Perhaps the file doesn't contain this number of pages. Please try again.")
 
+def get_frequency_table(lang):
+    """Получить таблицу частотности wordfreq для языка lang.
+    
+    Таблица загружается один раз за время работы процесса и используется для всех уровней студентов.
+    """
+    if lang not in frequency_tables:
+        frequency_tables[lang] = get_frequency_dict(lang)
+    return frequency_tables[lang]
+
+def zipf_scores(words, lang):
+    """Вычислить частотность слов words по шкале Zipf (как в zipf_frequency) сразу для всего списка.
+    
+    Функция возвращает массив numpy в том же порядке, что слова в words. 
+    Для слов, которых нет в таблице частотности, значение равно 0.
+    """
+    table = get_frequency_table(lang)
+    frequencies = np.fromiter((table.get(word, 0.0) for word in words), dtype=float, count=len(words))
+    scores = np.zeros(len(words))
+    found = frequencies > 0
+    scores[found] = np.log10(frequencies[found]) + 9
+    return scores.round(2)
+
+def iter_sentences(pages, parts=None):
+    """Разделить на предложения текст, который поступает постранично.
+    
+    Последнее предложение страницы может продолжаться на следующей, поэтому оно не возвращается сразу,
+    а присоединяется к началу следующей страницы.
+    Функция возвращает кортежи (номер страницы, начало, конец, предложение), где номер страницы (с 0) - страница,
+    на которой предложение начинается (даже если возвращается оно позже, вместе со следующей страницей),
+    а начало и конец - позиции предложения в тексте всех страниц подряд.
+    Если передан список parts, в него добавляются страницы, так что "".join(parts) - это весь текст.
+    """
+    carry = ""
+    carry_start = 0
+    carry_span = None
+    # страница, на которой начинается перенесенное предложение
+    carry_page = 0
+    text_length = 0
+    page_num = -1
+    for page_num, page in enumerate(pages):
+        if parts is not None:
+            parts.append(page)
+        if not carry:
+            carry_page = page_num
+        # chunk - часть текста от начала перенесенного предложения до конца страницы
+        chunk = carry + page
+        text_length += len(page)
+        spans = get_sentence_spans(chunk)
+        if spans:
+            start, end = spans.pop()
+            for sent_start, sent_end in spans:
+                sent_page = carry_page if sent_start < len(carry) else page_num
+                yield sent_page, carry_start + sent_start, carry_start + sent_end, chunk[sent_start:sent_end]
+            if start >= len(carry):
+                carry_page = page_num
+            carry = chunk[start:]
+            carry_span = (carry_start + start, carry_start + end)
+            carry_start += start
+        else:
+            carry = chunk
+    if carry_span is not None:
+        start, end = carry_span
+        yield carry_page, start, end, carry[:end - start]
+
+@lru_cache(maxsize=sentence_cache_size)
+def tag_sentence(sent):
+    """Токенизировать предложение и выполнить частеречную разметку.
+    
+    Результат - кортеж пар (токен, тег nltk). Результаты хранятся в кэше, поэтому повторяющиеся 
+    предложения (например, при повторной обработке того же текста) заново не размечаются.
+    """
+    return tuple(nltk.pos_tag(nltk.word_tokenize(sent, language=language)))
+
+def analyze_pages(pages, tagger=tag_sentence):
+    """Проанализировать текст за один проход.
+    
+    pages - страницы текста (список или генератор, например iter_pages).
+    Текст делится на предложения, и каждое предложение токенизируется и размечается по частям речи
+    ровно один раз. Для каждого слова в нижнем регистре сохраняется его частеречный тег nltk
+    в первом предложении, где оно встретилось (само предложение - первое в get_postings). Затем для всех 
+    уникальных слов одним вызовом вычисляется частотность (см. zipf_scores).
+    
+    Во время того же прохода строится инвертированный индекс: для каждого слова сохраняются
+    индексы предложений, где оно встречается, а также считается, сколько раз 
+    и на скольких страницах встречается каждое слово (это нужно для score_candidates).
+    Индексы предложений всех слов хранятся в одном массиве numpy, а не в отдельном списке для каждого слова,
+    поэтому индекс занимает 4 байта на пару (слово, предложение) (см. get_postings).
+    
+    Функция возвращает словарь document:
+    text - весь текст одной строкой,
+    offsets - массив numpy размером (число предложений, 2) с началом и концом каждого предложения в text
+    (сами предложения не хранятся, см. get_sentence),
+    lengths - массив с длиной каждого предложения в токенах,
+    words - словарь, где ключ - слово, а значение - тег nltk,
+    vocab - список слов из words,
+    vocab_ids - словарь, где ключ - слово, а значение - его индекс в vocab; остальные слова текста
+    (с заглавной буквы) получают следующие номера, чтобы у каждого слова был номер в posting_starts,
+    zipf - массив numpy с частотностью слов из vocab,
+    counts - массив numpy с числом употреблений слов из vocab в тексте,
+    page_counts - массив numpy с числом страниц, на которых встречаются слова из vocab,
+    num_pages - число страниц текста,
+    postings - массив numpy с индексами предложений, сгруппированными по словам, внутри слова - по порядку,
+    posting_starts - массив numpy, где для слова с номером i (см. vocab_ids) его индексы - postings[posting_starts[i]:posting_starts[i + 1]],
+    lemma_of - словарь, где ключ - слово, а значение - его лемма,
+    lemmas - словарь, где ключ - лемма, а значение - список словоформ с этой леммой.
+    Леммы вычисляются позже, при первом поиске примеров (см. get_lemma и index_lemmas).
+    
+    tagger - функция, которая размечает предложение (по умолчанию tag_sentence, см. также CachedTagger).
+    """
+    parts = []
+    offsets = array("q")
+    lengths = array("l")
+    words = {}
+    # пары (номер слова, индекс предложения) по порядку текста, в конце они группируются по словам
+    posting_ids = {}
+    pair_words = array("l")
+    pair_sents = array("l")
+    last_sent = array("l")
+    counts = Counter()
+    page_counts = Counter()
+    page_words = set()
+    current_page = 0
+    
+    for sent_id, (page_num, start, end, sent) in enumerate(iter_sentences(pages, parts)):
+        if page_num != current_page:
+            current_page = page_num
+            page_words.clear()
+        offsets.append(start)
+        offsets.append(end)
+        tagged_sent = tagger(sent)
+        lengths.append(len(tagged_sent))
+        for word, nltk_tag in tagged_sent:
+            if word.isalpha():
+                word_id = posting_ids.setdefault(word, len(posting_ids))
+                if word_id == len(last_sent):
+                    last_sent.append(-1)
+                if last_sent[word_id] != sent_id:
+                    last_sent[word_id] = sent_id
+                    pair_words.append(word_id)
+                    pair_sents.append(sent_id)
+            
+            # числа и имена собственные (определяются по регистру) исключаются,
+            # для остальных слов запоминается первое появление в тексте
+            if word.isalpha() and word.islower():
+                if word not in words:
+                    words[word] = nltk_tag
+                counts[word] += 1
+                if word not in page_words:
+                    page_words.add(word)
+                    page_counts[word] += 1
+    
+    vocab = list(words)
+    # номера слов в парах заменяются номерами из vocab_ids, поэтому отдельный словарь для индекса не нужен
+    vocab_ids = {word: i for i, word in enumerate(vocab)}
+    for word in posting_ids:
+        vocab_ids.setdefault(word, len(vocab_ids))
+    new_ids = np.array([vocab_ids[word] for word in posting_ids], dtype=np.int64)
+    pair_words = new_ids[np.array(pair_words, dtype=np.int64)]
+    # устойчивая сортировка сохраняет порядок предложений внутри каждого слова
+    order = np.argsort(pair_words, kind="stable")
+    posting_starts = np.zeros(len(vocab_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_words, minlength=len(vocab_ids)), out=posting_starts[1:])
+    
+    return {
+        "text": "".join(parts),
+        "offsets": np.array(offsets, dtype=np.int64).reshape(-1, 2),
+        "lengths": lengths,
+        "words": words,
+        "vocab": vocab,
+        "vocab_ids": vocab_ids,
+        "zipf": zipf_scores(vocab, src_lang),
+        "counts": np.array([counts[word] for word in vocab], dtype=float),
+        "page_counts": np.array([page_counts[word] for word in vocab], dtype=float),
+        "num_pages": current_page + 1,
+        "postings": np.array(pair_sents, dtype=np.int32)[order],
+        "posting_starts": posting_starts,
+        "lemma_of": {},
+        "lemmas": {}
+    }
+
+# все записи кэша анализа с их размером и временем последнего использования
+analysis_cache_entries = """ SELECT 'pages', rowid, size, used_at FROM pages
+UNION ALL SELECT 'sentences', rowid, size, used_at FROM sentences
+UNION ALL SELECT 'documents', rowid, size, used_at FROM documents """
+
+def get_analysis_cache():
+    """Открыть кэш анализа документов (база данных sqlite в файле analysis_cache_path) и создать таблицы, если их нет.
+    
+    pages - текст страниц, ключ - хэш содержимого файла, номер страницы и размер условной страницы,
+    sentences - размеченные предложения, ключ - хэш предложения и язык,
+    documents - результаты analyze_pages в json (см. document_to_json), ключ - хэш файла, диапазон страниц
+    и отпечаток настроек (см. settings_fingerprint).
+    В каждой таблице хранится размер записи в байтах и время последнего использования (см. trim_analysis_cache).
+    Если файл кэша создан более старой версией программы (PRAGMA user_version меньше analysis_cache_schema),
+    сохраненные документы удаляются, не загружаясь.
+    """
+    global analysis_cache, analysis_cache_total, analysis_cache_settings
+    if analysis_cache is None:
+        analysis_cache = sq.connect(analysis_cache_path, timeout=30)
+        if analysis_cache.execute(""" PRAGMA user_version """).fetchone()[0] < analysis_cache_schema:
+            analysis_cache.execute(""" DROP TABLE IF EXISTS documents """)
+            analysis_cache.execute(f""" PRAGMA user_version = {analysis_cache_schema} """)
+        analysis_cache.execute("""
+        CREATE TABLE IF NOT EXISTS pages
+        (file_hash TEXT NOT NULL,
+        paging TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, paging, page))
+        """)
+        analysis_cache.execute("""
+        CREATE TABLE IF NOT EXISTS sentences
+        (sentence_hash TEXT NOT NULL,
+        language TEXT NOT NULL,
+        tags TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL,
+        PRIMARY KEY (sentence_hash, language))
+        """)
+        analysis_cache.execute("""
+        CREATE TABLE IF NOT EXISTS documents
+        (file_hash TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        settings TEXT NOT NULL,
+        data TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, start, end, settings))
+        """)
+        analysis_cache.commit()
+        analysis_cache_total = analysis_cache.execute(f""" SELECT COALESCE(SUM(size), 0) FROM ({analysis_cache_entries}) """).fetchone()[0]
+        analysis_cache_settings = None
+    return analysis_cache
+
+def file_digest(address):
+    """Вычислить хэш sha256 содержимого файла. Файл читается блоками, поэтому большие файлы не загружаются в память."""
+    digest = hashlib.sha256()
+    with open(address, 'rb') as file:
+        for block in iter(lambda: file.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def paging():
+    """Размер условных страниц docx и txt и версия анализа: от них зависит текст страниц (см. read_pages)."""
+    return f"{paragraphs_per_page}/{lines_per_page}/{analysis_version}"
+
+def settings_fingerprint():
+    """Отпечаток настроек анализа: если меняются язык, профили уровней или разбиение на страницы, кэш документов не используется."""
+    settings = {
+        "language": language,
+        "src_lang": src_lang,
+        "level_profiles": level_profiles,
+        "paging": paging(),
+        "analysis_version": analysis_version
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+def iter_cached_pages(address, start=1, end=None, workers=None, digest=None):
+    """Постранично извлечь текст из файла, как iter_pages, но взять из кэша страницы, которые уже извлекались.
+    
+    Из файла извлекаются только страницы, которых нет в кэше (подряд идущие - одним вызовом iter_pages).
+    Извлеченные страницы возвращаются сразу, чтобы анализ шел одновременно с извлечением,
+    а в кэш сохраняются блоками по pages_per_chunk страниц.
+    """
+    if digest is None:
+        digest = file_digest(address)
+    if end is None:
+        end = count_pages(address)
+    
+    cache = get_analysis_cache()
+    select_pages = """ SELECT page, text FROM pages WHERE file_hash = ? AND paging = ? AND page BETWEEN ? AND ? """
+    cached = dict(cache.execute(select_pages, (digest, paging(), start, end)).fetchall())
+    if cached:
+        update_used = """ UPDATE pages SET used_at = ? WHERE file_hash = ? AND paging = ? AND page BETWEEN ? AND ? """
+        cache.execute(update_used, (time.time(), digest, paging(), start, end))
+        cache.commit()
+    
+    page = start
+    while page <= end:
+        if page in cached:
+            yield cached[page]
+            page += 1
+            continue
+        
+        missing_end = page
+        while missing_end < end and missing_end + 1 not in cached:
+            missing_end += 1
+        new_pages = []
+        try:
+            for text in iter_pages(address, page, missing_end, workers):
+                new_pages.append(text)
+                if len(new_pages) == pages_per_chunk:
+                    store_pages(digest, page, new_pages)
+                    page += len(new_pages)
+                    new_pages = []
+                yield text
+        finally:
+            # страницы, которые уже извлечены, сохраняются, даже если дальше их не стали читать
+            if new_pages:
+                store_pages(digest, page, new_pages)
+        page = missing_end + 1
+
+def store_pages(digest, start, pages):
+    """Сохранить в кэш текст страниц pages, первая из которых имеет номер start."""
+    global analysis_cache_total
+    cache = get_analysis_cache()
+    now = time.time()
+    insert_page = """ INSERT OR REPLACE INTO pages (file_hash, paging, page, text, size, used_at) VALUES (?, ?, ?, ?, ?, ?) """
+    rows = [(digest, paging(), page_num, text, len(text.encode()), now) for page_num, text in enumerate(pages, start)]
+    cache.executemany(insert_page, rows)
+    cache.commit()
+    analysis_cache_total += sum(row[4] for row in rows)
 
-def get_word_set(text):
+class CachedTagger:
+    """Разметчик предложений для analyze_pages, который сначала ищет предложение в кэше на диске.
+    
+    Если предложения нет в кэше, оно размечается tag_sentence. Новые разметки сохраняются вызовом save,
+    поэтому при анализе нового диапазона страниц того же файла заново размечаются только новые предложения.
+    """
+    
+    def __init__(self):
+        self.cache = get_analysis_cache()
+        self.found = []
+        self.new = {}
+    
+    def __call__(self, sent):
+        sentence_hash = hashlib.sha1(sent.encode()).hexdigest()
+        select_tags = """ SELECT tags FROM sentences WHERE sentence_hash = ? AND language = ? """
+        row = self.cache.execute(select_tags, (sentence_hash, language)).fetchone()
+        if row:
+            self.found.append(sentence_hash)
+            return tuple(tuple(pair) for pair in json.loads(row[0]))
+        tagged_sent = tag_sentence(sent)
+        self.new[sentence_hash] = tagged_sent
+        return tagged_sent
+    
+    def save(self):
+        global analysis_cache_total
+        now = time.time()
+        update_used = """ UPDATE sentences SET used_at = ? WHERE sentence_hash = ? AND language = ? """
+        self.cache.executemany(update_used, [(now, sentence_hash, language) for sentence_hash in self.found])
+        insert_tags = """ INSERT OR REPLACE INTO sentences (sentence_hash, language, tags, size, used_at) VALUES (?, ?, ?, ?, ?) """
+        rows = []
+        for sentence_hash, tagged_sent in self.new.items():
+            tags = json.dumps(tagged_sent, ensure_ascii=False)
+            rows.append((sentence_hash, language, tags, len(tags.encode()), now))
+        self.cache.executemany(insert_tags, rows)
+        self.cache.commit()
+        analysis_cache_total += sum(row[3] for row in rows)
+
+def document_to_json(document):
+    """Записать документ (результат analyze_pages) в строку json. Массивы numpy и array сохраняются как списки."""
+    return json.dumps({
+        "text": document["text"],
+        "offsets": document["offsets"].ravel().tolist(),
+        "lengths": list(document["lengths"]),
+        "words": document["words"],
+        "vocab": document["vocab"],
+        "zipf": document["zipf"].tolist(),
+        "counts": document["counts"].tolist(),
+        "page_counts": document["page_counts"].tolist(),
+        "num_pages": document["num_pages"],
+        "postings": document["postings"].tolist(),
+        "posting_starts": document["posting_starts"].tolist(),
+        # слова не из vocab, у которых есть номер в vocab_ids
+        "other_words": list(document["vocab_ids"])[len(document["vocab"]):],
+        "lemma_of": document["lemma_of"],
+        "lemmas": document["lemmas"]
+    }, ensure_ascii=False, separators=(",", ":"))
+
+def document_from_json(data):
+    """Восстановить документ из строки json, записанной document_to_json."""
+    document = json.loads(data)
+    document["offsets"] = np.array(document["offsets"], dtype=np.int64).reshape(-1, 2)
+    document["lengths"] = array("l", document["lengths"])
+    document["vocab_ids"] = {word: i for i, word in enumerate(document["vocab"] + document.pop("other_words"))}
+    document["postings"] = np.array(document["postings"], dtype=np.int32)
+    document["posting_starts"] = np.array(document["posting_starts"], dtype=np.int64)
+    for key in ("zipf", "counts", "page_counts"):
+        document[key] = np.array(document[key], dtype=float)
+    return document
+
+def lookup_document(digest, start, end):
+    """Найти в кэше результат analyze_pages для страниц с start по end файла с хэшем digest при текущих настройках."""
+    cache = get_analysis_cache()
+    invalidate_analysis_cache()
+    key = (digest, start, end, settings_fingerprint())
+    row = cache.execute(""" SELECT data FROM documents WHERE file_hash = ? AND start = ? AND end = ? AND settings = ? """, key).fetchone()
+    if row is None:
+        return None
+    cache.execute(""" UPDATE documents SET used_at = ? WHERE file_hash = ? AND start = ? AND end = ? AND settings = ? """,
+                  (time.time(), ) + key)
+    cache.commit()
+    document = document_from_json(row[0])
+    document["cache_key"] = (digest, start, end)
+    return document
+
+def store_document(document):
+    """Сохранить документ в кэш. Его можно сохранить еще раз после работы, чтобы в кэш попали и вычисленные леммы.
+    
+    После сохранения кэш сокращается до analysis_cache_size байт (см. trim_analysis_cache): это происходит
+    один раз на документ, а не при каждой записи страниц и предложений.
+    """
+    global analysis_cache_total
+    cache = get_analysis_cache()
+    digest, start, end = document["cache_key"]
+    data = document_to_json(document)
+    insert_document = """ INSERT OR REPLACE INTO documents (file_hash, start, end, settings, data, size, used_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?) """
+    cache.execute(insert_document, (digest, start, end, settings_fingerprint(), data, len(data.encode()), time.time()))
+    cache.commit()
+    analysis_cache_total += len(data.encode())
+    trim_analysis_cache()
+
+def invalidate_analysis_cache():
+    """Удалить из кэша страницы, разбитые с другим размером условной страницы, и документы, проанализированные
+    с другими настройками: они больше не понадобятся.
+    
+    Таблицы просматриваются целиком, поэтому это делается только один раз для каждого отпечатка настроек
+    (см. settings_fingerprint), а не при каждой записи.
+    """
+    global analysis_cache_total, analysis_cache_settings
+    cache = get_analysis_cache()
+    if analysis_cache_settings == settings_fingerprint():
+        return
+    removed = cache.execute(""" DELETE FROM pages WHERE paging != ? """, (paging(), )).rowcount
+    removed += cache.execute(""" DELETE FROM documents WHERE settings != ? """, (settings_fingerprint(), )).rowcount
+    cache.commit()
+    if removed:
+        analysis_cache_total = cache.execute(f""" SELECT COALESCE(SUM(size), 0) FROM ({analysis_cache_entries}) """).fetchone()[0]
+    analysis_cache_settings = settings_fingerprint()
+
+def trim_analysis_cache():
+    """Удалить самые давно использованные записи, если кэш анализа занимает больше analysis_cache_size байт.
+    
+    Размер берется из analysis_cache_total, поэтому, пока кэш не переполнен, таблицы не просматриваются.
+    Перезаписанные записи учитываются в analysis_cache_total дважды, поэтому перед удалением размер
+    пересчитывается точно.
+    """
+    global analysis_cache_total
+    cache = get_analysis_cache()
+    if analysis_cache_total <= analysis_cache_size:
+        return
+    total = cache.execute(f""" SELECT COALESCE(SUM(size), 0) FROM ({analysis_cache_entries}) """).fetchone()[0]
+    
+    removed = {"pages": [], "sentences": [], "documents": []}
+    if total > analysis_cache_size:
+        for table, rowid, size, used_at in cache.execute(f""" {analysis_cache_entries} ORDER BY used_at """):
+            if total <= analysis_cache_size:
+                break
+            removed[table].append((rowid, ))
+            total -= size
+    for table, rowids in removed.items():
+        cache.executemany(f""" DELETE FROM {table} WHERE rowid = ? """, rowids)
+    cache.commit()
+    analysis_cache_total = total
+
+def analyze_and_store(pages, digest, start, end):
+    """Проанализировать страницы (см. analyze_pages), используя кэш размеченных предложений, и сохранить документ в кэш."""
+    tagger = CachedTagger()
+    document = analyze_pages(pages, tagger)
+    tagger.save()
+    document["cache_key"] = (digest, start, end)
+    store_document(document)
+    return document
+
+def load_document(address, start=1, end=None, workers=None):
+    """Получить анализ страниц с start по end файла address.
+    
+    Если тот же файл (с тем же содержимым) уже анализировался с теми же страницами и настройками,
+    документ загружается из кэша. Иначе из файла извлекаются только страницы, которых нет в кэше,
+    и заново размечаются только предложения, которых нет в кэше.
+    """
+    digest = file_digest(address)
+    if end is None:
+        end = count_pages(address)
+    document = lookup_document(digest, start, end)
+    if document is None:
+        document = analyze_and_store(iter_cached_pages(address, start, end, workers, digest), digest, start, end)
+    return document
+
+def get_word_set(document, level=default_level, known_words=None):
     """Составить набор слов, которые пользователь скорее всего не знает.
     
-    Текст токенизируется: строка text делится на слова с помощью nltk, 
-    результат сохраняется в списке words. Затем составляется список pos, 
-    в котором частеречные теги слов хранятся в том же порядке, что сами слова в списке words. 
-    Затем из списка words удаляются числа и имена собственные (определяются по регистру),
-    а также самые частотные (так как скорее всего известны пользователю) и наоборот самые редкие слова 
-    (вероятно их изучение еще не релевантно для студента среднего уровня).
+    Из слов текста исключаются самые частотные (так как скорее всего известны пользователю) 
+    и наоборот самые редкие слова (вероятно их изучение еще не релевантно для студента этого уровня).
+    Границы частотности берутся из профиля level (см. level_profiles) 
+    и применяются ко всему массиву document["zipf"] сразу.
+    
+    known_words - множество слов и лемм, о которых студента больше не нужно спрашивать (см. load_known_words).
+    Такие словоформы исключаются еще до лемматизации. Слова, чьи леммы есть в known_words, пропускаются
+    позже, когда лемма вычисляется (см. analyze и select_words).
     """
-    words = nltk.word_tokenize(text, language=language)
-    pos = [nltk.pos_tag([word]) for word in words]
-    word_set = set({})
-    for word in words:
-        if word.isalpha() and frq_lower < zipf_frequency(word, src_lang) <= frq_upper and word.islower():
-            word_set.add(word)
+    if known_words is None:
+        known_words = set()
     
-    return word_set
+    frq_lower, frq_upper = level_profiles[level]
+    zipf = document["zipf"]
+    selected = np.flatnonzero((zipf > frq_lower) & (zipf <= frq_upper))
+    return {document["vocab"][i] for i in selected} - known_words
+
+def score_candidates(word_set, document, level=default_level):
+    """Оценить, насколько полезно студенту уровня level выучить каждое слово из word_set.
+    
+    Оценка - произведение трех величин:
+    log(1 + число употреблений слова в тексте) - чем чаще слово встречается, тем полезнее его выучить;
+    доля страниц, на которых встречается слово - слово, которое встречается по всему тексту, 
+    полезнее, чем слово с одной страницы;
+    положение слова в диапазоне частотности уровня (от 0.5 у нижней границы до 1 у верхней) - 
+    более частотные слова пригодятся скорее.
+    Функция возвращает словарь, где ключ - слово, а значение - оценка.
+    """
+    frq_lower, frq_upper = level_profiles[level]
+    words = list(word_set)
+    ids = np.array([document["vocab_ids"][word] for word in words], dtype=int)
+    
+    frequency = np.log1p(document["counts"][ids])
+    dispersion = document["page_counts"][ids] / document["num_pages"]
+    position = np.clip((document["zipf"][ids] - frq_lower) / (frq_upper - frq_lower), 0, 1)
+    scores = frequency * dispersion * (0.5 + position / 2)
+    
+    return dict(zip(words, scores.tolist()))
+
+def rank_candidates(word_set, document, level=default_level):
+    """Перебрать слова из word_set от самого полезного к наименее полезному (см. score_candidates).
+    
+    Функция - генератор на основе кучи: слова извлекаются по одному, поэтому полностью
+    список не сортируется, если нужны только первые слова.
+    """
+    heap = [(-score, word) for word, score in score_candidates(word_set, document, level).items()]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[1]
+
+def top_candidates(word_set, document, k, level=default_level):
+    """Выбрать k самых полезных слов из word_set (см. score_candidates), результат - список."""
+    scores = score_candidates(word_set, document, level)
+    return heapq.nsmallest(k, scores, key=lambda word: (-scores[word], word))
 
 def get_sentence_list(text):
     """Текст делится на предложения, результат сохраняется в списке строк sentence_list."""
     sentence_list = nltk.sent_tokenize(text, language=language)
     return sentence_list
 
-def find_sent(word, sentence_list):
-    """Найти предложение из текста, в котором используется слово word."""
-    for sent in sentence_list:
-        if word in nltk.word_tokenize(sent, language=language):
-            return sent
+@lru_cache(maxsize=None)
+def get_sentence_tokenizer(lang):
+    """Получить токенизатор punkt для языка lang или None, если в установленной версии nltk его нельзя получить."""
+    try:
+        return nltk.tokenize.punkt.PunktTokenizer(lang)
+    except (AttributeError, LookupError):
+        return None
+
+def get_sentence_spans(text):
+    """Разделить текст на предложения и вернуть список пар (начало, конец) - позиций предложений в text.
+    
+    Если доступен токенизатор punkt, позиции берутся из его span_tokenize, и строки предложений не создаются.
+    Иначе предложения из get_sentence_list находятся в тексте по порядку.
+    """
+    tokenizer = get_sentence_tokenizer(language)
+    if tokenizer is not None:
+        return list(tokenizer.span_tokenize(text))
+    
+    spans = []
+    position = 0
+    for sent in get_sentence_list(text):
+        start = text.find(sent, position)
+        if start < 0:
+            start = position
+        spans.append((start, start + len(sent)))
+        position = start + len(sent)
+    return spans
+
+def get_sentence(document, sent_id):
+    """Получить предложение с индексом sent_id: оно вырезается из document["text"] только при обращении."""
+    start, end = document["offsets"][sent_id]
+    return document["text"][start:end]
+
+def get_postings(word, document):
+    """Индексы предложений, в которых встречается слово word, по порядку (срез массива document["postings"])."""
+    word_id = document["vocab_ids"].get(word)
+    if word_id is None:
+        return document["postings"][:0]
+    starts = document["posting_starts"]
+    return document["postings"][starts[word_id]:starts[word_id + 1]]
+
+def find_sent(word, document):
+    """Найти первое предложение из текста, в котором используется слово word."""
+    sent_ids = get_postings(word, document)
+    if len(sent_ids):
+        return get_sentence(document, sent_ids[0])
+
+def find_examples(lemma, document, n=1, order="first"):
+    """Найти n примеров употребления леммы lemma в тексте.
+    
+    Индексы предложений берутся из инвертированного индекса (см. get_postings) для всех словоформ
+    с этой леммой, поэтому текст заново не просматривается. Словоформы известны для всех слов текста,
+    а не только для тех, что уже лемматизировались (см. index_lemmas).
+    order - способ выбора примеров: first - первые по порядку в тексте, shortest - самые короткие,
+    best - те, чья длина ближе всего к example_length токенов.
+    
+    Функция возвращает список предложений (пустой, если лемма не встречается в тексте).
+    """
+    index_lemmas(document)
+    forms = document["lemmas"].get(lemma, [])
+    sent_ids = sorted({int(sent_id) for form in forms for sent_id in get_postings(form, document)})
+    lengths = document["lengths"]
+    
+    if order == "first":
+        best_ids = sent_ids[:n]
+    elif order == "shortest":
+        best_ids = heapq.nsmallest(n, sent_ids, key=lambda sent_id: lengths[sent_id])
+    elif order == "best":
+        best_ids = heapq.nsmallest(n, sent_ids, key=lambda sent_id: abs(lengths[sent_id] - example_length))
+    else:
+        raise ValueError(f"Unknown order of examples: {order}")
+    
+    return [get_sentence(document, sent_id) for sent_id in best_ids]
         
-def get_nltk_tag(word, tagged_sent):
-    """Найти частеречный тег слова word в предложении с частеречной разметкой tagged_sent."""
-    for item in tagged_sent:
-        if word in item:
-            return item[1]
+def get_nltk_tag(word, document):
+    """Найти частеречный тег слова word в первом предложении, где оно встретилось."""
+    if word in document["words"]:
+        return document["words"][word]
         
 def nltk_tag_to_wordnet_tag(nltk_tag):
     """Преобразовать частеречный тег nltk в частеречный тег WordNet."""
@@ -118,48 +898,249 @@ def nltk_tag_to_wordnet_tag(nltk_tag):
         return wordnet.ADV
     else:
         return None
+
+def get_lemmatizer():
+    """Получить лемматизатор WordNet, при первом вызове он создается."""
+    global lemmatizer
+    if lemmatizer is None:
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer
+
+@lru_cache(maxsize=lemma_cache_size)
+def lemmatize_word(word, wordnet_tag):
+    """Лемматизировать слово с помощью лемматизатора WordNet.
     
-def get_lemma(word, sentence_list):
+    Результаты для пар (слово, тег WordNet) хранятся в кэше и используются для всех текстов,
+    которые обрабатывает процесс.
+    """
+    return get_lemmatizer().lemmatize(word, wordnet_tag)
+
+def lemmatize(word, nltk_tag):
     """Лемматизировать слово (привести к начальной форме).
     
-    Программа находит предложение, в котором используется слово word.
-    Предложение токенизируется, каждому токену назначается частеречный тег.
-    Затем частеречные теги nltk преобразуются в теги WordNet.
-    Слово лемматизируется с помощью лемматизатора WordNet.
+    Частеречный тег nltk преобразуется в тег WordNet.
+    Слово лемматизируется с помощью лемматизатора WordNet (см. lemmatize_word).
     В случае, если это глагол, добавляется инфинитивная частица to.
+    Если для тега nltk нет соответствующего тега WordNet, лемму получить нельзя, и функция возвращает "Not found".
+    Другие ошибки (например, если не загружен корпус WordNet) не перехватываются.
     """
-    try:
-        sent = find_sent(word, sentence_list)
-        sent_tokens = nltk.word_tokenize(sent, language=language)
-        tagged_sent = nltk.pos_tag(sent_tokens)
-        nltk_tag = get_nltk_tag(word, tagged_sent)
-        wordnet_tag = nltk_tag_to_wordnet_tag(nltk_tag)
-        if wordnet_tag == wordnet.VERB:
-            result = f"to {lemmatizer.lemmatize(word, wordnet_tag)}"
-        else:
-            result = f"{lemmatizer.lemmatize(word, wordnet_tag)}"
-        return result 
+    wordnet_tag = nltk_tag_to_wordnet_tag(nltk_tag)
+    if wordnet_tag is None:
+        return "Not found"
+    
+    lemma = lemmatize_word(word, wordnet_tag)
+    if wordnet_tag == wordnet.VERB:
+        return f"to {lemma}"
+    return lemma
+
+def cache_stats():
+    """Получить статистику кэшей лемм и размеченных предложений: число попаданий, промахов и размер."""
+    return {
+        "lemmas": lemmatize_word.cache_info()._asdict(),
+        "sentences": tag_sentence.cache_info()._asdict()
+    }
+    
+def get_lemma(word, document):
+    """Получить лемму слова word из текста.
     
-    except:
+    Лемма вычисляется по частеречному тегу, найденному при анализе текста в analyze_pages,
+    один раз и сохраняется в document.
+    """
+    if word in document["lemma_of"]:
+        return document["lemma_of"][word]
+    if word not in document["words"]:
         return "Not found"
     
+    lemma = lemmatize(word, document["words"][word])
+    document["lemma_of"][word] = lemma
+    document["lemmas"].setdefault(lemma, []).append(word)
+    return lemma
+    
+def index_lemmas(document):
+    """Вычислить леммы всех слов текста, чтобы в document["lemmas"] были все словоформы каждой леммы.
+    
+    Это делается один раз для документа, при первом поиске примеров (см. find_examples): леммы сохраняются
+    в document и вместе с ним попадают в кэш анализа (см. store_document).
+    """
+    if len(document["lemma_of"]) < len(document["vocab"]):
+        for word in document["vocab"]:
+            get_lemma(word, document)
+
+def get_translator():
+    """Получить переводчик Google translate, при первом вызове он создается."""
+    global translator
+    if translator is None:
+        translator = Translator()
+    return translator
+
+def google_backend(words, src, dest):
+    """Перевести список слов words одним запросом к Google translate.
+    
+    Функция возвращает список кортежей (основной перевод, список всех вариантов перевода)
+    в том же порядке, что слова в words. Если других вариантов нет, список вариантов пустой.
+    """
+    translations = get_translator().translate(words, src=src, dest=dest)
+    result = []
+    for translation in translations:
+        options = []
+        if translation.extra_data["all-translations"]:
+            options = list(translation.extra_data["all-translations"][0][1])
+        result.append((translation.text, options))
+    return result
+
+def dictionary_backend(dictionary):
+    """Создать переводчик на основе готового словаря, например, для работы без доступа к сети.
+    
+    dictionary - словарь, где ключ - слово, а значение - список вариантов перевода (первый - основной).
+    Функция возвращает переводчик с тем же интерфейсом, что google_backend.
+    Слова, которых нет в словаре, "переводятся" сами в себя.
+    """
+    def translate(words, src, dest):
+        return [(dictionary[word][0], list(dictionary[word])) if word in dictionary else (word, []) for word in words]
+    return translate
+
+# переводчик: функция, которая получает список слов и языки и возвращает список переводов;
+# его можно заменить, например, на dictionary_backend
+translation_backend = google_backend
+
+def get_translation_cache():
+    """Открыть кэш переводов (база данных sqlite в файле translation_cache_path) и создать таблицу, если ее нет."""
+    global translation_cache
+    if translation_cache is None:
+        translation_cache = sq.connect(translation_cache_path, check_same_thread=False)
+        translation_cache.execute("""
+        CREATE TABLE IF NOT EXISTS translations
+        (word TEXT NOT NULL,
+        src_lang TEXT NOT NULL,
+        dest_lang TEXT NOT NULL,
+        translation TEXT NOT NULL,
+        options TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        used_at REAL NOT NULL,
+        PRIMARY KEY (word, src_lang, dest_lang))
+        """)
+        translation_cache.execute(""" CREATE INDEX IF NOT EXISTS translations_used_at ON translations (used_at) """)
+        translation_cache.commit()
+    return translation_cache
+
+def lookup_translations(words):
+    """Найти в кэше переводы слов words, полученные не раньше чем translation_ttl секунд назад.
+    
+    Функция возвращает словарь, где ключ - слово, а значение - кортеж (основной перевод, список вариантов).
+    """
+    cache = get_translation_cache()
+    now = time.time()
+    found = {}
+    select_translation = """ SELECT translation, options FROM translations 
+    WHERE word = ? AND src_lang = ? AND dest_lang = ? AND fetched_at >= ? """
+    for word in words:
+        row = cache.execute(select_translation, (word, src_lang, dest_lang, now - translation_ttl)).fetchone()
+        if row:
+            found[word] = row[0], json.loads(row[1])
+    
+    update_used = """ UPDATE translations SET used_at = ? WHERE word = ? AND src_lang = ? AND dest_lang = ? """
+    cache.executemany(update_used, [(now, word, src_lang, dest_lang) for word in found])
+    cache.commit()
+    return found
+
+def store_translations(translations):
+    """Сохранить переводы в кэш и удалить устаревшие и самые давно использованные записи.
+    
+    translations - словарь, где ключ - слово, а значение - кортеж (основной перевод, список вариантов).
+    """
+    cache = get_translation_cache()
+    now = time.time()
+    insert_translation = """ INSERT OR REPLACE INTO translations 
+    (word, src_lang, dest_lang, translation, options, fetched_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?) """
+    cache.executemany(insert_translation, [
+        (word, src_lang, dest_lang, text, json.dumps(options, ensure_ascii=False), now, now)
+        for word, (text, options) in translations.items()
+    ])
+    
+    cache.execute(""" DELETE FROM translations WHERE fetched_at < ? """, (now - translation_ttl, ))
+    excess = cache.execute(""" SELECT COUNT(*) FROM translations """).fetchone()[0] - translation_cache_size
+    if excess > 0:
+        cache.execute(""" DELETE FROM translations WHERE rowid IN 
+        (SELECT rowid FROM translations ORDER BY used_at LIMIT ?) """, (excess, ))
+    cache.commit()
+
+def fetch_translations(words):
+    """Получить переводы слов words.
+    
+    Переводы ищутся в кэше, а недостающие запрашиваются у translation_backend одним запросом
+    и сохраняются в кэш. Функция возвращает словарь, где ключ - слово, 
+    а значение - кортеж (основной перевод, список вариантов).
+    """
+    with translation_lock:
+        found = lookup_translations(words)
+    
+    missing = [word for word in dict.fromkeys(words) if word not in found]
+    if missing:
+        fetched = dict(zip(missing, translation_backend(missing, src_lang, dest_lang)))
+        with translation_lock:
+            store_translations(fetched)
+        found.update(fetched)
+    
+    return found
+
+def prefetch_translations(words):
+    """Начать перевод слов words в фоновом потоке, пока пользователь отвечает на вопрос о текущем слове.
+    
+    Все слова, которые еще не переводятся, отправляются одним запросом.
+    """
+    global prefetch_executor
+    words = [word for word in words if word not in pending_translations]
+    if words:
+        if prefetch_executor is None:
+            prefetch_executor = ThreadPoolExecutor(max_workers=2)
+        future = prefetch_executor.submit(fetch_translations, words)
+        for word in words:
+            pending_translations[word] = future
+        # когда запрос завершен (успешно или с ошибкой), слова удаляются из pending_translations:
+        # готовые переводы уже есть в кэше, а неудачные запрашиваются заново (см. translate_options)
+        future.add_done_callback(lambda done, words=words: forget_pending(words, done))
+
+def forget_pending(words, future):
+    """Удалить из pending_translations слова words, если они все еще ожидают результата future."""
+    for word in words:
+        if pending_translations.get(word) is future:
+            pending_translations.pop(word, None)
+
+def translation_query(word, lemma):
+    """Выбрать, что переводить: для глаголов - лемму с частицей to, для остальных слов - само слово."""
+    if lemma.startswith('to '):
+        return lemma
+    return word
+
 def translate_options(word):
-    """Перевести слово word с английского на русский с помощью Google translate.
+    """Перевести слово word с английского на русский.
     
+    Если перевод уже запрошен в фоне (см. prefetch_translations), используется его результат, 
+    иначе перевод берется из кэша или запрашивается у translation_backend.
     Если переводчик предлагает несколько вариантов перевода слова, 
     они сохраняются в список options с порядковым номером.
     Если вариант только один, то options - строка, содержащая этот вариант.
     """
-    translation = translator.translate(word, src=src_lang, dest=dest_lang)
+    translation = None
+    future = pending_translations.pop(word, None)
+    if future is not None:
+        try:
+            translation = future.result()[word]
+        except Exception:
+            # если фоновый запрос не удался, перевод запрашивается еще раз
+            translation = None
+    if translation is None:
+        translation = fetch_translations([word])[word]
     
-    if translation.extra_data["all-translations"]:
-        options = translation.extra_data["all-translations"][0][1]
-        if translation.text not in translation.extra_data["all-translations"][0][1]:
-            options.insert(0, translation.text)
+    text, options = translation
+    if options:
+        options = list(options)
+        if text not in options:
+            options.insert(0, text)
         for i in range(len(options)):
             options[i] = f"{i+1}. {options[i]}"
     else:
-        options = translation.text
+        options = text
         
     return options
 
@@ -173,131 +1154,689 @@ def correct_trans(options, list_of_num):
     """
     corr_trans = []
     for num in list_of_num:
-        corr_trans.append(options[int(num) - 1][3:])
+        num = int(num)
+        if not 1 <= num <= len(options):
+            raise ValueError(f"There is no translation option {num}")
+        corr_trans.append(options[num - 1].split(". ", 1)[1])
     return corr_trans
 
-def analyze(word_set, sentence_list):
-    """Выбрать новые для пользователя слова и верный перевод для них.
+def get_known_words_db():
+    """Открыть базу данных со словами студентов (файл known_words_path) и создать таблицу, если ее нет."""
+    global known_words_db
+    if known_words_db is None:
+        known_words_db = sq.connect(known_words_path, timeout=30)
+        known_words_db.execute("""
+        CREATE TABLE IF NOT EXISTS student_words
+        (student TEXT NOT NULL,
+        word TEXT NOT NULL,
+        lemma TEXT NOT NULL,
+        status TEXT NOT NULL CHECK (status IN ('known', 'learning', 'new')),
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (student, word))
+        """)
+        known_words_db.execute(""" CREATE INDEX IF NOT EXISTS student_words_lemma ON student_words (student, lemma) """)
+        known_words_db.commit()
+    return known_words_db
+
+def load_known_words(student):
+    """Получить множество слов и лемм, о которых студента student больше не нужно спрашивать.
     
-    word_set - множество потенциальных новых слов (set).
-    sents - список предложений исходного текста.
+    Это слова со статусом known (студент их знает) и learning (уже сохранены в таблицу новых слов).
+    """
+    select_words = """ SELECT word, lemma FROM student_words WHERE student = ? AND status IN ('known', 'learning') """
+    known_words = set()
+    for word, lemma in get_known_words_db().execute(select_words, (student, )):
+        known_words.add(word)
+        known_words.add(lemma)
+    return known_words
+
+def mark_word(student, word, lemma, status):
+    """Сохранить статус слова для студента student.
     
-    Студент указывает число новых слов, которые хочет записать - words_needed.
-    Программа поочередно показывает студенту слова из набора word_set вместе с предложением, где они встретились.
+    status - known (студент знает слово), learning (слово сохранено в таблицу новых слов)
+    или new (студент не знает слово, но пока не сохранил его).
     """
-    new_words = {}
+    mark_words([(student, word, lemma, status)])
+
+def mark_words(rows):
+    """Сохранить статусы сразу нескольких слов одной транзакцией. rows - кортежи (student, word, lemma, status)."""
+    db = get_known_words_db()
+    now = time.time()
+    db.executemany(""" INSERT OR REPLACE INTO student_words (student, word, lemma, status, updated_at) VALUES (?, ?, ?, ?, ?) """,
+                   [row + (now, ) for row in rows])
+    db.commit()
+
+def iter_with_lookahead(iterable, size):
+    """Перебрать элементы iterable, возвращая вместе с каждым список из следующих size элементов."""
+    iterator = iter(iterable)
+    window = deque(islice(iterator, size + 1))
+    while window:
+        item = window.popleft()
+        window.extend(islice(iterator, 1))
+        yield item, list(window)
+
+class Session:
+    """Диалог со студентом из analyze в виде конечного автомата, который можно продолжить с любого шага.
     
-    print(f"I have found {len(word_set)} words you might not know.")
-    words_needed = int(input("How many words do you need? Type a number. "))
+    Сессия не читает ввод и не переводит слова сама: после каждого ответа (answer) она переходит
+    в следующее состояние state, копит сообщения для студента (take_output) и задает вопрос prompt.
+    Если для продолжения нужен перевод, в query записывается слово, которое нужно перевести,
+    и сессия ждет результат translate_options в translated. Поэтому одну и ту же сессию можно вести
+    из консоли (analyze) или из асинхронного движка, который обслуживает многих студентов (SessionEngine).
     
-    for word in word_set:
-        while len(new_words) < words_needed:
-            
-            # слово лемматизируется, а если лемму не удалось получить либо эта лемма уже есть в new_words, 
-            # это слово пропускается, и цикл начинается заново
-            lemma = get_lemma(word, sentence_list)
-            if lemma == "Not found" or lemma in new_words:
+    mark - функция с интерфейсом mark_word, которая сохраняет ответы студента (по умолчанию mark_word).
+    
+    Состояния: words_needed - сколько слов нужно, known - знает ли студент слово, correct_form - правильная
+    форма слова, translate - ожидание перевода, choose - выбор вариантов перевода, confirm - верен ли
+    единственный вариант, own_translation - свой перевод, done - диалог закончен.
+    """
+    
+    def __init__(self, word_set, document, student=None, level=default_level, known_words=None, mark=None):
+        if known_words is None:
+            known_words = load_known_words(student) if student else set()
+        self.document = document
+        self.student = student
+        self.mark = mark if mark is not None else mark_word
+        self.known_words = known_words
+        self.ranked = iter_with_lookahead(rank_candidates(word_set, document, level), prefetch_size)
+        self.new_words = {}
+        self.words_needed = 0
+        self.word = None
+        self.lemma = None
+        self.the_sent = None
+        self.trans_opt = None
+        self.query = None
+        self.output = [f"I have found {len(word_set)} words you might not know."]
+        self.ask("words_needed", "How many words do you need? Type a number. ")
+    
+    @property
+    def done(self):
+        return self.state == "done"
+    
+    def ask(self, state, prompt):
+        """Перейти в состояние state и задать вопрос prompt."""
+        self.state = state
+        self.prompt = prompt
+    
+    def take_output(self):
+        """Получить накопленные сообщения для студента (без вопроса prompt) и очистить их."""
+        output, self.output = self.output, []
+        return output
+    
+    def answer(self, text):
+        """Обработать ответ студента на текущий вопрос и перейти к следующему состоянию."""
+        if self.state in ("done", "translate"):
+            raise RuntimeError(f"The session doesn't expect an answer in the state {self.state}")
+        getattr(self, f"on_{self.state}")(text.strip())
+    
+    def translated(self, trans_opt):
+        """Получить результат translate_options(self.query) и показать студенту варианты перевода."""
+        if self.state != "translate":
+            raise RuntimeError(f"The session doesn't expect a translation in the state {self.state}")
+        self.query = None
+        self.trans_opt = trans_opt
+        
+        # если есть несколько вариантов перевода, пользователь выбирает верные либо вводит свой вариант,
+        # если только один - указывает, верный он или нет
+        if type(trans_opt) == list:
+            self.output.append(f"Here are the translation options: {trans_opt}")
+            self.ask("choose", "Which one do you find correct? Give me a number or a list of numbers separated by comma. "
+                               "Type 0 if none are correct. ")
+        else:
+            self.output.append(f"The translation of this word is {trans_opt}")
+            self.ask("confirm", "Is it correct? Type yes or no. ")
+    
+    def next_word(self):
+        """Показать следующее слово из word_set или закончить диалог, если слов достаточно или они закончились."""
+        for word, next_words in self.ranked:
+            if len(self.new_words) >= self.words_needed:
                 break
-                
-            the_sent = find_sent(word, sentence_list).strip().replace('\n', ' ')
-            print('\n', lemma, '\n', the_sent, '\n')
-            answer = input("Do you know this word? Type yes or no. If the word form is incorrect, type 0.").lower().strip()
             
-
-            # если пользователь знает слово, он получает ответ от программы, слово пропускается,
-            # и цикл начинается заново
-            if answer == "yes":
-                print(random.choice(answer_options))
-                break
-                
-            if answer == "0":
-                lemma = input("Please, type in the correct form. ").lower().strip()
-                
-            # если пользователь не знает слово
-            if answer == "no" or answer.strip() == "0":   
-                if lemma.startswith('to '):
-                    trans_opt = translate_options(lemma)
-                else:
-                    trans_opt = translate_options(word)
-                
-                # если есть несколько вариантов перевода, пользователь выбирает верные либо вводит свой вариант
-                if type(trans_opt) == list:
-                    print(f"Here are the translation options: {trans_opt}")
-                    num_trans = input("""Which one do you find correct? Give me a number or a list of numbers separated by comma. Type 0 if none are correct. """).split(', ')
-                    while True:
-                        try:
-                            if num_trans == ["0"]:
-                                corr_trans = input("Type in your translation here. ").lower().strip()
-                            else:
-                                corr_trans = correct_trans(trans_opt, num_trans)
-                                
-                            print(f"Alright, so your preferred translation is {corr_trans}.")
-                            new_words[lemma] = corr_trans, the_sent
-                            print(f"Good, so now you have {len(new_words)} words out of {words_needed}!")
-                            break
-
-                        except:
-                            print("That wasn't a viable answer option. Please try again.")
-                    
-
-                
-                # если есть только один вариант перевода, пользователь указывает, верный он или нет,
-                # если нет, то вводит свой вариант
-                else:
-                    print(f"The translation of this word is {trans_opt}")
-                    feedback = input("Is it correct? Type yes or no. ").lower().strip()
-                    if feedback == "yes":
-                        new_words[lemma] = trans_opt, the_sent
-                    elif feedback == "no":
-                        corr_trans = input("Type in your translation here. ").lower().strip()
-                        new_words[lemma] = corr_trans, the_sent
-
-                    print(f"Good, so now you have {len(new_words)} words out of {words_needed}!") 
-
-    print("Seems like you have all the words you need!")
-        
-    return new_words
+            # слово лемматизируется, а если лемму не удалось получить либо эта лемма уже есть в new_words
+            # или известна студенту, это слово пропускается
+            lemma = get_lemma(word, self.document)
+            if lemma == "Not found" or lemma in self.new_words or lemma in self.known_words:
+                continue
             
-def save_to_file(new_words):
-    """Сохранить в файл docx таблицу с новыми словами, их переводом и примером предложения."""
+            # пока пользователь отвечает, следующие слова переводятся в фоне
+            prefetch_translations([
+                translation_query(next_word, get_lemma(next_word, self.document))
+                for next_word in next_words if get_lemma(next_word, self.document) != "Not found"
+            ])
+            
+            self.word = word
+            self.lemma = lemma
+            self.the_sent = find_examples(lemma, self.document, order=example_order)[0].strip().replace('\n', ' ')
+            self.show_word()
+            return
+        
+        self.output.append("Seems like you have all the words you need!")
+        self.ask("done", None)
     
-    name = input("What should I call the document? ").strip()
-    doc_name = name + '.docx'
+    def show_word(self):
+        self.output.append(f"\n{self.lemma}\n{self.the_sent}\n")
+        self.ask("known", "Do you know this word? Type yes or no. If the word form is incorrect, type 0. ")
     
-    word_document = Document()
+    def add_word(self, translation):
+        """Сохранить текущее слово с переводом translation и перейти к следующему."""
+        self.new_words[self.lemma] = translation, self.the_sent
+        self.output.append(f"Good, so now you have {len(self.new_words)} words out of {self.words_needed}!")
+        if self.student:
+            self.mark(self.student, self.word, self.lemma, "learning")
+        self.next_word()
     
-    table = word_document.add_table(len(new_words), 4)
-    i = 0
-    j = 1
+    def request_translation(self):
+        if self.student:
+            self.mark(self.student, self.word, self.lemma, "new")
+        self.query = translation_query(self.word, self.lemma)
+        self.ask("translate", None)
     
-    for item in new_words:
-        row = table.rows[i]
-        row.cells[0].text = f'{j}'
-        row.cells[1].text = item
-        
-        if type(new_words[item][0]) == str:
-            row.cells[2].text = new_words[item][0]
+    def on_words_needed(self, text):
+        try:
+            self.words_needed = int(text)
+        except ValueError:
+            self.output.append("That wasn't a viable answer option. Please try again.")
+            return
+        self.next_word()
+    
+    def on_known(self, text):
+        answer = text.lower()
+        # если пользователь знает слово, он получает ответ от программы, и слово пропускается
+        if answer == "yes":
+            if self.student:
+                self.mark(self.student, self.word, self.lemma, "known")
+            self.output.append(random.choice(answer_options))
+            self.next_word()
+        elif answer == "0":
+            self.ask("correct_form", "Please, type in the correct form. ")
+        elif answer == "no":
+            self.request_translation()
         else:
-            row.cells[2].text = ", ".join(new_words[item][0])
-        row.cells[3].text = new_words[item][1]
-        i += 1
-        j += 1
+            self.show_word()
+    
+    def on_correct_form(self, text):
+        self.lemma = text.lower()
+        self.request_translation()
+    
+    def on_choose(self, text):
+        num_trans = [num.strip() for num in text.split(',')]
+        if num_trans == ["0"]:
+            self.ask("own_translation", "Type in your translation here. ")
+            return
+        try:
+            corr_trans = correct_trans(self.trans_opt, num_trans)
+        except ValueError:
+            # вопрос задается снова, пока студент не укажет существующие номера
+            self.output.append("That wasn't a viable answer option. Please try again.")
+            return
+        self.output.append(f"Alright, so your preferred translation is {corr_trans}.")
+        self.add_word(corr_trans)
+    
+    def on_confirm(self, text):
+        feedback = text.lower()
+        if feedback == "yes":
+            self.add_word(self.trans_opt)
+        elif feedback == "no":
+            self.ask("own_translation", "Type in your translation here. ")
+        else:
+            self.output.append("That wasn't a viable answer option. Please try again.")
+    
+    def on_own_translation(self, text):
+        self.add_word(text.lower())
+
+def analyze(word_set, document, student=None, level=default_level):
+    """Выбрать новые для пользователя слова и верный перевод для них.
+    
+    word_set - множество потенциальных новых слов (set).
+    document - результат анализа текста (см. analyze_pages).
+    student - имя студента; если указано, ответы студента сохраняются (см. mark_word),
+    и в следующих текстах его не спрашивают о тех же словах.
+    level - уровень студента, от него зависит порядок слов (см. score_candidates).
+    
+    Студент указывает число новых слов, которые хочет записать - words_needed.
+    Программа поочередно показывает студенту слова из набора word_set, начиная с самых полезных, 
+    вместе с предложением, где они встретились. Пример ищется среди всех словоформ леммы, поэтому
+    перед показом первого слова один раз лемматизируются все слова текста (см. index_lemmas).
+    Диалог ведет Session, а эта функция только читает ответы из консоли и переводит слова.
+    """
+    session = Session(word_set, document, student, level)
+    while True:
+        for line in session.take_output():
+            print(line)
+        if session.done:
+            return session.new_words
+        if session.query is not None:
+            session.translated(translate_options(session.query))
+        else:
+            session.answer(input(session.prompt))
+            
+def iter_rows(new_words):
+    """Получить строки таблицы новых слов по одной: номер, слово, перевод (варианты через запятую) и пример."""
+    for num, (word, (trans, sent)) in enumerate(new_words.items(), 1):
+        if type(trans) != str:
+            trans = ", ".join(trans)
+        yield num, word, trans, sent
+
+def write_docx(new_words, doc_name):
+    """Сохранить в файл docx doc_name таблицу с новыми словами, их переводом и примером предложения.
+    
+    Строки добавляются в конец таблицы по одной (add_row): обращение к table.rows[i] каждый раз заново
+    собирает список строк, и с заранее созданной таблицей время записи растет квадратично.
+    Линейное время дает python-docx 1.x: в версиях 0.8 row.cells тоже перебирает всю таблицу.
+    """
+    word_document = Document()
+    table = word_document.add_table(0, 4)
+    
+    for row in iter_rows(new_words):
+        cells = table.add_row().cells
+        for cell, value in zip(cells, row):
+            cell.text = str(value)
         
     word_document.save(doc_name)
+
+def write_csv(new_words, file_name, delimiter=','):
+    """Сохранить в файл csv те же столбцы, что в таблице docx: номер, слово, перевод и пример."""
+    with open(file_name, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        writer.writerow(["number", "word", "translation", "example"])
+        writer.writerows(iter_rows(new_words))
+
+def write_tsv(new_words, file_name):
+    """Сохранить те же столбцы, что write_csv, через табуляцию."""
+    write_csv(new_words, file_name, delimiter='\t')
+
+def write_anki(new_words, file_name):
+    """Сохранить новые слова в текстовый файл для импорта в Anki: слово, перевод и пример через табуляцию.
+    
+    Заголовки #separator, #html и #columns позволяют Anki сразу распознать формат файла.
+    """
+    with open(file_name, 'w', encoding='utf-8', newline='') as file:
+        file.write("#separator:tab\n#html:false\n#columns:Word\tTranslation\tExample\n")
+        writer = csv.writer(file, delimiter='\t', lineterminator='\n')
+        writer.writerows(row[1:] for row in iter_rows(new_words))
+
+def write_json(new_words, file_name):
+    """Сохранить новые слова в файл json: список словарей с ключами word, translation и example."""
+    entries = [
+        {"word": word, "translation": trans, "example": sent}
+        for word, (trans, sent) in new_words.items()
+    ]
+    with open(file_name, 'w', encoding='utf-8') as file:
+        json.dump(entries, file, ensure_ascii=False, indent=2)
+
+writers = {
+    "docx": write_docx,
+    "csv": write_csv,
+    "tsv": write_tsv,
+    "anki": write_anki,
+    "json": write_json
+}
+
+def output_name(name, file_format):
+    """Получить имя файла для сохранения таблицы name в формате file_format (для Anki - <name>_anki.txt)."""
+    if file_format == "anki":
+        return f"{name}_anki.txt"
+    return f"{name}.{file_format}"
+
+def save_to_file(new_words):
+    """Сохранить таблицу с новыми словами, их переводом и примером предложения в один или несколько файлов.
+    
+    Пользователь указывает имя и форматы (см. writers), по умолчанию сохраняется файл docx.
+    """
+    name = input("What should I call the document? ").strip()
+    while True:
+        formats = input(f"Which formats do you need ({', '.join(writers)})? Press Enter for docx. ").lower().split()
+        formats = formats or ["docx"]
+        unknown = [file_format for file_format in formats if file_format not in writers]
+        if not unknown:
+            break
+        print(f"Sorry, I don't know these formats: {', '.join(unknown)}. Please try again.")
+    
+    file_names = []
+    for file_format in dict.fromkeys(formats):
+        file_name = output_name(name, file_format)
+        writers[file_format](new_words, file_name)
+        file_names.append(file_name)
+    
+    print(f"Your words, their translations and example sentences have been saved to {', '.join(file_names)}. Make sure to check it out!")
+
+def select_words(word_set, document, words_needed, level=default_level, known_words=None):
+    """Выбрать и перевести новые слова без участия пользователя.
+    
+    Берутся words_needed самых полезных слов из word_set (см. rank_candidates) с разными леммами,
+    которых нет в known_words. Все они переводятся
+    одним запросом (см. fetch_translations). Для каждого слова сохраняются все варианты перевода
+    и первый пример из текста. Результат - словарь new_words в том же формате, что у analyze.
+    Статус слов студента здесь не меняется (см. mark_exported).
+    """
+    if known_words is None:
+        known_words = set()
+    
+    chosen = {}
+    for word in rank_candidates(word_set, document, level):
+        if len(chosen) == words_needed:
+            break
+        lemma = get_lemma(word, document)
+        if lemma != "Not found" and lemma not in chosen and lemma not in known_words:
+            chosen[lemma] = translation_query(word, lemma)
+    
+    translations = fetch_translations(list(chosen.values()))
+    new_words = {}
+    for lemma, query in chosen.items():
+        text, options = translations[query]
+        the_sent = find_examples(lemma, document, order=example_order)[0].strip().replace('\n', ' ')
+        new_words[lemma] = [text] + [option for option in options if option != text], the_sent
+    
+    return new_words
+
+def mark_exported(student, new_words, document):
+    """Сохранить для студента student статус learning для всех словоформ слов из new_words, которые есть в тексте.
+    
+    Все словоформы сохраняются одной транзакцией (см. mark_words).
+    """
+    mark_words([(student, word, lemma, "learning")
+                for lemma in new_words for word in document["lemmas"].get(lemma, [lemma])])
+
+def timed_pages(pages, timings):
+    """Вернуть страницы из pages по одной и прибавить время, потраченное на извлечение каждой, к timings["extract"]."""
+    pages = iter(pages)
+    while True:
+        started = time.perf_counter()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        finally:
+            timings["extract"] += time.perf_counter() - started
+        yield page
+
+def process_document(address, level, words_needed, output_dir, formats, student=None, mark_learning=False):
+    """Обработать один файл без участия пользователя и сохранить таблицы новых слов.
+    
+    Файл проходит все этапы: извлечение текста, анализ, отбор слов, перевод и сохранение
+    в форматах formats (см. writers) в папку output_dir.
+    Если указан студент student, слова, которые он уже знает или учит, пропускаются. Если mark_learning=True,
+    слова, которые сохранены во все файлы, получают для студента статус learning, и при следующем запуске
+    их уже не будет в таблицах; по умолчанию статус не меняется, и повторный запуск дает те же таблицы.
+    Функция возвращает словарь со статистикой: время каждого этапа в секундах, число страниц и слов.
+    """
+    timings = {}
+    
+    # если файл уже обрабатывался с теми же настройками, извлекать и анализировать его не нужно (см. load_document)
+    started = time.perf_counter()
+    digest = file_digest(address)
+    num_pages = count_pages(address)
+    document = lookup_document(digest, 1, num_pages)
+    timings["extract"] = time.perf_counter() - started
     
-    print(f"Your words, their translations and example sentences have been saved to {doc_name}. Make sure to check it out!")
+    # страницы анализируются по мере извлечения: timed_pages добавляет время извлечения к timings["extract"],
+    # а остальное время считается временем анализа
+    started = time.perf_counter()
+    extract_before = timings["extract"]
+    if document is None:
+        pages = timed_pages(iter_cached_pages(address, 1, num_pages, 1, digest), timings)
+        document = analyze_and_store(pages, digest, 1, num_pages)
+    timings["analyze"] = time.perf_counter() - started - (timings["extract"] - extract_before)
     
+    started = time.perf_counter()
+    known_words = load_known_words(student) if student else None
+    word_set = get_word_set(document, level, known_words)
+    timings["select"] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    new_words = select_words(word_set, document, words_needed, level, known_words)
+    timings["translate"] = time.perf_counter() - started
+    # в кэш попадают и леммы, вычисленные при отборе слов
+    store_document(document)
+    
+    started = time.perf_counter()
+    name = os.path.splitext(os.path.basename(address))[0] + '_words'
+    for file_format in formats:
+        writers[file_format](new_words, os.path.join(output_dir, output_name(name, file_format)))
+    if student and mark_learning:
+        mark_exported(student, new_words, document)
+    timings["write"] = time.perf_counter() - started
+    
+    return {
+        "file": address,
+        "pages": num_pages,
+        "words": sum(document["lengths"]),
+        "new_words": len(new_words),
+        "timings": timings
+    }
+
+def batch_run(directory, level=default_level, words_needed=50, formats=("docx", ), output_dir=None, workers=None,
+              student=None, mark_learning=False):
+    """Обработать все файлы pdf, docx и txt из папки directory без участия пользователя.
+    
+    Файлы обрабатываются параллельно в workers процессах (см. process_document).
+    Для каждого файла и для всех файлов вместе выводится время каждого этапа 
+    и скорость обработки (страниц и слов в секунду). Если файл не удалось обработать (например, pdf поврежден),
+    выводится ошибка, и остальные файлы обрабатываются как обычно.
+    """
+    if output_dir is None:
+        output_dir = directory
+    os.makedirs(output_dir, exist_ok=True)
+    addresses = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in ('.pdf', '.docx', '.txt')
+        # таблицы новых слов, сохраненные при предыдущих запусках, не обрабатываются
+        and not os.path.splitext(name)[0].endswith(('_words', '_words_anki'))
+    )
+    print(f"Processing {len(addresses)} files from {directory}.")
+    
+    started = time.perf_counter()
+    all_stats = []
+    with ProcessPoolExecutor(workers) as executor:
+        jobs = {
+            executor.submit(process_document, address, level, words_needed, output_dir, formats, student,
+                            mark_learning): address
+            for address in addresses
+        }
+        for job in as_completed(jobs):
+            try:
+                stats = job.result()
+            except Exception as e:
+                print(f"Error: could not process {jobs[job]}: {e}")
+                continue
+            all_stats.append(stats)
+            stages = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in stats["timings"].items())
+            print(f"{stats['file']}: {stats['pages']} pages, {stats['words']} words, "
+                  f"{stats['new_words']} new words ({stages})")
+    elapsed = time.perf_counter() - started
+    
+    total_pages = sum(stats["pages"] for stats in all_stats)
+    total_words = sum(stats["words"] for stats in all_stats)
+    print(f"\nProcessed {len(all_stats)} of {len(addresses)} files in {elapsed:.2f} s: "
+          f"{total_pages / elapsed:.1f} pages/s, {total_words / elapsed:.1f} words/s.")
+    for stage in ("extract", "analyze", "select", "translate", "write"):
+        stage_total = sum(stats["timings"][stage] for stats in all_stats)
+        print(f"{stage}: {stage_total:.2f} s in total")
+    
+    return all_stats
+    
+class SessionEngine:
+    """Асинхронный движок, который ведет диалоги (Session) со многими студентами одновременно.
+    
+    Анализ текстов (load_document) выполняется в пуле из workers процессов, причем каждый текст
+    анализируется один раз для всех студентов, которые с ним работают. Переводы запрашиваются
+    в пуле потоков translation_workers, поэтому, пока одна сессия ждет перевод, остальные продолжают работу.
+    Шаги сессий (лемматизация, загрузка WordNet, чтение и запись known_words.db) выполняются в отдельном
+    потоке, чтобы не задерживать цикл событий. Поток один: соединение sqlite можно использовать только из потока,
+    где оно создано, а общий для сессий документ (см. get_lemma) меняется без блокировок.
+    Ответы студентов не записываются по одному, а накапливаются и сохраняются одной транзакцией
+    раз в mark_interval секунд (см. mark_words) и при остановке движка (shutdown).
+    Сессии различаются по session_id. Методы open_session и reply возвращают текст, который
+    нужно показать студенту: сообщения и следующий вопрос.
+    """
+    
+    def __init__(self, workers=None, translation_workers=8, mark_interval=0.5):
+        self.analysis_executor = ProcessPoolExecutor(workers)
+        self.translation_executor = ThreadPoolExecutor(translation_workers)
+        self.session_executor = ThreadPoolExecutor(1, thread_name_prefix="sessions")
+        self.documents = {}
+        self.sessions = {}
+        self.mark_interval = mark_interval
+        self.pending_marks = []
+        self.flusher = None
+    
+    async def get_document(self, address, start=1, end=None):
+        """Получить анализ текста: если этот текст уже анализируется для другой сессии, результат ожидается."""
+        key = (os.path.abspath(address), start, end)
+        if key not in self.documents:
+            loop = asyncio.get_running_loop()
+            self.documents[key] = loop.run_in_executor(self.analysis_executor, load_document, address, start, end)
+        try:
+            return await self.documents[key]
+        except Exception:
+            # неудачный анализ не сохраняется, чтобы следующая сессия попробовала снова
+            self.documents.pop(key, None)
+            raise
+    
+    async def open_session(self, session_id, address, start=1, end=None, student=None, level=default_level):
+        """Начать диалог session_id по страницам с start по end файла address."""
+        if session_id in self.sessions:
+            raise ValueError(f"The session {session_id} already exists")
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_marks_periodically())
+        document = await self.get_document(address, start, end)
+        session = await self.in_session_thread(self.create_session, document, student, level)
+        self.sessions[session_id] = session
+        return await self.respond(session)
+    
+    def create_session(self, document, student, level):
+        known_words = load_known_words(student) if student else set()
+        word_set = get_word_set(document, level, known_words)
+        return Session(word_set, document, student, level, known_words, self.queue_mark)
+    
+    def queue_mark(self, student, word, lemma, status):
+        """Запомнить ответ студента, чтобы сохранить его вместе с другими (выполняется в потоке сессий)."""
+        self.pending_marks.append((student, word, lemma, status))
+    
+    def flush_marks(self):
+        """Сохранить накопленные ответы студентов одной транзакцией (выполняется в потоке сессий)."""
+        rows, self.pending_marks = self.pending_marks, []
+        if rows:
+            mark_words(rows)
+    
+    async def flush_marks_periodically(self):
+        while True:
+            await asyncio.sleep(self.mark_interval)
+            await self.in_session_thread(self.flush_marks)
+    
+    async def in_session_thread(self, function, *args):
+        """Выполнить function(*args) в потоке сессий, не блокируя цикл событий."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.session_executor, function, *args)
+    
+    async def reply(self, session_id, text):
+        """Передать ответ студента в сессию session_id и получить следующее сообщение."""
+        session = self.sessions[session_id]
+        await self.in_session_thread(session.answer, text)
+        return await self.respond(session)
+    
+    async def respond(self, session):
+        """Перевести слово, если оно нужно сессии, и собрать сообщения и следующий вопрос в один текст."""
+        output = session.take_output()
+        if session.query is not None:
+            loop = asyncio.get_running_loop()
+            trans_opt = await loop.run_in_executor(self.translation_executor, translate_options, session.query)
+            session.translated(trans_opt)
+            output.extend(session.take_output())
+        if not session.done:
+            output.append(session.prompt)
+        return "\n".join(output)
+    
+    def close_session(self, session_id):
+        """Закончить сессию session_id и получить выбранные студентом слова (словарь new_words, как у analyze)."""
+        return self.sessions.pop(session_id).new_words
+    
+    def shutdown(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        self.session_executor.submit(self.flush_marks).result()
+        self.analysis_executor.shutdown()
+        self.translation_executor.shutdown()
+        self.session_executor.shutdown()
+
+def warm_up():
+    """Загрузить WordNet, токенизатор и частеречный теггер nltk заранее.
+    
+    Все они загружаются при первом использовании, и без разогрева первая лемматизация или разметка
+    посреди работы заметно задерживается. Время каждого шага записывается в load_times.
+    """
+    steps = [
+        ("WordNet", lambda: lemmatize_word("words", "n")),
+        ("nltk tokenizer", lambda: nltk.word_tokenize("Warm up.", language=language)),
+        ("nltk tagger", lambda: nltk.pos_tag(["warm", "up"]))
+    ]
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except LookupError:
+            # данные nltk не установлены, ошибка появится при обычном использовании
+            continue
+        load_times[name] = (time.perf_counter() - started, threading.current_thread().name)
+
+def start_warm_up():
+    """Запустить warm_up в фоновом потоке."""
+    global warm_up_thread
+    warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    warm_up_thread.start()
+
+def wait_for_warm_up():
+    """Дождаться окончания разогрева, если он запущен, чтобы не загружать данные nltk одновременно из двух потоков."""
+    if warm_up_thread is not None:
+        warm_up_thread.join()
+
+def startup_report():
+    """Вывести время импорта программы, загрузки каждого тяжелого модуля и шагов разогрева."""
+    print(f"\nImporting learn_new_words took {import_time:.3f} s (target {startup_target:.3f} s).")
+    if import_time > startup_target:
+        print("Startup is slower than the target!")
+    for name, (seconds, thread) in sorted(load_times.items(), key=lambda item: -item[1][0]):
+        print(f"{name:<30}{seconds:>8.3f} s  ({thread})")
+
 def run():
-    """Запустить программу."""
+    """Запустить программу.
     
-    text = get_text()
-    if text:
-        word_set = get_word_set(text)
-        sentence_list = get_sentence_list(text)
-        new_words = analyze(word_set, sentence_list)
+    Пока пользователь выбирает файл, WordNet и модели nltk загружаются в фоновом потоке (см. warm_up).
+    """
+    start_warm_up()
+    choice = choose_file()
+    if choice:
+        wait_for_warm_up()
+        document = load_document(*choice)
+        student = input("What's your name? I'll remember the words you already know. ").strip()
+        word_set = get_word_set(document, known_words=load_known_words(student))
+        new_words = analyze(word_set, document, student)
+        # в кэш попадают и леммы, вычисленные во время работы
+        store_document(document)
         
         if new_words:
             save_to_file(new_words)
 
+import_time = time.perf_counter() - import_started
+
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Find new words in an English text and save them with translations.")
+    parser.add_argument("--batch", metavar="DIRECTORY", help="process all pdf, docx and txt files in DIRECTORY without questions")
+    parser.add_argument("--level", default=default_level, choices=level_profiles, help="student level for batch mode")
+    parser.add_argument("--words", type=int, default=50, help="number of new words per file in batch mode")
+    parser.add_argument("--format", nargs="+", default=["docx"], choices=writers, help="output formats for batch mode")
+    parser.add_argument("--output", metavar="DIRECTORY", help="where to save the results of batch mode")
+    parser.add_argument("--workers", type=int, help="number of processes for batch mode")
+    parser.add_argument("--student", help="skip the words this student already knows or learns")
+    parser.add_argument("--mark-learning", action="store_true",
+                        help="with --student, remember the exported words as learning so later runs skip them")
+    parser.add_argument("--startup-report", action="store_true", help="show how long the program and its modules took to load")
+    args = parser.parse_args()
+    
+    if args.batch:
+        batch_run(args.batch, args.level, args.words, args.format, args.output, args.workers, args.student,
+                  args.mark_learning)
+    else:
+        run()
+    if args.startup_report:
+        startup_report()
@@ -0,0 +1,559 @@
+import asyncio
+import csv
+import json
+import multiprocessing
+import re
+
+import numpy as np
+import pytest
+
+import learn_new_words as lnw
+
+# исходные функции, которые в большинстве тестов заменены заглушками
+zipf_scores = lnw.zipf_scores
+
+PAGES = ["A cat sat on a mat. The cat ran.", " A dog ran home."]
+VERBS = {"sat", "ran"}
+PLURALS = {"cats", "dogs"}
+
+def stub_tagger(sent):
+    tags = {word: "VBD" for word in VERBS} | {word: "NNS" for word in PLURALS}
+    return tuple((word, tags.get(word, "NN")) for word in re.findall(r"\w+|[^\w\s]", sent))
+
+def stub_lemmatize(word, tag):
+    if tag.startswith("V"):
+        return f"to {word}"
+    return word[:-1] if tag == "NNS" else word
+
+@pytest.fixture(autouse=True)
+def no_nltk_data(monkeypatch):
+    """Заменить части, которым нужны данные nltk и wordfreq, простыми детерминированными функциями."""
+    monkeypatch.setattr(lnw, "get_sentence_spans",
+                        lambda text: [match.span() for match in re.finditer(r"\S[^.]*(?:\.|$)", text)])
+    monkeypatch.setattr(lnw, "zipf_scores", lambda words, lang: np.full(len(words), 4.0))
+    monkeypatch.setattr(lnw, "lemmatize", stub_lemmatize)
+
+def test_iter_sentences_joins_sentences_across_pages():
+    parts = []
+    sentences = list(lnw.iter_sentences(["The cat sat. The dog ran", " far away. Birds sing."], parts))
+
+    assert [(page, sent) for page, start, end, sent in sentences] == [
+        (0, "The cat sat."), (0, "The dog ran far away."), (1, "Birds sing.")]
+    text = "".join(parts)
+    assert all(text[start:end] == sent for page, start, end, sent in sentences)
+
+def test_iter_sentences_empty():
+    assert list(lnw.iter_sentences([])) == []
+
+def test_analyze_pages_tags_every_sentence_once():
+    tagged = []
+    def tagger(sent):
+        tagged.append(sent)
+        return stub_tagger(sent)
+    document = lnw.analyze_pages(PAGES, tagger=tagger)
+
+    assert tagged == ["A cat sat on a mat.", "The cat ran.", "A dog ran home."]
+    assert document["text"] == "".join(PAGES)
+    assert list(document["lengths"]) == [7, 4, 5]
+    # слова с заглавной буквы (имена собственные) в words не попадают
+    assert "A" not in document["words"] and "The" not in document["words"]
+    assert document["words"]["ran"] == "VBD"
+    assert document["words"]["dog"] == "NN"
+    counts = dict(zip(document["vocab"], document["counts"]))
+    assert counts["cat"] == 2 and counts["dog"] == 1
+
+def test_postings():
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+
+    # слова с заглавной буквы тоже попадают в postings, а каждое предложение записывается один раз
+    assert lnw.get_postings("A", document).tolist() == [0, 2]
+    assert lnw.get_postings("cat", document).tolist() == [0, 1]
+    assert lnw.get_postings("ran", document).tolist() == [1, 2]
+    assert lnw.get_postings("unicorn", document).tolist() == []
+    # индексы всех слов лежат в одном массиве
+    assert document["postings"].dtype == np.int32
+    assert len(document["postings"]) == document["posting_starts"][-1] == 13
+    assert lnw.get_sentence(document, 2) == "A dog ran home."
+    assert lnw.find_sent("dog", document) == "A dog ran home."
+    assert lnw.find_sent("unicorn", document) is None
+
+def test_find_examples_covers_every_form_of_the_lemma():
+    pages = ["Two cats sat here. A cat ran.", " The dogs ran to the cats and the cats ran off."]
+    document = lnw.analyze_pages(pages, tagger=stub_tagger)
+
+    # леммы заранее не вычислялись, но примеры находятся для всех словоформ
+    assert lnw.find_examples("cat", document, n=5) == [
+        "Two cats sat here.", "A cat ran.", "The dogs ran to the cats and the cats ran off."]
+    assert sorted(document["lemmas"]["cat"]) == ["cat", "cats"]
+    assert lnw.find_examples("cat", document, n=2, order="shortest") == ["A cat ran.", "Two cats sat here."]
+    assert lnw.find_examples("to ran", document) == ["A cat ran."]
+    assert lnw.find_examples("unicorn", document) == []
+    with pytest.raises(ValueError):
+        lnw.find_examples("cat", document, order="random")
+
+def test_find_examples_best_length(monkeypatch):
+    monkeypatch.setattr(lnw, "example_length", 6)
+    document = lnw.analyze_pages(["A cat. The big cat sat down. The cat sat on the mat again and again."], tagger=stub_tagger)
+
+    assert lnw.find_examples("cat", document, order="best") == ["The big cat sat down."]
+
+def test_read_pages_of_txt(tmp_path):
+    address = tmp_path / "book.txt"
+    address.write_text("First page.\nStill first.\fSecond page.", encoding="utf-8")
+
+    assert lnw.read_pages(str(address)) == ["First page. Still first.\n", "Second page.\n"]
+    assert list(lnw.iter_pages(str(address), 2)) == ["Second page.\n"]
+    with pytest.raises(IndexError):
+        list(lnw.iter_pages(str(address), 2, 3))
+
+def test_choose_file_explains_every_bad_file(tmp_path, monkeypatch, capsys):
+    (tmp_path / "broken.docx").write_bytes(b"not a zip file")
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf file")
+    (tmp_path / "picture.png").write_bytes(b"\x89PNG\r\n\x1a\n\xff\xfe")
+    good = tmp_path / "book.txt"
+    good.write_text("One.\fTwo.\fThree.", encoding="utf-8")
+    chosen = iter(str(tmp_path / name) for name in ("broken.docx", "broken.pdf", "picture.png", "book.txt", "book.txt"))
+    answers = iter(["2-5", "2-3"])
+    monkeypatch.setattr(lnw, "filedialog", type("Dialog", (), {"askopenfilename": staticmethod(lambda **kwargs: next(chosen))}))
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    assert lnw.choose_file() == (str(good), 2, 3)
+    out = capsys.readouterr().out
+    assert "not a docx file or it is damaged" in out
+    assert "this pdf file is damaged" in out
+    assert "this is not a text file" in out
+    assert out.count("The range seems wrong") == 1
+
+def test_choose_file_missing_file(monkeypatch, capsys):
+    monkeypatch.setattr(lnw, "filedialog", type("Dialog", (), {"askopenfilename": staticmethod(lambda **kwargs: "")}))
+
+    assert lnw.choose_file() is None
+    assert "doesn't exist" in capsys.readouterr().out
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """Кэш переводов во временной папке и переводчик-заглушка, который запоминает каждый запрос."""
+    requests = []
+    def translate(words, src, dest):
+        requests.append(list(words))
+        if "broken" in words:
+            raise ConnectionError("no network")
+        return [(f"{word}-ru", [f"{word}-ru", f"{word}-ru2"] if word.startswith("multi") else []) for word in words]
+    monkeypatch.setattr(lnw, "translation_cache_path", str(tmp_path / "translations.db"))
+    monkeypatch.setattr(lnw, "translation_cache", None)
+    monkeypatch.setattr(lnw, "translation_backend", translate)
+    monkeypatch.setattr(lnw, "pending_translations", {})
+    monkeypatch.setattr(lnw, "prefetch_executor", None)
+    yield requests
+    if lnw.prefetch_executor is not None:
+        lnw.prefetch_executor.shutdown()
+    if lnw.translation_cache is not None:
+        lnw.translation_cache.close()
+
+def test_fetch_translations_uses_the_cache(backend):
+    assert lnw.fetch_translations(["cat", "dog", "cat"]) == {"cat": ("cat-ru", []), "dog": ("dog-ru", [])}
+    assert lnw.fetch_translations(["dog", "fox"])["fox"] == ("fox-ru", [])
+    assert backend == [["cat", "dog"], ["fox"]]
+
+def test_old_translations_are_fetched_again(backend, monkeypatch):
+    lnw.fetch_translations(["cat"])
+    monkeypatch.setattr(lnw, "translation_ttl", -1)
+    lnw.fetch_translations(["cat"])
+
+    assert backend == [["cat"], ["cat"]]
+    assert lnw.get_translation_cache().execute(""" SELECT COUNT(*) FROM translations """).fetchone()[0] == 0
+
+def test_cache_keeps_the_recently_used_translations(backend, monkeypatch):
+    monkeypatch.setattr(lnw, "translation_cache_size", 2)
+    lnw.fetch_translations(["cat", "dog"])
+    cache = lnw.get_translation_cache()
+    cache.execute(""" UPDATE translations SET used_at = CASE word WHEN 'cat' THEN 2 ELSE 1 END """)
+    lnw.fetch_translations(["fox"])
+
+    assert sorted(word for word, in cache.execute(""" SELECT word FROM translations """)) == ["cat", "fox"]
+
+def test_translate_options(backend):
+    assert lnw.translate_options("cat") == "cat-ru"
+    assert lnw.translate_options("multiple") == ["1. multiple-ru", "2. multiple-ru2"]
+
+def test_prefetched_translations_are_not_requested_again(backend):
+    lnw.prefetch_translations(["cat", "dog"])
+    lnw.prefetch_translations(["dog"])
+    # shutdown ждет, пока запросы и их обратные вызовы завершатся
+    lnw.prefetch_executor.shutdown()
+
+    assert lnw.translate_options("dog") == "dog-ru"
+    assert lnw.translate_options("cat") == "cat-ru"
+    assert backend == [["cat", "dog"]]
+    assert lnw.pending_translations == {}
+
+def test_failed_prefetch_is_requested_again(backend):
+    lnw.prefetch_translations(["broken", "cat"])
+    # shutdown ждет, пока запросы и их обратные вызовы завершатся
+    lnw.prefetch_executor.shutdown()
+    assert lnw.pending_translations == {}
+
+    assert lnw.translate_options("cat") == "cat-ru"
+    assert backend == [["broken", "cat"], ["cat"]]
+
+def test_zipf_scores_use_the_frequency_table(monkeypatch):
+    monkeypatch.setattr(lnw, "frequency_tables", {"en": {"cat": 1e-5, "mat": 1e-7}})
+
+    assert zipf_scores(["cat", "mat", "unicorn"], "en").tolist() == [4.0, 2.0, 0.0]
+
+@pytest.mark.parametrize("level, expected", [("A2", {"cat"}), ("B1", {"dog"}), ("C1", {"mat", "home"}),
+                                             ("C2", {"mat"})])
+def test_get_word_set_uses_the_level_profile(level, expected):
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    zipf = {"cat": 4.2, "dog": 3.5, "ran": 5.5, "sat": 5.0, "on": 7.0, "a": 7.5, "mat": 2.0, "home": 2.7}
+    document["zipf"] = np.array([zipf[word] for word in document["vocab"]])
+
+    assert lnw.get_word_set(document, level) == expected
+    assert lnw.get_word_set(document, level, known_words={"cat", "mat"}) == expected - {"cat", "mat"}
+
+@pytest.fixture
+def analysis_cache(tmp_path, monkeypatch):
+    """Кэш анализа во временной папке."""
+    monkeypatch.setattr(lnw, "analysis_cache_path", str(tmp_path / "analysis_cache.db"))
+    monkeypatch.setattr(lnw, "analysis_cache", None)
+    yield
+    if lnw.analysis_cache is not None:
+        lnw.analysis_cache.close()
+
+# заглушки передаются в процессы batch_run только при запуске процессов через fork
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="the worker processes need the stubs")
+def test_batch_run_reports_a_broken_file_and_goes_on(tmp_path, monkeypatch, capsys, backend, analysis_cache):
+    monkeypatch.setattr(lnw, "tag_sentence", stub_tagger)
+    texts = tmp_path / "texts"
+    texts.mkdir()
+    (texts / "story.txt").write_text("".join(PAGES), encoding="utf-8")
+    (texts / "broken.pdf").write_bytes(b"not a pdf file")
+    # таблица из прошлого запуска не обрабатывается как текст
+    (texts / "old_words.txt").write_text("1,cat,кошка,A cat.", encoding="utf-8")
+    output = tmp_path / "results" / "week 1"
+
+    all_stats = lnw.batch_run(str(texts), "A2", 2, ("csv", ), str(output), workers=2)
+
+    out = capsys.readouterr().out
+    assert f"Error: could not process {texts / 'broken.pdf'}" in out
+    assert "Processed 1 of 2 files" in out
+    assert [stats["file"] for stats in all_stats] == [str(texts / "story.txt")]
+    assert all_stats[0]["new_words"] == 2
+    with open(output / "story_words.csv", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["number", "word", "translation", "example"]
+    assert len(rows) == 3
+
+def test_document_json_roundtrip():
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    lnw.index_lemmas(document)
+    restored = lnw.document_from_json(lnw.document_to_json(document))
+
+    assert restored["text"] == document["text"]
+    assert (restored["offsets"] == document["offsets"]).all()
+    assert list(restored["lengths"]) == list(document["lengths"])
+    for key in ("words", "vocab", "vocab_ids", "lemma_of", "lemmas", "num_pages"):
+        assert restored[key] == document[key]
+    for key in ("zipf", "counts", "page_counts", "postings", "posting_starts"):
+        assert (restored[key] == document[key]).all()
+    assert lnw.find_examples("cat", restored, n=2) == lnw.find_examples("cat", document, n=2)
+
+def cache_size():
+    return lnw.analysis_cache.execute(f""" SELECT SUM(size) FROM ({lnw.analysis_cache_entries}) """).fetchone()[0]
+
+def test_load_document_drops_entries_of_old_settings(tmp_path, monkeypatch, analysis_cache):
+    tagged = []
+    monkeypatch.setattr(lnw, "tag_sentence", lambda sent: tagged.append(sent) or stub_tagger(sent))
+    address = tmp_path / "story.txt"
+    address.write_text("\n".join(["A cat sat on a mat.", "The cat ran.", "A dog ran home."]), encoding="utf-8")
+    monkeypatch.setattr(lnw, "lines_per_page", 2)
+    lnw.load_document(str(address))
+    lnw.load_document(str(address))
+    assert len(tagged) == 3
+
+    monkeypatch.setattr(lnw, "lines_per_page", 1)
+    document = lnw.load_document(str(address))
+
+    # текст страниц извлекается заново, а размеченные предложения берутся из кэша
+    assert len(tagged) == 3
+    assert document["num_pages"] == 3
+    cache = lnw.analysis_cache
+    assert cache.execute(""" SELECT DISTINCT paging FROM pages """).fetchall() == [(lnw.paging(), )]
+    assert cache.execute(""" SELECT settings FROM documents """).fetchall() == [(lnw.settings_fingerprint(), )]
+    assert lnw.analysis_cache_total == cache_size()
+
+def test_trim_removes_the_least_recently_used_entries(monkeypatch, analysis_cache):
+    monkeypatch.setattr(lnw, "analysis_cache_size", 250)
+    monkeypatch.setattr(lnw.time, "time", lambda: 1.0)
+    lnw.store_pages("old", 1, ["x" * 100, "y" * 100])
+    monkeypatch.setattr(lnw.time, "time", lambda: 2.0)
+    lnw.store_pages("new", 1, ["z" * 100, "w" * 100])
+
+    # страницы сохраняются без сокращения кэша, оно выполняется один раз на документ
+    assert lnw.analysis_cache_total == cache_size() == 400
+    lnw.trim_analysis_cache()
+
+    assert lnw.analysis_cache.execute(""" SELECT DISTINCT file_hash FROM pages """).fetchall() == [("new", )]
+    assert lnw.analysis_cache_total == cache_size() == 200
+
+def test_cache_stats_count_lemma_and_sentence_hits(monkeypatch):
+    lemmatized = []
+    class Lemmatizer:
+        def lemmatize(self, word, tag):
+            lemmatized.append((word, tag))
+            return word.rstrip("s")
+    class Nltk:
+        word_tokenize = staticmethod(lambda sent, language: sent.split())
+        pos_tag = staticmethod(lambda tokens: [(token, "NN") for token in tokens])
+    monkeypatch.setattr(lnw, "lemmatizer", Lemmatizer())
+    monkeypatch.setattr(lnw, "nltk", Nltk())
+    lnw.lemmatize_word.cache_clear()
+    lnw.tag_sentence.cache_clear()
+    try:
+        assert [lnw.lemmatize_word("cats", "n"), lnw.lemmatize_word("cats", "n"), lnw.lemmatize_word("cats", "v")] == ["cat"] * 3
+        assert lnw.tag_sentence("Two cats") == lnw.tag_sentence("Two cats") == (("Two", "NN"), ("cats", "NN"))
+        
+        assert lemmatized == [("cats", "n"), ("cats", "v")]
+        stats = lnw.cache_stats()
+        assert (stats["lemmas"]["hits"], stats["lemmas"]["misses"], stats["lemmas"]["maxsize"]) == (1, 2, lnw.lemma_cache_size)
+        assert (stats["sentences"]["hits"], stats["sentences"]["misses"]) == (1, 1)
+    finally:
+        lnw.lemmatize_word.cache_clear()
+        lnw.tag_sentence.cache_clear()
+
+@pytest.fixture
+def known_words_db(tmp_path, monkeypatch):
+    """База known_words.db во временной папке."""
+    monkeypatch.setattr(lnw, "known_words_path", str(tmp_path / "known_words.db"))
+    monkeypatch.setattr(lnw, "known_words_db", None)
+    yield
+    if lnw.known_words_db is not None:
+        lnw.known_words_db.close()
+
+@pytest.fixture
+def no_prefetch(monkeypatch):
+    """Не переводить следующие слова в фоне, а только запомнить, какие слова были бы переведены."""
+    prefetched = []
+    monkeypatch.setattr(lnw, "prefetch_translations", prefetched.extend)
+    return prefetched
+
+def test_known_words_are_kept_per_student(known_words_db):
+    lnw.mark_word("ann", "cats", "cat", "known")
+    lnw.mark_words([("ann", "ran", "to run", "learning"), ("ann", "fox", "fox", "new"), ("bob", "mat", "mat", "known")])
+
+    assert lnw.load_known_words("ann") == {"cats", "cat", "ran", "to run"}
+    assert lnw.load_known_words("bob") == {"mat"}
+    assert lnw.load_known_words("eve") == set()
+    lnw.mark_word("ann", "fox", "fox", "learning")
+    assert "fox" in lnw.load_known_words("ann")
+
+def test_session_skips_known_words_and_lemmas(known_words_db, no_prefetch):
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    lnw.mark_words([("ann", "ran", "to ran", "known"), ("ann", "cats", "cat", "learning")])
+    session = lnw.Session({"ran", "cat", "dog"}, document, student="ann", mark=lambda *row: None)
+    session.answer("5")
+
+    # ran исключается по словоформе, а cat - по лемме, хотя студент видел только форму cats
+    assert session.word == "dog"
+    session.answer("yes")
+    assert session.done
+
+def test_mark_exported_saves_every_form_in_one_transaction(known_words_db, monkeypatch):
+    pages = ["Two cats sat. A cat ran."]
+    document = lnw.analyze_pages(pages, tagger=stub_tagger)
+    lnw.index_lemmas(document)
+    calls = []
+    mark_words = lnw.mark_words
+    monkeypatch.setattr(lnw, "mark_words", lambda rows: calls.append(rows) or mark_words(rows))
+    lnw.mark_exported("ann", {"cat": ("кошка", "A cat ran."), "to ran": ("бежать", "A cat ran.")}, document)
+
+    assert len(calls) == 1
+    rows = lnw.get_known_words_db().execute(""" SELECT word, lemma, status FROM student_words ORDER BY word """).fetchall()
+    assert rows == [("cat", "cat", "learning"), ("cats", "cat", "learning"), ("ran", "to ran", "learning")]
+
+def test_page_counts_use_the_page_where_the_sentence_starts():
+    document = lnw.analyze_pages(["A cat sat. The dog", " ran home.", " A cat ran."], tagger=stub_tagger)
+    page_counts = dict(zip(document["vocab"], document["page_counts"]))
+
+    assert document["num_pages"] == 3
+    # The dog ran home. начинается на первой странице
+    assert (page_counts["cat"], page_counts["dog"], page_counts["home"], page_counts["ran"]) == (2, 1, 1, 2)
+
+def test_candidates_are_ranked_by_frequency_spread_and_level():
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    # ran встречается дважды на двух страницах, cat - дважды на одной, dog и mat - по разу
+    scores = lnw.score_candidates({"ran", "cat", "dog", "mat"}, document, "A2")
+
+    assert scores["ran"] > scores["cat"] > scores["dog"] == scores["mat"]
+    # при равных оценках слова идут по алфавиту
+    assert list(lnw.rank_candidates({"ran", "cat", "dog", "mat"}, document, "A2")) == ["ran", "cat", "dog", "mat"]
+    assert lnw.top_candidates({"ran", "cat", "dog", "mat"}, document, 3, "A2") == ["ran", "cat", "dog"]
+    # чем ближе слово к верхней границе частотности уровня, тем выше оценка
+    document["zipf"][document["vocab_ids"]["mat"]] = 4.5
+    assert lnw.score_candidates({"dog", "mat"}, document, "A2")["mat"] > lnw.score_candidates({"dog"}, document, "A2")["dog"]
+
+NEW_WORDS = {"cat": (["кошка", "кот"], "A cat sat, then ran."), "to ran": ("бежать", "The cat ran.")}
+
+def test_write_docx(tmp_path):
+    docx = pytest.importorskip("docx")
+    lnw.write_docx(NEW_WORDS, str(tmp_path / "words.docx"))
+
+    table = docx.Document(str(tmp_path / "words.docx")).tables[0]
+    assert [[cell.text for cell in row.cells] for row in table.rows] == [
+        ["1", "cat", "кошка, кот", "A cat sat, then ran."], ["2", "to ran", "бежать", "The cat ran."]]
+
+def test_write_csv_and_tsv(tmp_path):
+    lnw.write_csv(NEW_WORDS, str(tmp_path / "words.csv"))
+    lnw.write_tsv(NEW_WORDS, str(tmp_path / "words.tsv"))
+
+    for name, delimiter in (("words.csv", ","), ("words.tsv", "\t")):
+        with open(tmp_path / name, encoding="utf-8", newline="") as file:
+            assert list(csv.reader(file, delimiter=delimiter)) == [
+                ["number", "word", "translation", "example"],
+                ["1", "cat", "кошка, кот", "A cat sat, then ran."], ["2", "to ran", "бежать", "The cat ran."]]
+
+def test_write_anki(tmp_path):
+    lnw.write_anki(NEW_WORDS, str(tmp_path / "words_anki.txt"))
+
+    assert (tmp_path / "words_anki.txt").read_text(encoding="utf-8") == (
+        "#separator:tab\n#html:false\n#columns:Word\tTranslation\tExample\n"
+        "cat\tкошка, кот\tA cat sat, then ran.\nto ran\tбежать\tThe cat ran.\n")
+
+def test_write_json(tmp_path):
+    lnw.write_json(NEW_WORDS, str(tmp_path / "words.json"))
+
+    with open(tmp_path / "words.json", encoding="utf-8") as file:
+        assert json.load(file) == [
+            {"word": "cat", "translation": ["кошка", "кот"], "example": "A cat sat, then ran."},
+            {"word": "to ran", "translation": "бежать", "example": "The cat ran."}]
+
+def test_output_name():
+    assert [lnw.output_name("book_words", file_format) for file_format in lnw.writers] == [
+        "book_words.docx", "book_words.csv", "book_words.tsv", "book_words_anki.txt", "book_words.json"]
+
+def test_session_state_transitions(known_words_db, no_prefetch):
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    marks = []
+    session = lnw.Session({"ran", "cat", "dog"}, document, student="ann", mark=lambda *row: marks.append(row))
+    assert session.take_output() == ["I have found 3 words you might not know."]
+
+    session.answer("many")
+    assert session.state == "words_needed"
+    assert session.take_output() == ["That wasn't a viable answer option. Please try again."]
+    session.answer("2")
+    assert (session.state, session.lemma, session.the_sent) == ("known", "to ran", "The cat ran.")
+    # следующие слова переводятся в фоне, пока студент отвечает
+    assert no_prefetch == ["cat", "dog"]
+
+    session.answer("yes")
+    assert (session.state, session.word) == ("known", "cat")
+    session.answer("maybe")
+    assert session.state == "known"
+    session.answer("no")
+    assert (session.state, session.query) == ("translate", "cat")
+    with pytest.raises(RuntimeError):
+        session.answer("yes")
+    session.translated(["1. кот", "2. кошка"])
+    assert session.state == "choose"
+    session.answer("3")
+    assert session.state == "choose"
+    session.answer("2")
+    assert session.new_words == {"cat": (["кошка"], "A cat sat on a mat.")}
+
+    assert session.word == "dog"
+    session.answer("0")
+    assert session.state == "correct_form"
+    session.answer("Dogs")
+    assert (session.state, session.lemma, session.query) == ("translate", "dogs", "dog")
+    session.translated("собака")
+    assert session.state == "confirm"
+    session.answer("perhaps")
+    assert session.state == "confirm"
+    session.answer("no")
+    assert session.state == "own_translation"
+    session.answer("Пёс")
+
+    assert session.done
+    assert session.new_words["dogs"] == ("пёс", "A dog ran home.")
+    assert session.take_output()[-1] == "Seems like you have all the words you need!"
+    assert marks == [("ann", "ran", "to ran", "known"), ("ann", "cat", "cat", "new"), ("ann", "cat", "cat", "learning"),
+                     ("ann", "dog", "dogs", "new"), ("ann", "dog", "dogs", "learning")]
+
+def test_session_stops_when_the_words_run_out(no_prefetch):
+    document = lnw.analyze_pages(PAGES, tagger=stub_tagger)
+    session = lnw.Session({"ran", "dog"}, document)
+    session.answer("5")
+    session.answer("yes")
+    session.answer("yes")
+
+    assert session.done
+    assert session.new_words == {}
+    with pytest.raises(RuntimeError):
+        session.answer("yes")
+
+def test_correct_trans():
+    options = ["1. кот", "2. кошка", "3. котик"]
+    assert lnw.correct_trans(options, ["3", "1"]) == ["котик", "кот"]
+    with pytest.raises(ValueError):
+        lnw.correct_trans(options, ["4"])
+    with pytest.raises(ValueError):
+        lnw.correct_trans(options, ["two"])
+
+# документ анализируется в процессе, который получает заглушки только при запуске через fork
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="the worker process needs the stubs")
+def test_session_engine_serves_several_students(tmp_path, monkeypatch, backend, analysis_cache, known_words_db,
+                                                no_prefetch):
+    monkeypatch.setattr(lnw, "tag_sentence", stub_tagger)
+    address = tmp_path / "story.txt"
+    address.write_text("".join(PAGES), encoding="utf-8")
+
+    async def dialog(engine, session_id, student, answers):
+        replies = [await engine.open_session(session_id, str(address), student=student, level="A2")]
+        for answer in answers:
+            replies.append(await engine.reply(session_id, answer))
+        return replies, engine.close_session(session_id)
+
+    async def main():
+        engine = lnw.SessionEngine(workers=1, mark_interval=0.01)
+        try:
+            results = await asyncio.gather(dialog(engine, "1", "ann", ["1", "no", "yes"]),
+                                           dialog(engine, "2", "bob", ["1", "yes"]))
+            return results, len(engine.documents)
+        finally:
+            engine.shutdown()
+
+    results, num_documents = asyncio.run(main())
+    (ann_replies, ann_words), (bob_replies, bob_words) = results
+
+    assert num_documents == 1
+    assert ann_replies[0].startswith("I have found")
+    assert ann_replies[0].endswith("How many words do you need? Type a number. ")
+    assert "The translation of this word is cat-ru" in ann_replies[2]
+    assert ann_words == {"cat": ("cat-ru", "A cat sat on a mat.")}
+    assert bob_words == {}
+    assert backend == [["cat"]]
+    # соединение с known_words.db создано в потоке сессий, поэтому база открывается заново
+    monkeypatch.setattr(lnw, "known_words_db", None)
+    status = lnw.get_known_words_db().execute(""" SELECT student, status FROM student_words ORDER BY student """)
+    assert status.fetchall() == [("ann", "learning"), ("bob", "known")]
+
+def test_session_engine_analyzes_a_text_once(tmp_path, monkeypatch):
+    calls = []
+    async def main():
+        engine = lnw.SessionEngine(workers=1)
+        loop = asyncio.get_running_loop()
+        def run_in_executor(executor, function, *args):
+            calls.append(args)
+            future = loop.create_future()
+            future.set_result({"args": args})
+            return future
+        monkeypatch.setattr(loop, "run_in_executor", run_in_executor)
+        try:
+            return await asyncio.gather(*(engine.get_document("story.txt") for _ in range(3)))
+        finally:
+            monkeypatch.undo()
+            engine.shutdown()
+
+    documents = asyncio.run(main())
+    assert len(calls) == 1
+    assert documents[0] is documents[1] is documents[2]
@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import splitting_the_cost as stc
+
+# number of people in the generated occasions; occasions with fewer items get fewer people
+max_people = 50
+
+def write_occasion(filename, num_items, seed=0):
+    """Write an occasion file with num_items items bought by random people. The same seed gives the same file."""
+    rng = random.Random(seed)
+    people = [f"Person {num}" for num in range(1, min(max_people, num_items) + 1)]
+    with open(filename, "w") as file:
+        file.write(f"Occasion:\nOccasion with {num_items} items\n\nPeople:\n")
+        file.write("\n".join(people))
+        file.write("\n\nItems:\n")
+        for num in range(1, num_items + 1):
+            file.write(f"Item {num} - {rng.choice(people)} - {rng.randint(1, 5000)}\n")
+
+def database_path(filename, algorithm, schema_mode, database):
+    """The usual way: the occasion goes through the database file, the report is read back from it."""
+    stc.connect_database(database)
+    stc.run(filename, algorithm, schema_mode)
+    stc.connection.close()
+
+def memory_path(filename, algorithm, schema_mode, database):
+    """The occasion is calculated with plain objects and never touches a database."""
+    stc.run_in_memory(filename, algorithm)
+
+def memory_sqlite_path(filename, algorithm, schema_mode, database):
+    """The occasion is calculated with plain objects and then saved to an in-memory SQLite database."""
+    stc.connect_database(":memory:")
+    stc.run_in_memory(filename, algorithm, persist=True, schema_mode=schema_mode)
+    stc.connection.close()
+
+paths = {
+    "database": database_path,
+    "in-memory": memory_path,
+    "in-memory + :memory:": memory_sqlite_path
+}
+
+def measure(path, filename, algorithm, schema_mode, workdir, repeat):
+    """Run one of the paths repeat times and return the best time in seconds.
+
+    Every run gets a fresh database, because an occasion can only be saved once.
+    """
+    best = float("inf")
+    for num in range(repeat):
+        database = os.path.join(workdir, f"bench_{time.perf_counter_ns()}.db")
+        started = time.perf_counter()
+        # the runs print the check and progress messages, they would get in the way of the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            paths[path](filename, algorithm, schema_mode, database)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the database and the in-memory ways of splitting the cost.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="numbers of items in the occasion")
+    parser.add_argument("--algorithm", default="all_pairs", choices=stc.settlement_algorithms)
+    parser.add_argument("--schema-mode", default="triggers", choices=("triggers", "set_based"))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best one is shown")
+    args = parser.parse_args()
+
+    print(f"{'items':>8}{'path':>24}{'seconds':>12}{'items/s':>14}{'vs database':>14}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            filename = os.path.join(workdir, f"occasion_{size}.txt")
+            write_occasion(filename, size)
+            baseline = None
+            for path in paths:
+                seconds = measure(path, filename, args.algorithm, args.schema_mode, workdir, args.repeat)
+                baseline = baseline or seconds
+                print(f"{size:>8}{path:>24}{seconds:>12.4f}{size / seconds:>14.0f}{f'x{baseline / seconds:.1f}':>14}")
+
+if __name__ == "__main__":
+    main()
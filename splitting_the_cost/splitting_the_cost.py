@@ -1,13 +1,31 @@
+import argparse
+import csv
+import glob
+import json
+import heapq
+import os
 import shutil
 import sqlite3 as sq
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+settlement_algorithms = ("all_pairs", "min_transfers")
+# how the amounts spent are calculated, see prepare_database
+schema_modes = ("triggers", "set_based")
+report_formats = {"text": "txt", "json": "json", "csv": "csv"}
+# PRAGMA user_version of the current database layout (see upgrade_database)
+schema_version = 4
 
 def create_database():
+    """Create the tables. All amounts are stored as integers in cents (see parse_amount)."""
     occasions_tb = """
     CREATE TABLE IF NOT EXISTS occasions 
     (occasion_id INTEGER PRIMARY KEY AUTOINCREMENT,
     occasion_name TEXT NOT NULL,
     total_spent INTEGER CHECK (total_spent >= 0),
-    right_amount INTEGER CHECK (right_amount >= 0))
+    right_amount INTEGER CHECK (right_amount >= 0),
+    version INTEGER NOT NULL DEFAULT 1)
     """
 
     people_tb = """
@@ -16,6 +34,7 @@ def create_database():
     person_name TEXT NOT NULL,
     initial_amount INTEGER CHECK (initial_amount >= 0), 
     final_amount INTEGER CHECK (final_amount >= 0),
+    share INTEGER CHECK (share >= 0),
     occasion_id INTEGER NOT NULL,
     FOREIGN KEY (occasion_id) REFERENCES occasions (occasion_id)
     )
@@ -40,16 +59,52 @@ def create_database():
     receiver_id INTEGER NOT NULL,
     amount INTEGER CHECK (amount > 0),
     occasion_id INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
     FOREIGN KEY (sender_id) REFERENCES people (person_id),
     FOREIGN KEY (receiver_id) REFERENCES people (person_id),
     FOREIGN KEY (occasion_id) REFERENCES occasions(occasion_id)
     )
     """
 
+    # every time an occasion is changed, its transactions are calculated again and saved as a new version
+    settlements_tb = """
+    CREATE TABLE IF NOT EXISTS settlements
+    (occasion_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    algorithm TEXT,
+    total_spent INTEGER,
+    num_people INTEGER,
+    num_transactions INTEGER,
+    note TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (occasion_id, version),
+    FOREIGN KEY (occasion_id) REFERENCES occasions(occasion_id)
+    )
+    """
+
     cursor.execute(occasions_tb)
     cursor.execute(people_tb)
     cursor.execute(items_tb)
     cursor.execute(transactions_tb)
+    cursor.execute(settlements_tb)
+    connection.commit()
+
+def create_indexes():
+    """Add indexes for the columns used to look up occasions, people, items and transactions.
+    
+    Without them every lookup scans the whole table, which gets slow once the database keeps years of occasions.
+    """
+    indexes = [
+        """ CREATE UNIQUE INDEX IF NOT EXISTS occasions_name ON occasions (occasion_name) """,
+        """ CREATE INDEX IF NOT EXISTS people_occasion_name ON people (occasion_id, person_name) """,
+        """ CREATE INDEX IF NOT EXISTS items_occasion ON items (occasion_id) """,
+        """ CREATE INDEX IF NOT EXISTS items_person ON items (person_id) """,
+        """ CREATE INDEX IF NOT EXISTS transactions_occasion ON transactions (occasion_id, version) """,
+        """ CREATE INDEX IF NOT EXISTS transactions_sender ON transactions (sender_id) """,
+        """ CREATE INDEX IF NOT EXISTS transactions_receiver ON transactions (receiver_id) """
+    ]
+    for index in indexes:
+        cursor.execute(index)
     connection.commit()
     
 def create_triggers():
@@ -75,9 +130,11 @@ def create_triggers():
     END;
     """
     
-    # after transactions have been added, calculate the final amount spent by each person
+    # after transactions have been added, calculate the final amount spent by each person;
+    # later versions replace all transactions at once, so update_occasion uses calc_final_amounts for them
     calc_final = """ CREATE TRIGGER IF NOT EXISTS calc_final
     AFTER INSERT ON transactions
+    WHEN NEW.version = 1
     BEGIN
     UPDATE people SET final_amount = final_amount + NEW.amount
     WHERE person_id = NEW.sender_id;
@@ -91,104 +148,403 @@ def create_triggers():
     cursor.execute(calc_final)
     connection.commit()
     
-def data_from_file(filename):
-    """Reading data from file and creating three variables: occasion (str), people (list) and items (dict)"""
+def calc_initial_amounts(occasion_id):
+    """Calculate the total amount spent and the initial amount spent by each person in one pass over items.
     
-    try:
-        with open(filename, 'r') as file:
-            lines = file.readlines()
-    except FileNotFoundError:
-        print(f"Error: The file {filename} was not found.")
+    This is the set-based replacement for the count_total and count_initial triggers:
+    it runs once per occasion after all items have been added instead of once per item.
+    """
+    update_total = """ UPDATE occasions SET total_spent = 
+    (SELECT COALESCE(SUM(item_price), 0) FROM items WHERE occasion_id = ?)
+    WHERE occasion_id = ? """
+    cursor.execute(update_total, (occasion_id, occasion_id))
+    
+    reset_initial = """ UPDATE people SET initial_amount = 0 WHERE occasion_id = ? """
+    cursor.execute(reset_initial, (occasion_id, ))
+    update_initial = """ UPDATE people SET initial_amount = spent.total
+    FROM (SELECT person_id, SUM(item_price) AS total FROM items WHERE occasion_id = ? GROUP BY person_id) AS spent
+    WHERE people.person_id = spent.person_id """
+    cursor.execute(update_initial, (occasion_id, ))
+    calc_final_amounts(occasion_id)
+
+def calc_final_amounts(occasion_id):
+    """Calculate the final amount spent by each person in one pass over transactions.
+    
+    This is the set-based replacement for the calc_final trigger:
+    it runs once per occasion after all transactions have been added instead of once per transaction.
+    Only the transactions of the current version of the occasion count.
+    """
+    reset_final = """ UPDATE people SET final_amount = initial_amount WHERE occasion_id = ? """
+    cursor.execute(reset_final, (occasion_id, ))
+    
+    version = get_version(occasion_id)
+    add_sent = """ UPDATE people SET final_amount = final_amount + sent.total
+    FROM (SELECT sender_id, SUM(amount) AS total FROM transactions WHERE occasion_id = ? AND version = ?
+    GROUP BY sender_id) AS sent
+    WHERE people.person_id = sent.sender_id """
+    cursor.execute(add_sent, (occasion_id, version))
+    
+    subtract_received = """ UPDATE people SET final_amount = final_amount - received.total
+    FROM (SELECT receiver_id, SUM(amount) AS total FROM transactions WHERE occasion_id = ? AND version = ?
+    GROUP BY receiver_id) AS received
+    WHERE people.person_id = received.receiver_id """
+    cursor.execute(subtract_received, (occasion_id, version))
+
+def migrate_database():
+    """Switch an existing database to the set-based mode.
+    
+    Drops the triggers and recalculates the amounts of every occasion already in the database,
+    so that they stay correct without the triggers. Without the triggers the database stays in the set-based mode
+    (see prepare_database).
+    """
+    with connection:
+        cursor.execute(""" DROP TRIGGER IF EXISTS count_total """)
+        cursor.execute(""" DROP TRIGGER IF EXISTS count_initial """)
+        cursor.execute(""" DROP TRIGGER IF EXISTS calc_final """)
+        
+        cursor.execute(""" SELECT occasion_id FROM occasions """)
+        for occasion in cursor.fetchall():
+            calc_initial_amounts(occasion[0])
+
+def upgrade_database():
+    """Bring a database created by an older version of the script up to schema_version.
+    
+    Version 1: amounts are stored in cents instead of whole units, and people have a share -
+    the exact amount each of them should spend (see split_total).
+    Version 2: occasions can be changed (see update_occasion), so transactions have a version,
+    and the settlements table keeps the history of versions.
+    Version 3: the person_balances and current_transactions views of the set-based mode are gone, nothing read them.
+    Version 4: the calc_final trigger only counts the first version of the transactions (see create_triggers).
+    """
+    cursor.execute(""" PRAGMA user_version """)
+    version = cursor.fetchone()[0]
+    if version >= schema_version:
+        return
+    
+    with connection:
+        cursor.execute(""" PRAGMA table_info(people) """)
+        if "share" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute(""" ALTER TABLE people ADD COLUMN share INTEGER CHECK (share >= 0) """)
+            # the columns were there before, so the amounts in them are whole units
+            cursor.execute(""" UPDATE occasions SET total_spent = total_spent * 100, right_amount = right_amount * 100 """)
+            cursor.execute(""" UPDATE people SET initial_amount = initial_amount * 100, final_amount = final_amount * 100 """)
+            cursor.execute(""" UPDATE items SET item_price = item_price * 100 """)
+            cursor.execute(""" UPDATE transactions SET amount = amount * 100 """)
+            
+            cursor.execute(""" SELECT occasion_id FROM occasions """)
+            for occasion in cursor.fetchall():
+                add_shares(occasion[0])
+        
+        cursor.execute(""" PRAGMA table_info(transactions) """)
+        if "version" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute(""" ALTER TABLE occasions ADD COLUMN version INTEGER NOT NULL DEFAULT 1 """)
+            cursor.execute(""" ALTER TABLE transactions ADD COLUMN version INTEGER NOT NULL DEFAULT 1 """)
+            # the old index only covers occasion_id, create_indexes adds the new one
+            cursor.execute(""" DROP INDEX IF EXISTS transactions_occasion """)
+            add_settlements = """ INSERT INTO settlements (occasion_id, version, total_spent, num_people, num_transactions, note)
+            SELECT occasion_id, 1, total_spent,
+            (SELECT COUNT(*) FROM people WHERE people.occasion_id = occasions.occasion_id),
+            (SELECT COUNT(*) FROM transactions WHERE transactions.occasion_id = occasions.occasion_id),
+            'created before versions were kept'
+            FROM occasions """
+            cursor.execute(add_settlements)
+        
+        cursor.execute(""" DROP VIEW IF EXISTS person_balances """)
+        cursor.execute(""" DROP VIEW IF EXISTS current_transactions """)
+        # prepare_database creates it again with the WHEN clause if the database uses triggers
+        cursor.execute(""" DROP TRIGGER IF EXISTS calc_final """)
+        cursor.execute(f""" PRAGMA user_version = {schema_version} """)
+
+def parse_amount(text):
+    """Turn an amount like "12", "12.5" or "12.50" into an integer number of cents. Returns None if it's not an amount."""
+    units, point, cents = text.partition(".")
+    if not units.isdigit() or point and not (cents.isdigit() and len(cents) <= 2):
+        return None
+    return int(units) * 100 + int(cents.ljust(2, "0") if point else 0)
+
+def format_amount(cents):
+    """Turn an amount in cents back into text: 125000 -> "1250", 1250 -> "12.50"."""
+    units, cents = divmod(cents, 100)
+    return f"{units}.{cents:02d}" if cents else str(units)
+
+def split_total(total, person_ids):
+    """Split the total (in cents) between people so that the shares add up to exactly the total.
+    
+    Everyone gets total // n. The remaining total % n cents go one by one to the people with the smallest ids,
+    so the same occasion is always split the same way.
+    Example: 1000, [1, 2, 3] -> {1: 334, 2: 333, 3: 333}.
+    """
+    base, remainder = divmod(total, len(person_ids))
+    return {person_id: base + (1 if num < remainder else 0) for num, person_id in enumerate(sorted(person_ids))}
 
-    items = {}
+OccasionRecord = namedtuple("OccasionRecord", "line_num name")
+PersonRecord = namedtuple("PersonRecord", "line_num name")
+ItemRecord = namedtuple("ItemRecord", "line_num name buyer price")
 
-    for num in range(len(lines)):
-        if lines[num].strip() == "Occasion:":
-            occasion = lines[num + 1].strip()
+class InputFileError(ValueError):
+    """Raised when an occasion file has mistakes. errors is the list of all of them, each with its line number."""
+    
+    def __init__(self, filename, errors):
+        self.filename = filename
+        self.errors = errors
+        super().__init__(f"{len(errors)} errors in {filename}:\n" + "\n".join(errors))
+    
+    def __reduce__(self):
+        # so that the error can be sent back from a worker process
+        return InputFileError, (self.filename, self.errors)
 
-        elif lines[num].strip() == "People:":
-            people_start = num + 1
+class SchemaModeError(ValueError):
+    """Raised when a schema mode is asked for that the existing database doesn't use (see prepare_database)."""
+    
+    def __init__(self, schema_mode, database_mode):
+        self.schema_mode = schema_mode
+        self.database_mode = database_mode
+        super().__init__(f"The database calculates the amounts in the {database_mode} mode, not {schema_mode}. "
+                         f"Leave out the schema mode to use the database's one or use --migrate to switch it to set_based")
+
+class OccasionExistsError(ValueError):
+    """Raised when an occasion with the same name is already in the database."""
+    
+    def __init__(self, occasion):
+        self.occasion = occasion
+        super().__init__(f"There's already an occasion {occasion} in the database, please choose a different name")
+    
+    def __reduce__(self):
+        return OccasionExistsError, (self.occasion, )
+
+def iter_records(lines, errors):
+    """Read the lines of an occasion file one by one and yield OccasionRecord, PersonRecord and ItemRecord.
+    
+    A file can describe several occasions, each one starts with "Occasion:". Blank lines are skipped.
+    Lines with mistakes are not yielded, instead a message with the line number is added to errors:
+    unknown buyer, bad or zero price, duplicate person, line outside of a section and so on.
+    Only the names of the people of the current occasion are kept, so memory doesn't grow with the file.
+    """
+    section = None
+    occasion = None
+    occasion_line = 0
+    occasion_names = set()
+    people = set()
+    
+    def check_occasion():
+        if occasion is not None and not people:
+            errors.append(f"line {occasion_line}: occasion {occasion} has no people")
+    
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        
+        if line == "Occasion:":
+            check_occasion()
+            section = "occasion"
+            occasion = None
+            occasion_line = line_num
+            people = set()
+        elif line == "People:" or line == "Items:":
+            if section is None:
+                errors.append(f"line {line_num}: {line} comes before Occasion:")
+            elif occasion is None and section == "occasion":
+                errors.append(f"line {line_num}: the occasion has no name")
+            section = "people" if line == "People:" else "items"
+        
+        elif section == "occasion":
+            if occasion is not None:
+                errors.append(f"line {line_num}: the occasion already has a name: {occasion}")
+            elif line in occasion_names:
+                errors.append(f"line {line_num}: occasion {line} is already in the file")
+                occasion = line
+            else:
+                occasion = line
+                occasion_names.add(line)
+                yield OccasionRecord(line_num, line)
+        
+        elif section == "people":
+            if line in people:
+                errors.append(f"line {line_num}: {line} is already on the list of people")
+            else:
+                people.add(line)
+                yield PersonRecord(line_num, line)
+        
+        elif section == "items":
+            item = line.split(" - ")
+            if len(item) != 3:
+                errors.append(f"line {line_num}: expected 'item - buyer - price', got '{line}'")
+                continue
+            item_name, buyer_name, price = (part.strip() for part in item)
+            amount = parse_amount(price)
+            if buyer_name not in people:
+                errors.append(f"line {line_num}: {buyer_name} bought {item_name}, but they are not on the list of people")
+            elif amount is None:
+                errors.append(f"line {line_num}: the price of {item_name} should be an amount like 12 or 12.50, got '{price}'")
+            elif amount == 0:
+                # the database only keeps items with a positive price
+                errors.append(f"line {line_num}: the price of {item_name} should be more than 0, got '{price}'")
+            else:
+                yield ItemRecord(line_num, item_name, buyer_name, amount)
+        
+        else:
+            errors.append(f"line {line_num}: '{line}' is not in any section")
+    
+    check_occasion()
 
-        elif lines[num].strip() == "Items:":
-            people_end = num
-            items_start = num + 1
+def iter_occasions(filename):
+    """Read the file line by line and yield (occasion, people, items) for every occasion in it.
+    
+    occasion (str), people - list of names, items - list of tuples (item_name, price, buyer_name), prices are in cents.
+    Only one occasion is held in memory at a time. Occasions are yielded while there are no mistakes in the file;
+    the file is always read to the end and then InputFileError lists all the mistakes at once.
+    """
+    errors = []
+    occasion = None
+    people = []
+    items = []
+    
+    with open(filename, 'r') as file:
+        for record in iter_records(file, errors):
+            if isinstance(record, OccasionRecord):
+                if occasion is not None and not errors:
+                    yield occasion, people, items
+                occasion = record.name
+                people = []
+                items = []
+            elif isinstance(record, PersonRecord):
+                people.append(record.name)
+            else:
+                items.append((record.name, record.price, record.buyer))
+    
+    if errors:
+        raise InputFileError(filename, errors)
+    if occasion is not None:
+        yield occasion, people, items
 
-    items_end = len(lines)
-    people = [lines[num].strip() for num in range(people_start, people_end)]
+def check_file(filename):
+    """Read the whole file without keeping the occasions and raise InputFileError if there are any mistakes.
+    
+    Used before anything is saved, so a mistake at the end of the file doesn't leave the first occasions
+    in the database.
+    """
+    errors = []
+    with open(filename, 'r') as file:
+        for record in iter_records(file, errors):
+            pass
+    if errors:
+        raise InputFileError(filename, errors)
 
-    for num in range(items_start, items_end):
-        item = lines[num].strip().split(" - ")
-        item_name = item[0]
-        buyer_name = item[1]
-        price = int(item[2])
-        items[item_name] = (price, buyer_name)  
-    return occasion, people, items
+def data_from_file(filename):
+    """Read all occasions from the file and return them as a list of tuples (occasion, people, items)."""
+    return list(iter_occasions(filename))
 
 def add_occasion(occasion):
     """Add new occasion to the database. An occasion is only accepted if it's not in the database yet."""
     
-    check_occasions = f""" SELECT occasion_name FROM occasions """
-    cursor.execute(check_occasions)
-    all_occasions = [occ[0] for occ in cursor.fetchall()]
-    if occasion in all_occasions:
-        raise Exception("There's already an occasion with this name in the database. Please choose a different name")
+    check_occasion = """ SELECT EXISTS (SELECT 1 FROM occasions WHERE occasion_name = ?) """
+    cursor.execute(check_occasion, (occasion, ))
+    if cursor.fetchone()[0]:
+        raise OccasionExistsError(occasion)
     else:
         new_occasion = (occasion, 0)
         request_to_insert = """ INSERT INTO occasions (occasion_name, total_spent) VALUES (?, ?); """
         cursor.execute(request_to_insert, new_occasion)
-        connection.commit()
 
 def get_occasion_id(occasion_name):
     """ Takes occasion_name (str) and returns occasion_id(int) """
     
-    find_occasion_id = f"""
-    SELECT occasion_id FROM occasions WHERE occasion_name = "{occasion_name}"
+    find_occasion_id = """
+    SELECT occasion_id FROM occasions WHERE occasion_name = ?
     """
-    cursor.execute(find_occasion_id)
-    occasion_id = cursor.fetchall()[0][0]
+    cursor.execute(find_occasion_id, (occasion_name, ))
+    occasion_id = cursor.fetchone()[0]
     return occasion_id
 
+def get_version(occasion_id):
+    """Return the current version of the occasion's transactions (see update_occasion)."""
+    cursor.execute(""" SELECT version FROM occasions WHERE occasion_id = ? """, (occasion_id, ))
+    return cursor.fetchone()[0]
+
+def record_settlement(occasion_id, version, algorithm, note=None):
+    """Save a version of the occasion's transactions to the history in the settlements table."""
+    add_settlement = """ INSERT INTO settlements (occasion_id, version, algorithm, total_spent, num_people, num_transactions, note)
+    SELECT occasion_id, ?, ?, total_spent,
+    (SELECT COUNT(*) FROM people WHERE occasion_id = occasions.occasion_id),
+    (SELECT COUNT(*) FROM transactions WHERE occasion_id = occasions.occasion_id AND version = ?),
+    ?
+    FROM occasions WHERE occasion_id = ? """
+    cursor.execute(add_settlement, (version, algorithm, version, note, occasion_id))
+
+def settlement_history(occasion_name):
+    """Return all versions of the occasion as tuples (version, algorithm, total_spent, num_people, num_transactions, note, created_at)."""
+    select_history = """ SELECT version, algorithm, total_spent, num_people, num_transactions, note, created_at
+    FROM settlements WHERE occasion_id = (SELECT occasion_id FROM occasions WHERE occasion_name = ?) ORDER BY version """
+    cursor.execute(select_history, (occasion_name, ))
+    return cursor.fetchall()
+
 def add_people(people, occasion_id):
-    for name in people:
-        new_person = (name, occasion_id, 0)
-        request_to_insert = """ INSERT INTO people (person_name, occasion_id, initial_amount) VALUES (?, ?, ?); """
-        cursor.execute(request_to_insert, new_person)
-        connection.commit()
+    """Add all people at once and return a dictionary that maps their names to their ids."""
+    
+    request_to_insert = """ INSERT INTO people (person_name, occasion_id, initial_amount) VALUES (?, ?, ?); """
+    cursor.executemany(request_to_insert, ((name, occasion_id, 0) for name in people))
+    return find_people_ids(occasion_id)
+
+def find_people_ids(occasion_id):
+    """ Takes occasion_id (int) and returns a dictionary {person_name: person_id} with everyone involved """
+    
+    select_people = """ SELECT person_name, person_id FROM people WHERE occasion_id = ? """
+    cursor.execute(select_people, (occasion_id, ))
+    return dict(cursor.fetchall())
         
 def find_num_people(occasion_id):
     """ Takes occasion_id (int) and returns number of people involved (int) """
     
-    find_num_people = f""" SELECT person_name from people WHERE occasion_id = "{occasion_id}" """
-    cursor.execute(find_num_people)
-    num_people = len(cursor.fetchall())
+    find_num_people = """ SELECT COUNT(*) FROM people WHERE occasion_id = ? """
+    cursor.execute(find_num_people, (occasion_id, ))
+    num_people = cursor.fetchone()[0]
     return num_people
 
-def add_items(items, occasion_id):
-    for item in items.items():
-        name = item[0]
-        price = item[1][0]
-        buyer = item[1][1]
-
-        find_person_id = f""" SELECT person_id FROM people WHERE person_name = "{buyer}" AND occasion_id = {occasion_id} """
-        cursor.execute(find_person_id)
-        person_id = cursor.fetchall()[0][0]
-
-        new_item = (name, price, person_id, occasion_id)
-        request_to_insert = """ INSERT INTO items (item_name, item_price, person_id, occasion_id) VALUES (?, ?, ?, ?); """
-        cursor.execute(request_to_insert, new_item)
-        connection.commit()
+def add_items(items, occasion_id, names_ids=None):
+    """Add all items at once.
+    
+    items is a list of tuples (item_name, price, buyer_name).
+    names_ids is the dictionary {person_name: person_id} returned by add_people.
+    If it's not given, it's loaded from the database with one query.
+    """
+    if names_ids is None:
+        names_ids = find_people_ids(occasion_id)
+    
+    new_items = []
+    for name, price, buyer in items:
+        if buyer not in names_ids:
+            raise ValueError(f"{buyer} bought {name}, but they are not on the list of people")
+        new_items.append((name, price, names_ids[buyer], occasion_id))
+    
+    request_to_insert = """ INSERT INTO items (item_name, item_price, person_id, occasion_id) VALUES (?, ?, ?, ?); """
+    cursor.executemany(request_to_insert, new_items)
         
 def calc_right_amount(occasion_id, num_people):
-    find_total_spent = f""" SELECT total_spent FROM occasions WHERE occasion_id = {occasion_id} """
-    cursor.execute(find_total_spent)
-    total_spent = cursor.fetchall()[0][0]
-    right_amount = round(total_spent / num_people)
+    find_total_spent = """ SELECT total_spent FROM occasions WHERE occasion_id = ? """
+    cursor.execute(find_total_spent, (occasion_id, ))
+    total_spent = cursor.fetchone()[0]
+    # the smallest share, some people get one cent more (see split_total)
+    right_amount = total_spent // num_people
     return right_amount
 
+def add_shares(occasion_id):
+    """Split the total spent between the people of the occasion, save everyone's share and return {person_id: share}."""
+    find_total_spent = """ SELECT total_spent FROM occasions WHERE occasion_id = ? """
+    cursor.execute(find_total_spent, (occasion_id, ))
+    total_spent = cursor.fetchone()[0]
+    
+    select_people = """ SELECT person_id FROM people WHERE occasion_id = ? """
+    cursor.execute(select_people, (occasion_id, ))
+    shares = split_total(total_spent, [person[0] for person in cursor.fetchall()])
+    
+    update_share = """ UPDATE people SET share = ? WHERE person_id = ? """
+    cursor.executemany(update_share, ((share, person_id) for person_id, share in shares.items()))
+    return shares
+
 def add_right_amount(occasion_id, right_amount):
     update_right_amount = """ UPDATE occasions SET right_amount = ? WHERE occasion_id = ? """
     cursor.execute(update_right_amount, (right_amount, occasion_id))
-    connection.commit()
     
 def create_names_amounts(occasion_id):
     """Sort people by the initial amount they have spent.
@@ -196,11 +552,14 @@ def create_names_amounts(occasion_id):
     Creates a dictionary names_amounts and sorts it from largest to smallest amount spent.
     Example: {4: 2200, 3: 1600, 2: 1000, 1: 200}. Keys are people's ids and values are their initial amount spent.
     """
-    select_people = f""" SELECT person_id, initial_amount FROM people WHERE occasion_id = {occasion_id} """
-    cursor.execute(select_people)
+    select_people = """ SELECT person_id, initial_amount FROM people WHERE occasion_id = ? ORDER BY person_id """
+    cursor.execute(select_people, (occasion_id, ))
     names_amounts = {person[0]: person[1] for person in cursor.fetchall()}
-    names_amounts = dict(sorted(names_amounts.items(), key=lambda item: item[1], reverse=True))
-    return names_amounts
+    return sort_names_amounts(names_amounts)
+
+def sort_names_amounts(names_amounts):
+    """Sort the dictionary {person_id: initial_amount} from largest to smallest amount spent."""
+    return dict(sorted(names_amounts.items(), key=lambda item: item[1], reverse=True))
         
 
 def calc(names_amounts):
@@ -218,7 +577,7 @@ def calc(names_amounts):
     for person in names_amounts.items():
         person_id = person[0]
         current_amount = person[1]
-        part = round(current_amount / len(names_amounts))
+        part = current_amount // len(names_amounts)
         names_amounts[person_id] = [current_amount, part]
     
     item_list = list(names_amounts.items())
@@ -241,8 +600,122 @@ def calc(names_amounts):
         who_sends_what[curr_id] = prev_people_amount
     return who_sends_what
     
-def add_transactions(who_sends_what, occasion_id):
-    add_transaction = """ INSERT INTO transactions (sender_id, receiver_id, amount, occasion_id) VALUES (?, ?, ?, ?); """
+def settle_remainder(who_sends_what, names_amounts, shares):
+    """Adjust the transactions of calc so that everyone ends up with exactly their share.
+    
+    calc rounds everyone's part down, so people can be a few cents off. Everyone sends their difference
+    to the person who has spent the most (the first one in names_amounts). The differences add up to 0,
+    so that person ends up right as well.
+    """
+    final_amounts = dict(names_amounts)
+    for sender, receiver, amount in iter_transactions(who_sends_what):
+        final_amounts[sender] += amount
+        final_amounts[receiver] -= amount
+    
+    top_id = next(iter(names_amounts))
+    for person_id, final_amount in final_amounts.items():
+        difference = shares[person_id] - final_amount
+        if person_id == top_id or not difference:
+            continue
+        transactions = who_sends_what.setdefault(person_id, [])
+        for transaction in transactions:
+            if transaction[0] == top_id:
+                transaction[1] += difference
+                break
+        else:
+            transactions.append([top_id, difference])
+    
+    # a transaction to the top person can become negative when they have spent as much as the sender,
+    # then the top person sends the money instead
+    reversed_transactions = []
+    for person_id, transactions in who_sends_what.items():
+        for transaction in transactions:
+            if transaction[0] == top_id and transaction[1] < 0:
+                reversed_transactions.append([person_id, -transaction[1]])
+                transaction[1] = 0
+    if reversed_transactions:
+        who_sends_what.setdefault(top_id, []).extend(reversed_transactions)
+    return who_sends_what
+
+def calc_min_transfers(names_amounts, shares):
+    """Calculate who should send how much to whom using as few transactions as possible.
+    
+    Takes the same dictionary names_amounts as calc and the dictionary {person_id: share} with
+    the amount each person should spend (see split_total), returns dictionary who_sends_what in the same format as calc.
+    
+    Each person's balance is their initial amount minus their share, the balances add up to exactly 0. People with a negative balance
+    (debtors) send money to people with a positive balance (creditors). The largest debtor always pays
+    the largest creditor as much as possible, so every transaction settles at least one of them
+    and there are at most n - 1 transactions. Debtors and creditors are kept in heaps, so it takes O(n log n).
+    
+    Input example: {4: 2200, 3: 1600, 2: 1000, 1: 200}, {1: 1250, 2: 1250, 3: 1250, 4: 1250}.
+    Output example: {1: [[4, 950], [3, 100]], 2: [[3, 250]]}.
+    """
+    # heapq is a min-heap, so both heaps store negative amounts to pop the largest debt and credit first
+    debtors = []
+    creditors = []
+    for person_id, amount in names_amounts.items():
+        balance = amount - shares[person_id]
+        if balance < 0:
+            debtors.append((balance, person_id))
+        elif balance > 0:
+            creditors.append((-balance, person_id))
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+    
+    who_sends_what = {}
+    while debtors and creditors:
+        debt, sender = heapq.heappop(debtors)
+        credit, receiver = heapq.heappop(creditors)
+        to_send = min(-debt, -credit)
+        who_sends_what.setdefault(sender, []).append([receiver, to_send])
+        
+        # whoever is not settled yet goes back to the heap with the rest of their balance
+        if -debt > to_send:
+            heapq.heappush(debtors, (debt + to_send, sender))
+        if -credit > to_send:
+            heapq.heappush(creditors, (credit + to_send, receiver))
+    return who_sends_what
+
+def settle(names_amounts, shares, algorithm="all_pairs"):
+    """Calculate transactions with the chosen algorithm.
+    
+    shares - dictionary {person_id: share} with the exact amount each person should spend (see split_total).
+    all_pairs - everyone sends money to everyone who has spent more (see calc and settle_remainder),
+    min_transfers - at most n - 1 transactions (see calc_min_transfers).
+    Returns dictionary who_sends_what.
+    """
+    if algorithm == "all_pairs":
+        # calc changes the dictionary it gets, so it works on a copy
+        who_sends_what = calc(dict(names_amounts))
+        return settle_remainder(who_sends_what, names_amounts, shares)
+    elif algorithm == "min_transfers":
+        return calc_min_transfers(names_amounts, shares)
+    else:
+        raise ValueError(f"Unknown algorithm {algorithm}. Please choose {' or '.join(settlement_algorithms)}")
+
+def compare_algorithms(names_amounts, shares, repeat=100):
+    """Run every settlement algorithm on the same occasion and print the number of transactions and the run time."""
+    for algorithm in settlement_algorithms:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            who_sends_what = settle(names_amounts, shares, algorithm)
+        elapsed = (time.perf_counter() - started) / repeat
+        num_transactions = sum(1 for transactions in who_sends_what.values() for transaction in transactions if transaction[1])
+        print(f"{algorithm}: {num_transactions} transactions, {elapsed * 1000:.3f} ms")
+
+def ask_algorithm():
+    """Ask which settlement algorithm to use until the answer is one of settlement_algorithms. Enter means all_pairs."""
+    while True:
+        algorithm = input(f"Which algorithm should I use, {' or '.join(settlement_algorithms)}? Press Enter for all_pairs. ").strip()
+        if not algorithm:
+            return "all_pairs"
+        if algorithm in settlement_algorithms:
+            return algorithm
+        print(f"Sorry, there's no algorithm {algorithm}. Please try again.")
+    
+def iter_transactions(who_sends_what):
+    """Yield tuples (sender_id, receiver_id, amount) from who_sends_what, skipping transactions of 0."""
     for item in who_sends_what.items():
         sender = item[0]
         transactions = item[1]
@@ -250,148 +723,769 @@ def add_transactions(who_sends_what, occasion_id):
             receiver = transaction[0]
             amount = transaction[1]
             if amount:
-                result = (sender, receiver, amount, occasion_id)
-                cursor.execute(add_transaction, result)
-                connection.commit()
+                yield sender, receiver, amount
+
+def add_transactions(who_sends_what, occasion_id, version=1):
+    add_transaction = """ INSERT INTO transactions (sender_id, receiver_id, amount, occasion_id, version) VALUES (?, ?, ?, ?, ?); """
+    new_transactions = ((sender, receiver, amount, occasion_id, version)
+                        for sender, receiver, amount in iter_transactions(who_sends_what))
+    cursor.executemany(add_transaction, new_transactions)
             
-def check(occasion_id, right_amount):
-    """Make sure the final amount spent by each person is close to the right amount."""
-    
-    select_final_amounts = f""" SELECT person_id, final_amount FROM people WHERE occasion_id = {occasion_id}"""
-    cursor.execute(select_final_amounts)
-    ids_final_amounts = {person[0]: person[1] for person in cursor.fetchall()}
-    for person in ids_final_amounts.items():
-        if person[1] in range(right_amount - 2, right_amount + 3):
-            print("Everything seems right.")
-        else:
-            print(f"""Something is wrong with person {person[0]}, 
-                  their final amount is {[person[1]]}, but it should be {right_amount}""")
+def check(occasion_id):
+    """Make sure the final amount spent by each person is exactly their share, with one aggregate query."""
+    
+    count_wrong = """ SELECT COUNT(*), GROUP_CONCAT(CASE WHEN final_amount IS NOT share THEN person_id END)
+    FROM people WHERE occasion_id = ? """
+    cursor.execute(count_wrong, (occasion_id, ))
+    num_people, wrong_ids = cursor.fetchone()
+    report_check(num_people, wrong_ids.split(",") if wrong_ids else [])
+
+def report_check(num_people, wrong_ids):
+    """Print the result of the check. wrong_ids - ids of people whose final amount is not their share."""
+    if wrong_ids:
+        print(f"Something is wrong with {len(wrong_ids)} of {num_people} people (ids {', '.join(map(str, wrong_ids))}), "
+              f"their final amount is not what they should spend.")
+    else:
+        print(f"Everything seems right: all {num_people} people spend what they should.")
             
-def result(original_file, new_file, who_sends_what, occasion_id, num_people, right_amount):
-    """Create a text file with the result.
+def result(original_file, new_file, occasion_id, num_people, right_amount, report_format="text"):
+    """Create a file with the result.
     
-    Creates a copy of the input file and adds instructions on who should send how much to whom. 
+    report_format - text, json or csv (see write_report).
+    For the text format, creates a copy of the input file and adds instructions on who should send how much to whom. 
     Also adds an explanation.
+    
+    The report is built from three queries: the occasion, everyone's amounts with the sums they send and receive
+    (grouped in SQL) and all transactions joined with the names of senders and receivers.
+    Only the current version of the transactions is reported (see update_occasion).
+    Transactions are written to the file as they are read from the database.
     """
+    select_occasion = """ SELECT occasion_name, total_spent, version FROM occasions WHERE occasion_id = ? """
+    cursor.execute(select_occasion, (occasion_id, ))
+    occasion, total, version = cursor.fetchone()
+    
+    select_people = """ SELECT people.person_id, people.person_name, people.initial_amount, people.share,
+    people.final_amount, COALESCE(sent.total, 0), COALESCE(received.total, 0)
+    FROM people
+    LEFT JOIN (SELECT sender_id, SUM(amount) AS total FROM transactions WHERE occasion_id = ? AND version = ?
+    GROUP BY sender_id) AS sent
+    ON sent.sender_id = people.person_id
+    LEFT JOIN (SELECT receiver_id, SUM(amount) AS total FROM transactions WHERE occasion_id = ? AND version = ?
+    GROUP BY receiver_id) AS received
+    ON received.receiver_id = people.person_id
+    WHERE people.occasion_id = ? ORDER BY people.person_id """
+    cursor.execute(select_people, (occasion_id, version, occasion_id, version, occasion_id))
+    people = cursor.fetchall()
     
+    select_transactions = """ SELECT transactions.sender_id, senders.person_name, 
+    transactions.receiver_id, receivers.person_name, transactions.amount
+    FROM transactions
+    JOIN people AS senders ON senders.person_id = transactions.sender_id
+    JOIN people AS receivers ON receivers.person_id = transactions.receiver_id
+    WHERE transactions.occasion_id = ? AND transactions.version = ? ORDER BY transactions.transaction_id """
+    transactions = cursor.execute(select_transactions, (occasion_id, version))
+    
+    render_result(original_file, new_file, report_format, occasion, total, num_people, right_amount, people, transactions)
+
+def render_result(original_file, new_file, report_format, occasion, total, num_people, right_amount, people, transactions):
+    """Write the report to new_file. For the text format, the report is added to a copy of original_file."""
+    if report_format == "text":
+        try:
+            shutil.copyfile(original_file, new_file)
+        except FileNotFoundError:
+            print(f"Error: File '{original_file}' not found.")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+    
+    mode = "a" if report_format == "text" else "w"
     try:
-        shutil.copyfile(original_file, new_file)
+        with open(new_file, mode, newline="" if report_format == "csv" else None) as file:
+            write_report(file, report_format, occasion, total, num_people, right_amount, people, transactions)
     except FileNotFoundError:
-        print(f"Error: File '{original_file}' not found.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        print(f"Error: The file {new_file} was not found.")
+
+def write_report(file, report_format, occasion, total, num_people, right_amount, people, transactions):
+    """Write the report to an open file.
+    
+    people - list of tuples (person_id, person_name, initial_amount, share, final_amount, sent, received).
+    All amounts are in cents; the reports show them in whole units (see format_amount).
+    transactions - iterable of tuples (sender_id, sender_name, receiver_id, receiver_name, amount) in the order
+    they should be done. It's only iterated once, so it can be a database cursor.
+    
+    text - the Overview, To do and Explanation sections added to the copy of the input file,
+    json - an object with the occasion, everyone's amounts and all transactions,
+    csv - one row per transaction: sender, receiver, amount.
+    """
+    if report_format == "text":
+        file.write("\n\nOverview:")
+        file.write(f"\nTotal spent is {format_amount(total)}.")
+        if len({person[3] for person in people}) > 1:
+            # the total can't be split equally to the cent (see split_total)
+            file.write(f"\nThere are {num_people} people, so each should spend {format_amount(right_amount)} "
+                       f"or {format_amount(right_amount + 1)}.")
+        else:
+            file.write(f"\nThere are {num_people} people, so each should spend {format_amount(right_amount)}.")
         
-    try:
-        with open(new_file, "a") as file:
-            file.write("\n\nOverview:")
-            select_total = f""" SELECT total_spent FROM occasions WHERE occasion_id = {occasion_id}"""
-            find_total = cursor.execute(select_total)
-            total = cursor.fetchall()[0][0]
-            file.write(f"\nTotal spent is {total}.")
-            file.write(f"\nThere are {num_people} people, so each should spend {right_amount}.")
-            
-            select_name_initial = f""" SELECT person_name, initial_amount FROM people WHERE occasion_id = {occasion_id} """
-            cursor.execute(select_name_initial)
-            names_initials = cursor.fetchall()
-            length = len(names_initials)
-            for num in range(length):
-                name = names_initials[num][0]
-                amount = names_initials[num][1]
-                if num == 0:
-                    file.write(f"\n\nInitially, {name} has spent {amount}, ")
-                elif num == length - 1:
-                    file.write(f"{name} {amount}.")
-                else:
-                    file.write(f"{name} {amount}, ")
-            
-            file.write("\n\nTo do:")
-            select_transactions = f""" SELECT sender_id, receiver_id, amount FROM transactions where occasion_id = {occasion_id} """
-            cursor.execute(select_transactions)
-            all_transactions = [item for item in cursor.fetchall()]
-            
-            select_name = """ SELECT person_name FROM people WHERE person_id = ? """
+        length = len(people)
+        for num in range(length):
+            name = people[num][1]
+            amount = format_amount(people[num][2])
+            if num == 0:
+                file.write(f"\n\nInitially, {name} has spent {amount}, ")
+            elif num == length - 1:
+                file.write(f"{name} {amount}.")
+            else:
+                file.write(f"{name} {amount}, ")
+        
+        # while the instructions are written, everyone's part of the explanation is collected
+        expenses = {person[0]: [] for person in people}
+        file.write("\n\nTo do:")
+        for sender_id, sender_name, receiver_id, receiver_name, amount in transactions:
+            amount = format_amount(amount)
+            file.write(f"\n{sender_name} sends {amount} to {receiver_name}")
+            expenses[sender_id].append(f" + {amount}")
+            expenses[receiver_id].append(f" - {amount}")
+        
+        file.write("\n\nExplanation:")
+        for person_id, person_name, initial, share, final_amount, sent, received in people:
+            file.write(f"\n{person_name}'s expenses: {format_amount(initial)}")
+            file.write("".join(expenses[person_id]))
+            file.write(f" = {format_amount(final_amount)}\n")
+    
+    elif report_format == "json":
+        def number(cents):
+            return cents // 100 if cents % 100 == 0 else cents / 100
+        
+        report = {
+            "occasion": occasion,
+            "total_spent": number(total),
+            "num_people": num_people,
+            "right_amount": number(right_amount),
+            "people": [
+                {"name": name, "initial_amount": number(initial), "share": number(share), "sent": number(sent),
+                 "received": number(received), "final_amount": number(final_amount)}
+                for person_id, name, initial, share, final_amount, sent, received in people
+            ],
+            "transactions": [
+                {"sender": sender_name, "receiver": receiver_name, "amount": number(amount)}
+                for sender_id, sender_name, receiver_id, receiver_name, amount in transactions
+            ]
+        }
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    
+    elif report_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(["sender", "receiver", "amount"])
+        for sender_id, sender_name, receiver_id, receiver_name, amount in transactions:
+            writer.writerow([sender_name, receiver_name, format_amount(amount)])
+    
+    else:
+        raise ValueError(f"Unknown report format {report_format}. Please choose {' or '.join(report_formats)}")
             
-            for item in all_transactions:
-                sender_id = item[0]
-                receiver_id = item[1]
-                amount = item[2]
-                
-                find_sender_name = cursor.execute(select_name, (sender_id, ))
-                sender_name = cursor.fetchall()[0][0]
-                
-                find_receiver_name = cursor.execute(select_name, (receiver_id, ))
-                receiver_name = cursor.fetchall()[0][0]
-                file.write(f"\n{sender_name} sends {amount} to {receiver_name}")
-                    
-            file.write("\n\nExplanation:")
-            select_ids_names_final = f""" SELECT person_id, person_name, final_amount FROM people where occasion_id = {occasion_id} """
-            cursor.execute(select_ids_names_final)
-            all_ids_names = cursor.fetchall()
+class Person:
+    """A participant of an occasion in the in-memory engine (see compute_occasion)."""
+    __slots__ = ("person_id", "name", "initial_amount", "share", "final_amount", "sent", "received")
+    
+    def __init__(self, person_id, name):
+        self.person_id = person_id
+        self.name = name
+        self.initial_amount = 0
+        self.share = 0
+        self.final_amount = 0
+        self.sent = 0
+        self.received = 0
+
+class Settlement:
+    """An occasion calculated without a database: amounts, the right amount and the transactions."""
+    __slots__ = ("occasion", "total", "right_amount", "people", "items", "who_sends_what", "algorithm")
+    
+    def __init__(self, occasion, total, right_amount, people, items, who_sends_what, algorithm="all_pairs"):
+        self.occasion = occasion
+        self.total = total
+        self.right_amount = right_amount
+        self.people = people
+        self.items = items
+        self.who_sends_what = who_sends_what
+        self.algorithm = algorithm
+    
+    def people_rows(self):
+        """Everyone's amounts in the form write_report takes them."""
+        return [(person.person_id, person.name, person.initial_amount, person.share, person.final_amount,
+                 person.sent, person.received) for person in self.people]
+    
+    def transaction_rows(self):
+        """All transactions with names in the form write_report takes them."""
+        return [(sender, self.people[sender - 1].name, receiver, self.people[receiver - 1].name, amount)
+                for sender, receiver, amount in iter_transactions(self.who_sends_what)]
+
+def compute_occasion(occasion, people, items, algorithm="all_pairs"):
+    """Calculate an occasion with plain Python objects, without a database, and return a Settlement.
+    
+    Does what the tables and triggers do in run_occasion: people get ids 1, 2, 3... in the order of the file,
+    the amounts are summed up, and the transactions are calculated with the same settle.
+    """
+    persons = [Person(person_id, name) for person_id, name in enumerate(people, 1)]
+    people_by_name = {person.name: person for person in persons}
+    
+    total = 0
+    for name, price, buyer in items:
+        if buyer not in people_by_name:
+            raise ValueError(f"{buyer} bought {name}, but they are not on the list of people")
+        people_by_name[buyer].initial_amount += price
+        total += price
+    
+    right_amount = total // len(persons)
+    shares = split_total(total, [person.person_id for person in persons])
+    for person in persons:
+        person.share = shares[person.person_id]
+    names_amounts = sort_names_amounts({person.person_id: person.initial_amount for person in persons})
+    who_sends_what = settle(names_amounts, shares, algorithm)
+    
+    for sender, receiver, amount in iter_transactions(who_sends_what):
+        persons[sender - 1].sent += amount
+        persons[receiver - 1].received += amount
+    for person in persons:
+        person.final_amount = person.initial_amount + person.sent - person.received
+    
+    return Settlement(occasion, total, right_amount, persons, items, who_sends_what, algorithm)
+
+def save_settlement(settlement, schema_mode="triggers"):
+    """Save an occasion calculated by compute_occasion to the database in one transaction.
+    
+    The ids given by the database replace the in-memory ids in the saved transactions.
+    """
+    with connection:
+        add_occasion(settlement.occasion)
+        occasion_id = get_occasion_id(settlement.occasion)
+        names_ids = add_people([person.name for person in settlement.people], occasion_id)
+        add_items(settlement.items, occasion_id, names_ids)
+        if schema_mode == "set_based":
+            calc_initial_amounts(occasion_id)
+        add_right_amount(occasion_id, settlement.right_amount)
+        add_shares(occasion_id)
+        
+        ids = {person.person_id: names_ids[person.name] for person in settlement.people}
+        who_sends_what = {ids[sender]: [[ids[receiver], amount] for receiver, amount in transactions]
+                          for sender, transactions in settlement.who_sends_what.items()}
+        add_transactions(who_sends_what, occasion_id)
+        record_settlement(occasion_id, 1, settlement.algorithm)
+        if schema_mode == "set_based":
+            calc_final_amounts(occasion_id)
+    return occasion_id
+
+def run_in_memory(filename, algorithm="all_pairs", report_format="text", persist=False, schema_mode=None):
+    """Calculate the occasions described in the file without a database and write the results.
+    
+    The result files are the same as the ones written by run. With persist=True every occasion is also saved
+    to the connected database (see save_settlement); connect_database(":memory:") keeps it in memory.
+    """
+    if persist:
+        schema_mode = prepare_database(schema_mode)
+    try:
+        check_file(filename)
+        for num, (occasion, people, items) in enumerate(iter_occasions(filename)):
+            settlement = compute_occasion(occasion, people, items, algorithm)
+            if persist:
+                try:
+                    save_settlement(settlement, schema_mode)
+                except OccasionExistsError as e:
+                    print(f"Error: {e}. The occasion was skipped.")
+                    continue
             
-            for person in all_ids_names:
-                person_id = person[0]
-                person_name = person[1]
-                final_amount = person[2]
-                file.write(f"\n{person_name}'s expenses:")
-                for item in names_initials:
-                    if person_name in item:
-                        initial = item[1]
-                        file.write(f" {initial}")
-                for item in all_transactions:
-                    if person_id in item:
-                        sender = item[0]
-                        receiver = item[1]
-                        amount = item[2]
-                        if person_id == sender:
-                            file.write(f" + {amount}")
-                        elif person_id == receiver:
-                            file.write(f" - {amount}")
-                file.write(f" = {final_amount}\n")
+            report_check(len(settlement.people), [person.person_id for person in settlement.people
+                                                  if person.final_amount != person.share])
             
+            suffix = f"_{num + 1}" if num else ""
+            new_file = f'{filename}_result{suffix}.{report_formats[report_format]}'
+            render_result(filename, new_file, report_format, occasion, settlement.total, len(people),
+                          settlement.right_amount, settlement.people_rows(), settlement.transaction_rows())
     except FileNotFoundError:
-            print(f"Error: The file {newfile} was not found.")
-            
-def run(filename):
-    # connecting to the database and creating it
-    create_database()
-    create_triggers()
+        print(f"Error: The file {filename} was not found.")
+    except InputFileError as e:
+        print(f"Error: {e}")
+
+def run_compare(filename, repeat=100):
+    """Compare the settlement algorithms on every occasion in the file (see compare_algorithms). Nothing is saved."""
+    try:
+        check_file(filename)
+        for occasion, people, items in iter_occasions(filename):
+            settlement = compute_occasion(occasion, people, items)
+            names_amounts = sort_names_amounts({person.person_id: person.initial_amount for person in settlement.people})
+            shares = {person.person_id: person.share for person in settlement.people}
+            print(f"{occasion} ({len(people)} people, {len(items)} items):")
+            compare_algorithms(names_amounts, shares, repeat)
+    except FileNotFoundError:
+        print(f"Error: The file {filename} was not found.")
+    except InputFileError as e:
+        print(f"Error: {e}")
+
+def connect_database(path="presents_database.db", wal=False):
+    """Connect to the database and make the connection available to all functions in this module.
     
-    # reading data from file
-    occasion, people, items = data_from_file(filename)
+    With wal=True the database uses write-ahead logging, so readers don't block the writer during long batch runs.
+    """
+    global connection, cursor
+    connection = sq.connect(path)
+    cursor = connection.cursor()
+    if wal:
+        cursor.execute(""" PRAGMA journal_mode=WAL """)
+
+def prepare_database(schema_mode=None):
+    """Create the tables and, in the triggers mode, the triggers (see run). Returns the schema mode of the database.
     
-    # adding a new occasion
-    add_occasion(occasion)
-    occasion_id = get_occasion_id(occasion)
+    A new database gets schema_mode (triggers if it's None). An existing database keeps its mode: triggers if it has
+    the triggers, set_based if it doesn't (see migrate_database). If schema_mode is given and the existing database
+    uses the other mode, SchemaModeError is raised, so a database is never calculated in two ways at once.
+    """
+    if schema_mode is not None and schema_mode not in schema_modes:
+        raise ValueError(f"Unknown schema mode {schema_mode}. Please choose {' or '.join(schema_modes)}")
+    cursor.execute(""" SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'occasions') """)
+    is_new = not cursor.fetchone()[0]
     
-    # adding people and items
-    add_people(people, occasion_id)
-    add_items(items, occasion_id)
+    create_database()
+    upgrade_database()
+    create_indexes()
+    if is_new:
+        database_mode = schema_mode or "triggers"
+    else:
+        database_mode = get_schema_mode()
+    if schema_mode is not None and schema_mode != database_mode:
+        raise SchemaModeError(schema_mode, database_mode)
+    if database_mode == "triggers":
+        create_triggers()
+    return database_mode
+
+def run(filename, algorithm="all_pairs", schema_mode=None, report_format="text"):
+    """Calculate the transactions for the occasion described in the file and write the result.
     
-    # finding the number of people
-    num_people = find_num_people(occasion_id)
+    algorithm - how to calculate the transactions (see settle).
+    schema_mode - how to calculate the amounts spent: triggers - with triggers that run for every
+    inserted row (see create_triggers), set_based - with a few aggregate queries per occasion
+    (see calc_initial_amounts and calc_final_amounts). It's only chosen for a new database, None means the mode
+    of the database (see prepare_database). Use migrate_database to switch an existing database to the set-based mode.
+    report_format - text, json or csv (see write_report).
+    """
+    # connecting to the database and creating it
+    schema_mode = prepare_database(schema_mode)
     
-    # finding the right amount
-    right_amount = calc_right_amount(occasion_id, num_people)
-    add_right_amount(occasion_id, right_amount)
+    # the whole file is checked first, then read one occasion at a time;
+    # occasions that are already in the database (for example, from an earlier run) are skipped
+    try:
+        check_file(filename)
+        for num, (occasion, people, items) in enumerate(iter_occasions(filename)):
+            try:
+                run_occasion(filename, occasion, people, items, algorithm, schema_mode, report_format, num)
+            except OccasionExistsError as e:
+                print(f"Error: {e}. The occasion was skipped.")
+    except FileNotFoundError:
+        print(f"Error: The file {filename} was not found.")
+    except InputFileError as e:
+        print(f"Error: {e}")
+
+def run_occasion(filename, occasion, people, items, algorithm="all_pairs", schema_mode="triggers", report_format="text",
+                 num=0):
+    """Save an occasion that has already been read from the file, calculate the transactions and write the result.
     
-    # creating a names_amounts dictionary.
-    names_amounts = create_names_amounts(occasion_id)
+    num is the number of the occasion in the file. The result of the first one is saved to filename_result.txt,
+    the result of the second one to filename_result_2.txt and so on.
+    """
     
-    # calculating transactions based on names_amounts
-    who_sends_what = calc(names_amounts)
-    add_transactions(who_sends_what, occasion_id)
+    # everything about the occasion is saved in one transaction:
+    # it's committed at the end of the block or rolled back if anything goes wrong
+    with connection:
+        # adding a new occasion
+        add_occasion(occasion)
+        occasion_id = get_occasion_id(occasion)
+        
+        # adding people and items
+        names_ids = add_people(people, occasion_id)
+        add_items(items, occasion_id, names_ids)
+        if schema_mode == "set_based":
+            calc_initial_amounts(occasion_id)
+        
+        # finding the number of people
+        num_people = find_num_people(occasion_id)
+        
+        # finding the right amount
+        right_amount = calc_right_amount(occasion_id, num_people)
+        add_right_amount(occasion_id, right_amount)
+        shares = add_shares(occasion_id)
+        
+        # creating a names_amounts dictionary.
+        names_amounts = create_names_amounts(occasion_id)
+        
+        # calculating transactions based on names_amounts
+        who_sends_what = settle(names_amounts, shares, algorithm)
+        add_transactions(who_sends_what, occasion_id)
+        record_settlement(occasion_id, 1, algorithm)
+        if schema_mode == "set_based":
+            calc_final_amounts(occasion_id)
     
-    # checking whether the final amount is close to the right amount (+-2)
-    check(occasion_id, right_amount)
+    # checking whether everyone's final amount is exactly their share
+    check(occasion_id)
     
     # writing results to a new file
-    result(filename, f'{filename}_result.txt', who_sends_what, occasion_id, num_people, right_amount)
+    suffix = f"_{num + 1}" if num else ""
+    new_file = f'{filename}_result{suffix}.{report_formats[report_format]}'
+    result(filename, new_file, occasion_id, num_people, right_amount, report_format)
+
+def uses_triggers():
+    """Check whether the database calculates the amounts with triggers (see create_triggers) or in the set-based mode."""
+    cursor.execute(""" SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'count_total') """)
+    return bool(cursor.fetchone()[0])
+
+def get_schema_mode():
+    """Return the schema mode of an existing database: triggers or set_based."""
+    return "triggers" if uses_triggers() else "set_based"
+
+def add_spent(occasion_id, spent):
+    """Change the total and the initial amounts by the sums in the dictionary {person_id: amount}, amounts can be negative."""
+    update_initial = """ UPDATE people SET initial_amount = initial_amount + ? WHERE person_id = ? """
+    cursor.executemany(update_initial, ((amount, person_id) for person_id, amount in spent.items()))
+    update_total = """ UPDATE occasions SET total_spent = total_spent + ? WHERE occasion_id = ? """
+    cursor.execute(update_total, (sum(spent.values()), occasion_id))
+
+def remove_items(items, occasion_id, names_ids):
+    """Remove items given as tuples (item_name, price, buyer_name), one row for every tuple.
+    
+    Returns the dictionary {person_id: -amount} with the sums to take off the buyers (see add_spent).
+    """
+    find_item = """ SELECT item_id FROM items
+    WHERE occasion_id = ? AND item_name = ? AND item_price = ? AND person_id = ? ORDER BY item_id LIMIT 1 """
+    delete_item = """ DELETE FROM items WHERE item_id = ? """
+    spent = {}
+    for name, price, buyer in items:
+        cursor.execute(find_item, (occasion_id, name, price, names_ids.get(buyer)))
+        item = cursor.fetchone()
+        if item is None:
+            raise ValueError(f"{buyer} didn't buy {name} for {format_amount(price)}")
+        cursor.execute(delete_item, (item[0], ))
+        spent[names_ids[buyer]] = spent.get(names_ids[buyer], 0) - price
+    return spent
+
+def load_transactions(occasion_id, version):
+    """Load a version of the occasion's transactions as dictionary who_sends_what."""
+    select_transactions = """ SELECT sender_id, receiver_id, amount FROM transactions
+    WHERE occasion_id = ? AND version = ? ORDER BY transaction_id """
+    cursor.execute(select_transactions, (occasion_id, version))
+    who_sends_what = {}
+    for sender, receiver, amount in cursor.fetchall():
+        who_sends_what.setdefault(sender, []).append([receiver, amount])
+    return who_sends_what
+
+def merge_transactions(who_sends_what, corrections):
+    """Add the corrections to the transactions. Both are dictionaries who_sends_what.
+    
+    If two people already have a transaction, its amount changes instead of a new one being added,
+    and money going in opposite directions between the same two people is netted.
+    Returns a new dictionary, the given ones are not changed.
+    """
+    merged = {sender: [list(transaction) for transaction in transactions] for sender, transactions in who_sends_what.items()}
+    
+    def find(sender, receiver):
+        for transaction in merged.get(sender, []):
+            if transaction[0] == receiver:
+                return transaction
+    
+    for sender, receiver, amount in iter_transactions(corrections):
+        same = find(sender, receiver)
+        opposite = find(receiver, sender)
+        if same:
+            same[1] += amount
+        elif opposite and opposite[1] >= amount:
+            opposite[1] -= amount
+        elif opposite:
+            merged.setdefault(sender, []).append([receiver, amount - opposite[1]])
+            opposite[1] = 0
+        else:
+            merged.setdefault(sender, []).append([receiver, amount])
+    return merged
+
+def diff_transactions(old, new):
+    """Compare two dictionaries who_sends_what.
+    
+    Returns a list of tuples (sender_id, receiver_id, old_amount, new_amount) for every transaction
+    that was added (old_amount is 0), removed (new_amount is 0) or changed.
+    """
+    old_amounts = {(sender, receiver): amount for sender, receiver, amount in iter_transactions(old)}
+    new_amounts = {(sender, receiver): amount for sender, receiver, amount in iter_transactions(new)}
+    diff = []
+    for pair in dict.fromkeys(list(old_amounts) + list(new_amounts)):
+        old_amount = old_amounts.get(pair, 0)
+        new_amount = new_amounts.get(pair, 0)
+        if old_amount != new_amount:
+            diff.append((pair[0], pair[1], old_amount, new_amount))
+    return diff
+
+def update_occasion(occasion, new_people=(), removed_people=(), new_items=(), removed_items=(),
+                    algorithm="all_pairs", incremental=True, note=None):
+    """Change an occasion that is already in the database and save its transactions as a new version.
+    
+    new_people and removed_people are lists of names, new_items and removed_items are lists of tuples
+    (item_name, price, buyer_name) like in iter_occasions. People can only be removed once they have no items.
+    
+    Only the affected amounts are changed: the buyers' initial amounts and the total by the sums of the added
+    and removed items. With incremental=True the transactions of the previous version are kept and
+    only corrected: everyone's difference from their new share is settled with as few transactions as possible
+    (see calc_min_transfers) and merged into the old ones (see merge_transactions), so most transactions stay the same.
+    With incremental=False the transactions are calculated from scratch with the algorithm.
+    
+    Everything is done in one transaction. Returns the new version and the list of changed transactions
+    as tuples (sender_name, receiver_name, old_amount, new_amount).
+    """
+    with connection:
+        cursor.execute(""" SELECT occasion_id FROM occasions WHERE occasion_name = ? """, (occasion, ))
+        found = cursor.fetchone()
+        if found is None:
+            raise ValueError(f"There's no occasion {occasion} in the database")
+        occasion_id = found[0]
+        version = get_version(occasion_id)
+        old_transactions = load_transactions(occasion_id, version)
+        
+        # adding people
+        names_ids = find_people_ids(occasion_id)
+        for name in new_people:
+            if name in names_ids:
+                raise ValueError(f"{name} is already on the list of people")
+        if new_people:
+            names_ids = add_people(new_people, occasion_id)
+        names = {person_id: name for name, person_id in names_ids.items()}
+        
+        # adding and removing items, the triggers only take care of added items
+        spent = {}
+        if new_items:
+            add_items(new_items, occasion_id, names_ids)
+            if not uses_triggers():
+                for name, price, buyer in new_items:
+                    spent[names_ids[buyer]] = spent.get(names_ids[buyer], 0) + price
+        for person_id, amount in remove_items(removed_items, occasion_id, names_ids).items():
+            spent[person_id] = spent.get(person_id, 0) + amount
+        if spent:
+            add_spent(occasion_id, spent)
+        
+        # removing people
+        removed_ids = set()
+        for name in removed_people:
+            if name not in names_ids:
+                raise ValueError(f"{name} is not on the list of people")
+            cursor.execute(""" SELECT EXISTS (SELECT 1 FROM items WHERE person_id = ?) """, (names_ids[name], ))
+            if cursor.fetchone()[0]:
+                raise ValueError(f"{name} still has items, please remove them first")
+            removed_ids.add(names_ids[name])
+        cursor.executemany(""" DELETE FROM people WHERE person_id = ? """, ((person_id, ) for person_id in removed_ids))
+        
+        # the shares change for everyone when the total or the number of people changes
+        num_people = find_num_people(occasion_id)
+        if not num_people:
+            raise ValueError(f"Occasion {occasion} would have no people")
+        add_right_amount(occasion_id, calc_right_amount(occasion_id, num_people))
+        shares = add_shares(occasion_id)
+        names_amounts = create_names_amounts(occasion_id)
+        
+        if incremental:
+            kept = {sender: [transaction for transaction in transactions if transaction[0] not in removed_ids]
+                    for sender, transactions in old_transactions.items() if sender not in removed_ids}
+            final_amounts = dict(names_amounts)
+            for sender, receiver, amount in iter_transactions(kept):
+                final_amounts[sender] += amount
+                final_amounts[receiver] -= amount
+            who_sends_what = merge_transactions(kept, calc_min_transfers(final_amounts, shares))
+        else:
+            who_sends_what = settle(names_amounts, shares, algorithm)
+        
+        new_version = version + 1
+        cursor.execute(""" UPDATE occasions SET version = ? WHERE occasion_id = ? """, (new_version, occasion_id))
+        # the calc_final trigger only counts the first version, the final amounts are calculated from scratch
+        add_transactions(who_sends_what, occasion_id, new_version)
+        calc_final_amounts(occasion_id)
+        record_settlement(occasion_id, new_version, "incremental" if incremental else algorithm, note)
+    
+    check(occasion_id)
+    diff = [(names[sender], names[receiver], old_amount, new_amount)
+            for sender, receiver, old_amount, new_amount in diff_transactions(old_transactions, who_sends_what)]
+    return new_version, diff
+
+def print_diff(occasion, version, diff):
+    """Print the transactions that changed in the new version of the occasion."""
+    print(f"{occasion}, version {version}: {len(diff)} transactions changed.")
+    for sender, receiver, old_amount, new_amount in diff:
+        if not old_amount:
+            print(f"  new: {sender} sends {format_amount(new_amount)} to {receiver}")
+        elif not new_amount:
+            print(f"  cancelled: {sender} no longer sends {format_amount(old_amount)} to {receiver}")
+        else:
+            print(f"  changed: {sender} sends {format_amount(new_amount)} to {receiver} instead of {format_amount(old_amount)}")
+
+def run_update(filename, algorithm="all_pairs", incremental=True, schema_mode=None, report_format="text"):
+    """Add the people and items from the file to occasions that are already in the database.
+    
+    The file has the usual format. People who are not in the occasion yet are added, all items are added.
+    Occasions that are not in the database yet are created as usual (see run_occasion).
+    """
+    schema_mode = prepare_database(schema_mode)
+    try:
+        check_file(filename)
+        for num, (occasion, people, items) in enumerate(iter_occasions(filename)):
+            cursor.execute(""" SELECT occasion_id FROM occasions WHERE occasion_name = ? """, (occasion, ))
+            found = cursor.fetchone()
+            if found is None:
+                run_occasion(filename, occasion, people, items, algorithm, schema_mode, report_format, num)
+                continue
+            
+            names_ids = find_people_ids(found[0])
+            new_people = [name for name in people if name not in names_ids]
+            version, diff = update_occasion(occasion, new_people, new_items=items, algorithm=algorithm,
+                                            incremental=incremental, note=f"{len(items)} items from {filename}")
+            print_diff(occasion, version, diff)
+            
+            suffix = f"_{num + 1}" if num else ""
+            new_file = f'{filename}_result{suffix}.{report_formats[report_format]}'
+            num_people = find_num_people(found[0])
+            result(filename, new_file, found[0], num_people, calc_right_amount(found[0], num_people), report_format)
+    except FileNotFoundError:
+        print(f"Error: The file {filename} was not found.")
+    except InputFileError as e:
+        print(f"Error: {e}")
+
+def find_files(paths):
+    """Turn a list of files, directories and glob patterns into a sorted list of occasion files.
+    
+    All txt files are taken from directories. Result files (*_result.txt, *_result_2.txt, ...) are skipped.
+    """
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.update(glob.glob(os.path.join(path, "*.txt")))
+        else:
+            matches = glob.glob(path)
+            if not matches:
+                print(f"Error: No files match {path}.")
+            filenames.update(matches)
+    return sorted(filename for filename in filenames if not is_result_file(filename))
+
+def is_result_file(filename):
+    """Check whether the file was written by result(): filename_result.txt or filename_result_2.txt and so on."""
+    name = os.path.splitext(filename)[0]
+    return name.endswith("_result") or name.rstrip("0123456789").endswith("_result_")
+
+def parse_file(filename):
+    """Read an occasion file in a worker process. Returns the filename, the list of occasions and the time it took."""
+    started = time.perf_counter()
+    data = data_from_file(filename)
+    return filename, data, time.perf_counter() - started
+
+def run_batch(paths, database="presents_database.db", algorithm="all_pairs", schema_mode=None,
+              workers=None, queue_size=16, report_format="text"):
+    """Process many occasion files into one database.
+    
+    Files are read in parallel by worker processes, while this process is the only one that writes to the database
+    (in WAL mode). At most queue_size files are read ahead of the writer, so memory use stays bounded.
+    Prints the time for every file and the overall throughput.
+    """
+    filenames = find_files(paths)
+    print(f"Processing {len(filenames)} files into {database}.")
+    
+    connect_database(database, wal=True)
+    schema_mode = prepare_database(schema_mode)
+    
+    started = time.perf_counter()
+    processed = 0
+    total_items = 0
+    
+    files_of_futures = {}
+    
+    def write(future):
+        nonlocal processed, total_items
+        try:
+            filename, occasions, parse_time = future.result()
+            write_started = time.perf_counter()
+            for num, (occasion, people, items) in enumerate(occasions):
+                try:
+                    run_occasion(filename, occasion, people, items, algorithm, schema_mode, report_format, num)
+                except OccasionExistsError as e:
+                    print(f"Error: {e}. The occasion was skipped.")
+        except Exception as e:
+            print(f"Error: could not process {files_of_futures[future]}: {e}")
+            return
+        write_time = time.perf_counter() - write_started
+        processed += 1
+        num_people = sum(len(people) for occasion, people, items in occasions)
+        num_items = sum(len(items) for occasion, people, items in occasions)
+        total_items += num_items
+        print(f"{filename}: {len(occasions)} occasions, {num_people} people, {num_items} items, "
+              f"read in {parse_time:.3f} s, saved and calculated in {write_time:.3f} s")
+    
+    with ProcessPoolExecutor(workers) as executor:
+        in_flight = set()
+        for filename in filenames:
+            # the writer takes the finished files before more are read
+            if len(in_flight) >= queue_size:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            future = executor.submit(parse_file, filename)
+            files_of_futures[future] = filename
+            in_flight.add(future)
+        
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(future)
+    
+    elapsed = time.perf_counter() - started
+    print(f"\nProcessed {processed} of {len(filenames)} files ({total_items} items) in {elapsed:.2f} s: "
+          f"{processed / elapsed:.1f} files/s, {total_items / elapsed:.1f} items/s.")
     
 if __name__ == "__main__":
-    filename = input("Please, type in a filename. ").strip()
-    connection = sq.connect('presents_database.db')
-    cursor = connection.cursor()
-    run(filename)
+    parser = argparse.ArgumentParser(description="Calculate who should send how much to whom so that everyone spends the same.")
+    parser.add_argument("paths", nargs="*", help="occasion files, directories or glob patterns; if none are given, you'll be asked for a file")
+    parser.add_argument("--database", default="presents_database.db", help="database file")
+    parser.add_argument("--algorithm", choices=settlement_algorithms, help="how to calculate the transactions")
+    parser.add_argument("--schema-mode", choices=schema_modes,
+                        help="how to calculate the amounts spent in a new database (triggers by default); "
+                             "an existing database keeps its mode, see --migrate")
+    parser.add_argument("--workers", type=int, help="number of processes that read the files")
+    parser.add_argument("--queue-size", type=int, default=16, help="how many files can be read ahead of the database writer")
+    parser.add_argument("--report-format", default="text", choices=report_formats, help="format of the result files")
+    parser.add_argument("--update", action="store_true",
+                        help="add the people and items from the files to occasions already in the database")
+    parser.add_argument("--full", action="store_true", help="with --update, calculate all transactions from scratch")
+    parser.add_argument("--in-memory", action="store_true", help="calculate without a database")
+    parser.add_argument("--persist", action="store_true", help="with --in-memory, also save the occasions to the database")
+    parser.add_argument("--migrate", action="store_true", help="switch the database to the set-based mode and exit")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare the number of transactions and the run time of the settlement algorithms, save nothing")
+    args = parser.parse_args()
+    
+    try:
+        if args.compare:
+            # nothing is saved, the database is only there so it can be closed like in the other modes
+            connect_database(":memory:")
+            for filename in find_files(args.paths) if args.paths else [input("Please, type in a filename. ").strip()]:
+                run_compare(filename)
+        elif args.in_memory:
+            filenames = find_files(args.paths) if args.paths else [input("Please, type in a filename. ").strip()]
+            # without --persist the database isn't touched at all
+            connect_database(args.database if args.persist else ":memory:")
+            for filename in filenames:
+                run_in_memory(filename, args.algorithm or "all_pairs", args.report_format, args.persist, args.schema_mode)
+        elif args.update:
+            connect_database(args.database)
+            for filename in find_files(args.paths) if args.paths else [input("Please, type in a filename. ").strip()]:
+                run_update(filename, args.algorithm or "all_pairs", not args.full, args.schema_mode, args.report_format)
+        elif args.migrate:
+            connect_database(args.database)
+            prepare_database()
+            migrate_database()
+        elif args.paths:
+            run_batch(args.paths, args.database, args.algorithm or "all_pairs", args.schema_mode, args.workers,
+                      args.queue_size, args.report_format)
+        else:
+            filename = input("Please, type in a filename. ").strip()
+            algorithm = args.algorithm or ask_algorithm()
+            connect_database(args.database)
+            run(filename, algorithm, args.schema_mode, args.report_format)
+    except SchemaModeError as e:
+        print(f"Error: {e}")
     cursor.close()
     connection.close()
-
@@ -0,0 +1,300 @@
+import csv
+import io
+import json
+
+import pytest
+
+import splitting_the_cost as stc
+
+@pytest.fixture(params=["triggers", "set_based"])
+def schema_mode(request):
+    """A fresh in-memory database for every test, prepared in both schema modes."""
+    stc.connect_database(":memory:")
+    stc.prepare_database(request.param)
+    yield request.param
+    stc.connection.close()
+
+def write_occasion(path, people, items, name="Party"):
+    """Write an occasion file. items are strings like "x - A - 100"."""
+    path.write_text("Occasion:\n" + name + "\n\nPeople:\n" + "\n".join(people) + "\n\nItems:\n" + "\n".join(items) + "\n")
+    return str(path)
+
+def save_occasion(tmp_path, schema_mode, people, items):
+    filename = write_occasion(tmp_path / "occasion.txt", people, items)
+    for occasion, people, items in stc.iter_occasions(filename):
+        stc.run_occasion(filename, occasion, people, items, schema_mode=schema_mode)
+    return stc.get_occasion_id("Party")
+
+def final_amounts(occasion_id):
+    stc.cursor.execute(""" SELECT person_name, final_amount, share FROM people WHERE occasion_id = ? ORDER BY person_id """,
+                       (occasion_id, ))
+    return stc.cursor.fetchall()
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_update_adds_person_without_items(tmp_path, schema_mode, incremental):
+    occasion_id = save_occasion(tmp_path, schema_mode, ["A", "B"], ["x - A - 100"])
+    version, diff = stc.update_occasion("Party", new_people=["C"], incremental=incremental)
+
+    assert version == 2
+    assert diff
+    assert [(name, final) for name, final, share in final_amounts(occasion_id)] == [("A", 3334), ("B", 3333), ("C", 3333)]
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_update_only_removes_items(tmp_path, schema_mode, incremental):
+    occasion_id = save_occasion(tmp_path, schema_mode, ["A", "B"], ["x - A - 100", "y - B - 40"])
+    stc.update_occasion("Party", removed_items=[("y", 4000, "B")], incremental=incremental)
+
+    assert all(final == share for name, final, share in final_amounts(occasion_id))
+    assert stc.get_version(occasion_id) == 2
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_update_moves_items_away_from_top_spender(tmp_path, schema_mode, incremental):
+    occasion_id = save_occasion(tmp_path, schema_mode, ["A", "B", "C"], ["x - A - 10", "y - B - 3"])
+    stc.update_occasion("Party", removed_items=[("x", 1000, "A")], new_items=[("z", 1100, "B")], incremental=incremental)
+
+    assert [(name, final) for name, final, share in final_amounts(occasion_id)] == [("A", 467), ("B", 467), ("C", 466)]
+    stc.cursor.execute(""" SELECT initial_amount FROM people WHERE occasion_id = ? ORDER BY person_id """, (occasion_id, ))
+    assert stc.cursor.fetchall() == [(0, ), (1400, ), (0, )]
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_update_gives_the_same_result_in_both_modes(tmp_path, incremental):
+    results = []
+    for mode in stc.schema_modes:
+        stc.connect_database(":memory:")
+        stc.prepare_database(mode)
+        occasion_id = save_occasion(tmp_path, mode, ["A", "B", "C"], ["x - A - 22", "y - B - 10", "z - C - 16.01"])
+        version, diff = stc.update_occasion("Party", new_people=["D"], new_items=[("w", 700, "D")],
+                                            removed_items=[("y", 1000, "B")], incremental=incremental)
+        stc.cursor.execute(""" SELECT total_spent, right_amount FROM occasions WHERE occasion_id = ? """, (occasion_id, ))
+        results.append((version, diff, stc.cursor.fetchone(), final_amounts(occasion_id)))
+        stc.connection.close()
+
+    assert results[0] == results[1]
+    version, diff, (total, right_amount), people = results[0]
+    assert (version, total, right_amount) == (2, 4501, 1125)
+    assert all(final == share for name, final, share in people)
+
+def test_mistake_later_in_file_saves_nothing(tmp_path, schema_mode, capsys):
+    filename = tmp_path / "occasions.txt"
+    filename.write_text("Occasion:\nOne\n\nPeople:\nA\nB\n\nItems:\nx - A - 10\n\n"
+                        "Occasion:\nTwo\n\nPeople:\nA\n\nItems:\ny - Z - 5\n")
+    stc.run(str(filename), schema_mode=schema_mode)
+
+    assert "Z bought y" in capsys.readouterr().out
+    stc.cursor.execute(""" SELECT COUNT(*) FROM occasions """)
+    assert stc.cursor.fetchone()[0] == 0
+
+def test_rerun_skips_stored_occasions(tmp_path, schema_mode, capsys):
+    filename = write_occasion(tmp_path / "occasion.txt", ["A", "B"], ["x - A - 10"])
+    stc.run(filename, schema_mode=schema_mode)
+    stc.run(filename, schema_mode=schema_mode)
+
+    assert "already an occasion Party" in capsys.readouterr().out
+    stc.cursor.execute(""" SELECT COUNT(*) FROM occasions """)
+    assert stc.cursor.fetchone()[0] == 1
+    with pytest.raises(stc.OccasionExistsError):
+        stc.add_occasion("Party")
+
+@pytest.mark.parametrize("algorithm", ["all_pairs", "min_transfers"])
+def test_saved_occasion_matches_compute_occasion(tmp_path, schema_mode, algorithm):
+    people = ["A", "B", "C", "D"]
+    items = [("x", 2200, "A"), ("y", 1000, "B"), ("z", 1601, "C"), ("w", 200, "A")]
+    settlement = stc.compute_occasion("Party", people, items, algorithm)
+    stc.run_occasion(str(tmp_path / "occasion.txt"), "Party", people, items, algorithm, schema_mode)
+    occasion_id = stc.get_occasion_id("Party")
+
+    stc.cursor.execute(""" SELECT person_name, initial_amount, share, final_amount FROM people
+    WHERE occasion_id = ? ORDER BY person_id """, (occasion_id, ))
+    assert stc.cursor.fetchall() == [(person.name, person.initial_amount, person.share, person.final_amount)
+                                     for person in settlement.people]
+    stc.cursor.execute(""" SELECT senders.person_name, receivers.person_name, amount FROM transactions
+    JOIN people AS senders ON senders.person_id = sender_id JOIN people AS receivers ON receivers.person_id = receiver_id
+    WHERE transactions.occasion_id = ? ORDER BY transaction_id """, (occasion_id, ))
+    assert stc.cursor.fetchall() == [(sender, receiver, amount)
+                                     for _, sender, _, receiver, amount in settlement.transaction_rows()]
+
+def reconnect(database):
+    stc.connection.close()
+    stc.connect_database(str(database))
+
+def test_database_keeps_its_schema_mode(tmp_path):
+    database = tmp_path / "presents.db"
+    stc.connect_database(str(database))
+    assert stc.prepare_database("set_based") == "set_based"
+    reconnect(database)
+
+    assert stc.prepare_database() == "set_based"
+    assert not stc.uses_triggers()
+    with pytest.raises(stc.SchemaModeError, match="--migrate"):
+        stc.prepare_database("triggers")
+    assert not stc.uses_triggers()
+    stc.connection.close()
+
+def test_migrate_stays_set_based(tmp_path):
+    database = tmp_path / "presents.db"
+    stc.connect_database(str(database))
+    occasion_id = save_occasion(tmp_path, stc.prepare_database(), ["A", "B"], ["x - A - 100"])
+    stc.migrate_database()
+    reconnect(database)
+
+    assert stc.prepare_database() == "set_based"
+    stc.cursor.execute(""" SELECT name FROM sqlite_master WHERE type IN ('trigger', 'view') """)
+    assert stc.cursor.fetchall() == []
+    stc.update_occasion("Party", new_items=[("y", 5000, "B")])
+    assert all(final == share == 7500 for name, final, share in final_amounts(occasion_id))
+    stc.cursor.execute(""" SELECT initial_amount FROM people WHERE occasion_id = ? ORDER BY person_id """, (occasion_id, ))
+    assert stc.cursor.fetchall() == [(10000, ), (5000, )]
+    stc.connection.close()
+
+@pytest.mark.parametrize("algorithm", ["all_pairs", "min_transfers"])
+def test_settle_everyone_ends_with_their_share(algorithm):
+    names_amounts = stc.sort_names_amounts({1: 2200, 2: 1000, 3: 1601, 4: 200})
+    shares = stc.split_total(sum(names_amounts.values()), list(names_amounts))
+    final = dict(names_amounts)
+    for sender, receiver, amount in stc.iter_transactions(stc.settle(names_amounts, shares, algorithm)):
+        assert amount > 0
+        final[sender] += amount
+        final[receiver] -= amount
+
+    assert final == shares
+
+def test_min_transfers_needs_at_most_n_minus_one():
+    names_amounts = stc.sort_names_amounts({1: 2200, 2: 1000, 3: 1600, 4: 200, 5: 0})
+    shares = stc.split_total(sum(names_amounts.values()), list(names_amounts))
+    assert len(list(stc.iter_transactions(stc.settle(names_amounts, shares, "min_transfers")))) <= 4
+
+def test_settle_unknown_algorithm():
+    with pytest.raises(ValueError):
+        stc.settle({1: 100, 2: 0}, {1: 50, 2: 50}, "greedy")
+
+def test_ask_algorithm_until_the_answer_is_known(monkeypatch, capsys):
+    answers = iter(["min_transfer", "min_transfers", ""])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    assert stc.ask_algorithm() == "min_transfers"
+    assert "there's no algorithm min_transfer" in capsys.readouterr().out
+    assert stc.ask_algorithm() == "all_pairs"
+
+def test_run_compare_saves_nothing(tmp_path, capsys):
+    filename = write_occasion(tmp_path / "occasion.txt", ["A", "B", "C", "D"],
+                              ["x - A - 22", "y - B - 10", "z - C - 16", "w - D - 2"])
+    stc.run_compare(filename, repeat=1)
+
+    out = capsys.readouterr().out
+    assert "Party (4 people, 4 items):" in out
+    assert "all_pairs: 6 transactions" in out and "min_transfers: 3 transactions" in out
+    assert [path.name for path in tmp_path.iterdir()] == ["occasion.txt"]
+
+def test_run_batch_saves_every_good_file(tmp_path, capsys):
+    occasions = tmp_path / "occasions"
+    occasions.mkdir()
+    for num in range(3):
+        write_occasion(occasions / f"party_{num}.txt", ["A", "B"], [f"x - A - {10 * (num + 1)}"], name=f"Party {num}")
+    (occasions / "broken.txt").write_text("Occasion:\nBroken\n\nPeople:\nA\n\nItems:\ny - Z - 5\n")
+    database = tmp_path / "presents.db"
+    stc.run_batch([str(occasions)], str(database), queue_size=2, workers=2)
+
+    out = capsys.readouterr().out
+    assert "Processed 3 of 4 files (3 items)" in out
+    assert "could not process" in out and "broken.txt" in out
+    stc.cursor.execute(""" PRAGMA journal_mode """)
+    assert stc.cursor.fetchone()[0] == "wal"
+    stc.cursor.execute(""" SELECT occasion_name, total_spent FROM occasions ORDER BY occasion_name """)
+    assert stc.cursor.fetchall() == [("Party 0", 1000), ("Party 1", 2000), ("Party 2", 3000)]
+    assert sorted(path.name for path in occasions.glob("*_result.txt")) == [f"party_{num}.txt_result.txt" for num in range(3)]
+    stc.connection.close()
+
+def test_json_report(tmp_path, schema_mode):
+    filename = write_occasion(tmp_path / "occasion.txt", ["A", "B", "C"], ["x - A - 100.50"])
+    stc.run(filename, schema_mode=schema_mode, report_format="json")
+
+    with open(filename + "_result.json", encoding="utf-8") as file:
+        report = json.load(file)
+    assert report["occasion"] == "Party"
+    assert (report["total_spent"], report["num_people"], report["right_amount"]) == (100.5, 3, 33.5)
+    assert [(person["name"], person["initial_amount"], person["sent"], person["received"], person["final_amount"])
+            for person in report["people"]] == [("A", 100.5, 0, 67, 33.5), ("B", 0, 33.5, 0, 33.5), ("C", 0, 33.5, 0, 33.5)]
+    assert sorted((t["sender"], t["receiver"], t["amount"]) for t in report["transactions"]) == [
+        ("B", "A", 33.5), ("C", "A", 33.5)]
+
+def test_csv_report(tmp_path, schema_mode):
+    filename = write_occasion(tmp_path / "occasion.txt", ["A", "B", "C"], ["x - A - 100.50"])
+    stc.run(filename, schema_mode=schema_mode, report_format="csv")
+
+    with open(filename + "_result.csv", newline="", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["sender", "receiver", "amount"]
+    assert sorted(rows[1:]) == [["B", "A", "33.50"], ["C", "A", "33.50"]]
+    assert not (tmp_path / "occasion.txt_result.txt").exists()
+
+def test_unknown_report_format():
+    with pytest.raises(ValueError):
+        stc.write_report(io.StringIO(), "xml", "Party", 100, 1, 100, [], [])
+
+def test_input_file_error_lists_every_mistake(tmp_path):
+    filename = tmp_path / "occasion.txt"
+    filename.write_text("Occasion:\nParty\n\nPeople:\nA\nA\nB\n\nItems:\nx - A - 10\ny - C - 5\nz - B - ten\nw - B\n")
+    with pytest.raises(stc.InputFileError) as error:
+        stc.data_from_file(str(filename))
+
+    assert [message.split(":")[0] for message in error.value.errors] == ["line 6", "line 11", "line 12", "line 13"]
+    assert "4 errors" in str(error.value)
+
+def test_zero_price_is_a_mistake(tmp_path, schema_mode, capsys):
+    filename = write_occasion(tmp_path / "occasion.txt", ["A", "B"], ["x - A - 10", "y - B - 0.00"])
+    stc.run(filename, schema_mode=schema_mode)
+
+    assert "line 10: the price of y should be more than 0, got '0.00'" in capsys.readouterr().out
+    stc.cursor.execute(""" SELECT COUNT(*) FROM occasions """)
+    assert stc.cursor.fetchone()[0] == 0
+
+def test_empty_and_repeated_occasions(tmp_path):
+    filename = tmp_path / "occasions.txt"
+    filename.write_text("Occasion:\nParty\n\nPeople:\nA\n\nOccasion:\nEmpty\n\nOccasion:\nParty\n\nPeople:\nB\n")
+    with pytest.raises(stc.InputFileError) as error:
+        stc.check_file(str(filename))
+
+    assert error.value.errors == ["line 7: occasion Empty has no people", "line 11: occasion Party is already in the file"]
+
+def test_split_total_adds_up():
+    assert stc.split_total(1000, [3, 1, 2]) == {1: 334, 2: 333, 3: 333}
+    assert stc.split_total(0, [1, 2]) == {1: 0, 2: 0}
+    assert sum(stc.split_total(100001, list(range(7))).values()) == 100001
+
+@pytest.mark.parametrize("text, cents", [("12", 1200), ("12.5", 1250), ("12.50", 1250), ("0.05", 5), ("0", 0),
+                                         ("12.505", None), ("-1", None), ("12.", None), (".5", None), ("ten", None)])
+def test_parse_amount(text, cents):
+    assert stc.parse_amount(text) == cents
+
+def test_upgrade_old_database(tmp_path):
+    stc.connect_database(str(tmp_path / "presents.db"))
+    stc.cursor.executescript("""
+    CREATE TABLE occasions (occasion_id INTEGER PRIMARY KEY AUTOINCREMENT, occasion_name TEXT NOT NULL,
+    total_spent INTEGER, right_amount INTEGER);
+    CREATE TABLE people (person_id INTEGER PRIMARY KEY AUTOINCREMENT, person_name TEXT NOT NULL,
+    initial_amount INTEGER, final_amount INTEGER, occasion_id INTEGER NOT NULL);
+    CREATE TABLE items (item_id INTEGER PRIMARY KEY AUTOINCREMENT, item_name TEXT NOT NULL, item_price INTEGER,
+    person_id INTEGER NOT NULL, occasion_id INTEGER NOT NULL);
+    CREATE TABLE transactions (transaction_id INTEGER PRIMARY KEY AUTOINCREMENT, sender_id INTEGER NOT NULL,
+    receiver_id INTEGER NOT NULL, amount INTEGER, occasion_id INTEGER NOT NULL);
+    CREATE INDEX transactions_occasion ON transactions (occasion_id);
+    CREATE VIEW person_balances AS SELECT person_id, initial_amount FROM people;
+    INSERT INTO occasions VALUES (1, 'Party', 10, 5);
+    INSERT INTO people VALUES (1, 'A', 10, 5, 1), (2, 'B', 0, 5, 1);
+    INSERT INTO items VALUES (1, 'x', 10, 1, 1);
+    INSERT INTO transactions VALUES (1, 2, 1, 5, 1);
+    """)
+    stc.prepare_database()
+
+    stc.cursor.execute(""" PRAGMA user_version """)
+    assert stc.cursor.fetchone()[0] == stc.schema_version
+    stc.cursor.execute(""" SELECT total_spent, right_amount, version FROM occasions """)
+    assert stc.cursor.fetchall() == [(1000, 500, 1)]
+    assert final_amounts(1) == [("A", 500, 500), ("B", 500, 500)]
+    stc.cursor.execute(""" SELECT amount, version FROM transactions """)
+    assert stc.cursor.fetchall() == [(500, 1)]
+    stc.cursor.execute(""" SELECT version, total_spent, num_people, num_transactions FROM settlements """)
+    assert stc.cursor.fetchall() == [(1, 1000, 2, 1)]
+    stc.cursor.execute(""" SELECT name FROM sqlite_master WHERE type = 'view' """)
+    assert stc.cursor.fetchall() == []
+    stc.connection.close()